@@ -29,13 +29,9 @@ import argparse
 import logging
 import sys
 from util.termcolor import colored
-from manifest_parser import ManifestParser
-from module_pool import ModulePool
-from env import Env
-import fetch as fetch_mod
-from action import (CheckCondition, CleanModules, FetchModules, GenerateFetchMakefile, ListFiles,
-                    ListModules, MergeCores, GenerateSimulationMakefile,
-                    GenerateSynthesisMakefile, GenerateRemoteSynthesisMakefile, GenerateSynthesisProject)
+
+# NOTE: the module pool, the environment, the actions and the tools are
+# imported lazily, so that every command only pays for what it uses.
 
 #from argument_parser import get_argument_parser
 
@@ -45,6 +41,11 @@ from action import (CheckCondition, CleanModules, FetchModules, GenerateFetchMak
 #    BUILD_ID = "unrecognized"
 
 
+# Commands that only read the module tree. They need neither the tool module
+# nor any information from the environment, so they take a fast path.
+_READ_ONLY_COMMANDS = ["list-mods", "list-files"]
+
+
 def main():
     """This is the main funcion, where HDLMake starts.
     Here, we make the next processes:
@@ -66,11 +67,6 @@ def main():
     global_mod.options = options
 
 
-    # global_mod_assigned!!!
-    env = Env(options)
-    global_mod.env = env
-
-
     numeric_level = getattr(logging, options.log.upper(), None)
     if not isinstance(numeric_level, int):
         sys.exit('Invalid log level: %s' % options.log)
@@ -78,27 +74,84 @@ def main():
     logging.basicConfig(format=colored("%(levelname)s", "yellow") + colored("\t%(filename)s:%(lineno)d: %(funcName)s()\t", "blue") + "%(message)s", level=numeric_level)
     logging.debug(str(options))
 
-    modules_pool = ModulePool()
-    modules_pool.new_module(parent=None,
-                            url=os.getcwd(),
-                            source=fetch_mod.LOCAL,
-                            fetchto=".",
-                            process_manifest=False)
+    # let a running server answer, if there is one for this directory
+    if options.command not in ["serve", "watch", "matrix", "regress", "manifest-help", "report"]:
+        from server import forward
+        status = forward(sys.argv[1:])
+        if status is not None:
+            sys.exit(status)
 
-    # Setting top_module as top module of design (ModulePool class)
-    if modules_pool.get_top_module().manifest is None:
-        logging.info("No manifest found. At least an empty one is needed")
-        logging.info("To see some help, type hdlmake --help")
-        sys.exit("Exiting")
+    # manifest-help doesn't even need the module tree
+    if options.command == "manifest-help":
+        from manifest_parser import ManifestParser
+        ManifestParser().print_help()
+        quit()
 
-    # Setting global variable (global_mod.py)
-    top_mod = modules_pool.get_top_module()
-    global_mod.top_module = top_mod
+    # the report only reads the timing log
+    if options.command == "report":
+        from util.timing import print_report
+        print_report(options.timing_log, options.top)
+        quit()
 
-    #global_mod.global_target = global_mod.top_module.target
-    global_mod.mod_pool = modules_pool
+    # global_mod_assigned!!!
+    from env import Env
+    env = Env(options)
+    global_mod.env = env
 
-    modules_pool.process_top_module_manifest()
+    modules_pool = _load_modules_pool()
+
+    if options.command == "serve":
+        from server import Server
+        server = Server(options=options,
+                        env=env,
+                        modules_pool=modules_pool,
+                        parse_options=lambda argv: _get_options(argparse.Namespace(argv=["hdlmake"] + argv), parser),
+                        load_pool=_load_modules_pool,
+                        run_command=_run_command,
+                        socket_path=options.socket)
+        server.serve_forever()
+        return
+
+    if options.command == "watch":
+        from server import watch
+        watch(options=options,
+              env=env,
+              modules_pool=modules_pool,
+              load_pool=_load_modules_pool,
+              get_actions=_get_actions,
+              run_actions=_run_actions)
+        return
+
+    if options.command == "matrix":
+        from matrix import run_matrix
+        sys.exit(run_matrix(options=options,
+                            env=env,
+                            modules_pool=modules_pool,
+                            get_actions=_get_actions,
+                            run_actions=_run_actions))
+
+    _run_command(options, env, modules_pool)
+
+
+def _run_command(options, env, modules_pool):
+    """Execute the command given in the options over the loaded modules"""
+    action = _get_actions(options, env, modules_pool)
+    _run_actions(action, modules_pool, options, env)
+
+
+def _get_actions(options, env, modules_pool):
+    """Return the actions implementing the command given in the options.
+    The tool module is loaded, if the command needs it."""
+    top_mod = modules_pool.get_top_module()
+
+    if options.command in _READ_ONLY_COMMANDS:
+        if options.command == "list-mods":
+            from action import ListModules
+            action = [ ListModules ]
+        elif options.command == "list-files":
+            from action import ListFiles
+            action = [ ListFiles ]
+        return action
 
     #
     # Load global tool object (global_mod.py)
@@ -130,7 +183,7 @@ def main():
 
 
     #env.top_module = modules_pool.get_top_module()
-    env.check_env(verbose=False)
+    # the environment is probed lazily, when an action asks for a setting
     #env.check_env_wrt_manifest(verbose=False)
 
 
@@ -147,10 +200,6 @@ def main():
         env.check_manifest(modules_pool.get_top_module().manifest, verbose=True)
         quit()
 
-    if options.command == "manifest-help":
-        ManifestParser().print_help()
-        quit()
-
     if options.command == "auto":
         logging.info("Running automatic flow.")
         if not top_mod.action:
@@ -162,12 +211,16 @@ def main():
                 logging.error("`sim_tool' manifest variable has to be specified. "
                               "Otherwise hdlmake doesn't know how to simulate the project")
                 quit()
+            from action import GenerateSimulationMakefile
             action = [ GenerateSimulationMakefile ]
         elif top_mod.action == "synthesis":
             if not top_mod.syn_tool:
                 logging.error("`syn_tool' manifest variable has to be specified. "
                               "Otherwise hdlmake doesn't know how to synthesize the project")
                 quit()
+            from action import GenerateSynthesisProject
+            from action import GenerateSynthesisMakefile
+            from action import GenerateRemoteSynthesisMakefile
             action = [
                 GenerateSynthesisProject,
                 GenerateSynthesisMakefile,
@@ -186,33 +239,79 @@ def main():
     #elif options.command == "make-remote":
     #    action = [ GenerateRemoteSynthesisMakefile ]
     elif options.command == "fetch":
+        from action import FetchModules
         action = [ FetchModules ]
     elif options.command == "clean":
+        from action import CleanModules
         action = [ CleanModules ]
-    elif options.command == "list-mods":
-        action = [ ListModules ]
-    elif options.command == "list-files":
-        action = [ ListFiles ]
     elif options.command == "merge-cores":
+        from action import MergeCores
         action = [ MergeCores ]
-    elif options.command == "ise-project":
-        action = [ GenerateSynthesisProject ]
-    elif options.command == "quartus-project":
-        action = [ GenerateSynthesisProject ]
-    elif options.command == "project":
+    elif options.command in ["ise-project", "quartus-project", "project"]:
+        from action import GenerateSynthesisProject
         action = [ GenerateSynthesisProject ]
+    elif options.command == "vendor-libs":
+        from action import CompileVendorLibraries
+        action = [ CompileVendorLibraries ]
+    elif options.command == "regress":
+        from action import RunRegression
+        action = [ RunRegression ]
 
+    return action
+
+
+def _load_modules_pool():
+    """Create the pool of modules, with the current directory as the top
+    module, and process the top manifest"""
+    from module_pool import ModulePool
+    import fetch as fetch_mod
+
+    modules_pool = ModulePool()
+    modules_pool.new_module(parent=None,
+                            url=os.getcwd(),
+                            source=fetch_mod.LOCAL,
+                            fetchto=".",
+                            process_manifest=False)
+
+    # Setting top_module as top module of design (ModulePool class)
+    if modules_pool.get_top_module().manifest is None:
+        logging.info("No manifest found. At least an empty one is needed")
+        logging.info("To see some help, type hdlmake --help")
+        sys.exit("Exiting")
+
+    # Setting global variable (global_mod.py)
+    top_mod = modules_pool.get_top_module()
+    global_mod.top_module = top_mod
+
+    #global_mod.global_target = global_mod.top_module.target
+    global_mod.mod_pool = modules_pool
+
+    modules_pool.process_top_module_manifest()
+    return modules_pool
+
+
+def _run_actions(action, modules_pool, options, env):
+    """Run the actions, return False if one of them failed"""
+    # the actions share the tool object, so that they write a single makefile
+    tool_object = None
+    if options.command not in _READ_ONLY_COMMANDS:
+        tool_object = global_mod.tool_module.ToolControls()
     try:
         for command in action:
             action_instance = command(modules_pool=modules_pool,
                                     options=options,
-                                    env=env)
+                                    env=env,
+                                    tool_object=tool_object)
             action_instance.run()
+        if tool_object is not None:
+            tool_object.close()
     except Exception as e:
         import traceback
         logging.error(e)
         print("Trace:")
         traceback.print_exc()
+        return False
+    return True
 
 
 def _get_parser():
@@ -248,26 +347,78 @@ def _get_parser():
     clean = subparsers.add_parser("clean", help="remove all modules fetched for direct and indirect children of this module")
     listmod = subparsers.add_parser("list-mods", help="List all modules together with their files")
     listmod.add_argument("--with-files", help="list modules together with their files", default=False, action="store_true", dest="withfiles")
+    listmod.add_argument("--format", help="output format (default: text)", dest="format", default="text",
+                         choices=["text", "json", "jsonl", "null-separated"])
     listfiles = subparsers.add_parser("list-files", help="List all files in a form of a space-separated string")
     listfiles.add_argument("--delimiter", help="set delimitier for the list of files", dest="delimiter", default=' ')
+    listfiles.add_argument("--format", help="output format (default: text)", dest="format", default="text",
+                           choices=["text", "json", "jsonl", "null-separated"])
+    listfiles.add_argument("--library", help="list only the files of this library (can be repeated)",
+                           dest="libraries", default=None, action="append")
+    listfiles.add_argument("--type", help="list only the files of this type: vhdl, verilog, sv, ucf... (can be repeated)",
+                           dest="types", default=None, action="append")
+    listfiles.add_argument("--module", help="list only the files of the module of this path or URL (can be repeated)",
+                           dest="modules", default=None, action="append")
+    listfiles.add_argument("--reachable", help="list only the files used by TOP, or by the top of the top manifest",
+                           dest="reachable", default=None, nargs="?", const="", metavar="TOP")
     merge_cores = subparsers.add_parser("merge-cores", help="Merges entire synthesizable content of an project into a pair of VHDL/Verilog files")
     merge_cores.add_argument("--dest", help="name for output merged file", dest="dest", default=None)
+    merge_cores.add_argument("--per-library", help="write one merged file per library and language",
+                             dest="per_library", default=False, action="store_true")
+    merge_cores.add_argument("-j", "--jobs", help="number of processes preprocessing the Verilog files (default: number of CPUs)",
+                             dest="jobs", default=None, type=int)
     ise_proj = subparsers.add_parser("ise-project", help="create/update an ise project including list of project")
     ise_proj.add_argument("--generate-project-vhd", help="generate project.vhd file with a meta package describing the project",
                           dest="generate_project_vhd", default=False, action="store_true")
     quartus_proj = subparsers.add_parser("quartus-project", help="create/update a quartus project including list of project")
     synthesis_proj = subparsers.add_parser("project", help="create/update a project for the appropriated tool")
-
-    condition_check = argparse.ArgumentParser()
-    condition_check.add_argument("--tool", dest="tool", required=True)
-    condition_check.add_argument("--reference", dest="reference", required=True)
-    condition_check.add_argument("--condition", dest="condition", required=True)
+    synthesis_proj.add_argument("--timeout", help="kill the tool when it runs for more than TIMEOUT seconds",
+                                dest="timeout", default=None, type=float)
+    report = subparsers.add_parser("report", help="summarize the compilation times logged by a makefile generated with --profile")
+    report.add_argument("--timing-log", help="timing log written by the makefile (default: hdlmake_timing.jsonl)",
+                        dest="timing_log", default="hdlmake_timing.jsonl")
+    report.add_argument("--top", help="number of targets listed by time (default: 20)", dest="top", default=20, type=int)
+    vendor_libs = subparsers.add_parser("vendor-libs", help="compile the vendor libraries of sim_vendor_libs into the shared cache")
+    vendor_libs.add_argument("--list", help="list the vendor libraries and their place in the cache", dest="list",
+                             default=False, action="store_true")
+    vendor_libs.add_argument("--rebuild", help="compile the vendor libraries again, even if they are in the cache",
+                             dest="rebuild", default=False, action="store_true")
+    matrix = subparsers.add_parser("matrix", help="run the automatic flow for every configuration of the matrix, parsing the sources once")
+    matrix.add_argument("--file", help="file setting the matrix variable, instead of the top manifest",
+                        dest="matrix_file", default=None)
+    matrix.add_argument("--output-dir", help="directory of the configuration directories (default: matrix)",
+                        dest="output_dir", default="matrix")
+    matrix.add_argument("-j", "--jobs", help="number of configurations run at the same time (default: number of CPUs)",
+                        dest="jobs", default=None, type=int)
+    regress = subparsers.add_parser("regress", help="run the tests of sim_tests in parallel and write a JUnit XML report")
+    regress.add_argument("-j", "--jobs", help="number of tests run at the same time (default: number of CPUs)",
+                         dest="jobs", default=None, type=int)
+    regress.add_argument("--test", help="run only this test (can be repeated)", dest="tests",
+                         default=None, action="append")
+    regress.add_argument("--output-dir", help="directory of the logs of the tests (default: regress)",
+                         dest="output_dir", default="regress")
+    regress.add_argument("--junit", help="JUnit XML report (default: regress.xml)",
+                         dest="junit", default="regress.xml")
+    regress.add_argument("--no-compile", help="run the tests without compiling the tops first",
+                         dest="no_compile", default=False, action="store_true")
+    watch = subparsers.add_parser("watch", help="run the automatic flow again every time a manifest or a source file changes")
+    serve = subparsers.add_parser("serve", help="keep the modules in memory and answer the hdlmake commands run in this directory")
+    serve.add_argument("--socket", help="path of the Unix socket to listen on (default: .hdlmake.sock, or $HDLMAKE_SERVER)",
+                       dest="socket", default=None)
 
     auto = subparsers.add_parser("auto", help="default action for hdlmake. Run when no args are given")
     auto.add_argument("--force", help="force hdlmake to generate the makefile, even if the specified tool is missing", default=False, action="store_true")
     auto.add_argument("--noprune", help="prevent hdlmake from pruning unneeded files", default=False, action="store_true")
     auto.add_argument("--generate-project-vhd", help="generate project.vhd file with a meta package describing the project",
                       dest="generate_project_vhd", default=False, action="store_true")
+    auto.add_argument("--backend", help="build system of the simulation (default: make)",
+                      dest="backend", default=argparse.SUPPRESS, choices=["make", "ninja"])
+    auto.add_argument("--schedule", help="order the simulation compilations for parallel make runs",
+                      dest="schedule", default=argparse.SUPPRESS, action="store_true")
+    auto.add_argument("--batch-compile", help="compile the files of a library and a dependency level together",
+                      dest="batch_compile", default=argparse.SUPPRESS, action="store_true")
+    auto.add_argument("--profile", help="log the time taken by every compilation of the simulation",
+                      dest="profile", default=argparse.SUPPRESS, action="store_true")
 
     parser.add_argument("--py", dest="arbitrary_code",
                         default="", help="add arbitrary code when evaluation all manifests")
@@ -277,6 +428,14 @@ def _get_parser():
     parser.add_argument("--generate-project-vhd", help="generate project.vhd file with a meta package describing the project",
                           dest="generate_project_vhd", default=False, action="store_true")
     parser.add_argument("--force", help="force hdlmake to generate the makefile, even if the specified tool is missing", default=False, action="store_true")
+    parser.add_argument("--backend", help="build system of the simulation (default: make)",
+                        dest="backend", default="make", choices=["make", "ninja"])
+    parser.add_argument("--schedule", help="order the simulation compilations for parallel make runs",
+                        dest="schedule", default=False, action="store_true")
+    parser.add_argument("--batch-compile", help="compile the files of a library and a dependency level together",
+                        dest="batch_compile", default=False, action="store_true")
+    parser.add_argument("--profile", help="log the time taken by every compilation of the simulation",
+                        dest="profile", default=False, action="store_true")
     parser.add_argument("--allow-unknown", dest="allow_unknown",
                         default=False, help="allow unknown option insertions in the child Manifests", action="store_true")
 
@@ -285,21 +444,31 @@ def _get_parser():
 
 
 
+def _get_condition_check_parser():
+    condition_check = argparse.ArgumentParser()
+    condition_check.add_argument("--tool", dest="tool", required=True)
+    condition_check.add_argument("--reference", dest="reference", required=True)
+    condition_check.add_argument("--condition", dest="condition", required=True)
+    return condition_check
+
+
 def _get_options(sys,parser):
     options = None
     if len(sys.argv[1:]) == 0:
             options = parser.parse_args(['auto'])
 
+    elif sys.argv[1] == "_conditioncheck":
+        # run by the makefiles with its own arguments
+        from env import Env
+        from action import CheckCondition
+        options = _get_condition_check_parser().parse_args(sys.argv[2:])
+        env = Env(options)
+        CheckCondition(modules_pool=None,
+                       options=options,
+                       env=env).run()
+        quit()
     elif len(sys.argv[1:]) == 1:
-        if sys.argv[1] == "_conditioncheck":
-            options = condition_check.parse_args(sys.argv[2:])
-            env = Env(options)
-            env.check_env()
-            CheckCondition(modules_pool=None,
-                           options=options,
-                           env=env).run()
-            quit()
-        elif sys.argv[1] == "--help" or sys.argv[1] == "-h":
+        if sys.argv[1] == "--help" or sys.argv[1] == "-h":
             options = parser.parse_args(sys.argv[1:])
         elif sys.argv[1].startswith('-'):
             options = parser.parse_args(["auto"]+sys.argv[1:])
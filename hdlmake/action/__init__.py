@@ -33,3 +33,5 @@ from synthesis_project import GenerateSynthesisProject
 from synthesis import GenerateSynthesisMakefile
 from remote_synthesis import GenerateRemoteSynthesisMakefile
 from simulation import GenerateSimulationMakefile
+from vendor_libs import CompileVendorLibraries
+from regress import RunRegression
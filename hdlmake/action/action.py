@@ -21,14 +21,16 @@
 
 import sys
 import logging
+import global_mod
 from makefile_writer import MakefileWriter
 
 
 class Action(object):
-    def __init__(self, modules_pool, options, env):
+    def __init__(self, modules_pool, options, env, tool_object=None):
         self.modules_pool = modules_pool
         self.options = options
         self.env = env
+        self._tool_object = tool_object
 
         self._check_manifest()
         self._check_env()
@@ -38,6 +40,14 @@ class Action(object):
     def top_module(self):
         return self.modules_pool.get_top_module()
 
+    @property
+    def tool_object(self):
+        """The tool controls, shared by the actions of a command so that
+        they write a single makefile"""
+        if self._tool_object is None:
+            self._tool_object = global_mod.tool_module.ToolControls()
+        return self._tool_object
+
     def _check_manifest(self):
         pass
 
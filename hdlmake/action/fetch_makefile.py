@@ -20,7 +20,7 @@
 # along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
 
 from action import Action
-import global_mod
+from makefile_writer import MakefileWriter
 import logging
 
 
@@ -34,5 +34,7 @@ class GenerateFetchMakefile(Action):
             quit()
 
         self._check_all_fetched_or_quit()
-        global_mod.makefile_writer.generate_fetch_makefile(pool)
+        makefile_writer = MakefileWriter()
+        makefile_writer.generate_fetch_makefile(pool)
+        makefile_writer.close()
         logging.info("Makefile for fetching modules generated.")
\ No newline at end of file
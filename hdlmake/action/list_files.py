@@ -19,14 +19,149 @@
 # You should have received a copy of the GNU General Public License
 # along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
 
+"""List the files of the modules.
+
+The files are written as they are found, one module after the other, as
+text, as a JSON array, as JSON lines or as paths followed by a null
+character (for xargs -0). They can be filtered by library, by type (the
+name of their class without File: vhdl, verilog, sv, ucf...), by module and
+by reachability from a top, the files the top uses directly or not.
+"""
+
+import sys
+import json
+import logging
+import importlib
+
 from action import Action
+from util import path as path_mod
+
+FORMATS = ["text", "json", "jsonl", "null-separated"]
+
+
+class RecordWriter(object):
+    """Write records to a stream as soon as they are given: as a JSON
+    array, one JSON object per line or the value of key followed by a null
+    character"""
+
+    def __init__(self, output_format, key, stream=None):
+        self.output_format = output_format
+        self.key = key
+        self.stream = stream or sys.stdout
+        self._count = 0
+        if output_format == "json":
+            self.stream.write("[")
+
+    def write(self, record):
+        if self.output_format == "json":
+            self.stream.write((",\n" if self._count else "\n") + json.dumps(record, sort_keys=True))
+        elif self.output_format == "jsonl":
+            self.stream.write(json.dumps(record, sort_keys=True) + "\n")
+        else:
+            self.stream.write(record[self.key] + "\0")
+        self._count += 1
+
+    def close(self):
+        if self.output_format == "json":
+            self.stream.write("\n]\n")
+        self.stream.flush()
+
+
+def get_file_type(source_file):
+    """Return the type of the file: vhdl, verilog, sv, ucf..."""
+    name = source_file.__class__.__name__
+    if name.endswith("File"):
+        name = name[:-len("File")]
+    return name.lower()
 
 
 class ListFiles(Action):
     def run(self):
-        files_str = []
+        reachable = None
+        if self.options.reachable is not None:
+            reachable = self._get_reachable_files(self.options.reachable)
+
+        if self.options.format == "text":
+            writer = None
+        else:
+            writer = RecordWriter(self.options.format, "path")
+        first = True
         for m in self.modules_pool:
-            if not m.isfetched:
+            if not m.isfetched or not self._is_selected_module(m):
+                continue
+            files = [f for f in m.files if self._is_selected_file(f, reachable)]
+            if writer is not None:
+                for f in files:
+                    writer.write({"path": f.path,
+                                  "type": get_file_type(f),
+                                  "library": getattr(f, "library", None),
+                                  "module": path_mod.relpath(m.path)})
                 continue
-            files_str.append(self.options.delimiter.join([f.path for f in m.files]))
-        print(" ".join(files_str))
+            if not first:
+                sys.stdout.write(" ")
+            sys.stdout.write(self.options.delimiter.join([f.path for f in files]))
+            first = False
+        if writer is not None:
+            writer.close()
+        else:
+            sys.stdout.write("\n")
+
+    def _is_selected_module(self, module):
+        """Tell if the module is one of those given with --module, by its
+        path or its URL"""
+        if not self.options.modules:
+            return True
+        names = [path_mod.relpath(module.path), module.path, module.url]
+        return any(name.rstrip('/') in names for name in self.options.modules)
+
+    def _is_selected_file(self, source_file, reachable):
+        libraries = [lib.lower() for lib in self.options.libraries or []]
+        if libraries and getattr(source_file, "library", "").lower() not in libraries:
+            return False
+        types = [file_type.lower() for file_type in self.options.types or []]
+        if types and get_file_type(source_file) not in types:
+            return False
+        if reachable is not None and source_file not in reachable:
+            return False
+        return True
+
+    def _get_tool_objects(self):
+        """Return the tool of the top manifest, so that its libraries are
+        not reported as missing when the dependencies are solved"""
+        top_module = self.top_module
+        tool_name = top_module.syn_tool if top_module.action == "synthesis" else top_module.sim_tool
+        if not tool_name:
+            return []
+        try:
+            return [importlib.import_module("tools.%s.%s" % (tool_name, tool_name)).ToolControls()]
+        except ImportError as e:
+            logging.warning("Can't load the tool %s: %s" % (tool_name, e))
+            return []
+
+    def _get_reachable_files(self, top):
+        """Return the set of the files used by the top, by the top of the
+        top manifest when top is empty"""
+        from dep_file import DepFile
+        from tools.common.sim_tops import get_top_files, provides_top
+
+        if top:
+            tops = [top]
+        elif self.top_module.action == "synthesis" and self.top_module.syn_top:
+            tops = [self.top_module.syn_top]
+        elif isinstance(self.top_module.top_module, basestring):
+            tops = [self.top_module.top_module]
+        else:
+            tops = list(self.top_module.top_module or [])
+        if not tops:
+            logging.error("No top: give it to --reachable or set top_module in the top manifest.")
+            sys.exit("Exiting")
+
+        self.modules_pool.solve_dependencies(self._get_tool_objects())
+        fileset = self.modules_pool.build_file_set().filter(DepFile)
+        reachable = set()
+        for name in tops:
+            if not any(provides_top(f, name) for f in fileset):
+                logging.error("No file provides the top %s" % name)
+                sys.exit("Exiting")
+            reachable.update(get_top_files(fileset, name))
+        return reachable
@@ -21,6 +21,7 @@
 
 from __future__ import absolute_import
 from action.action import Action
+from action.list_files import RecordWriter, get_file_type
 from util import path
 import fetch
 
@@ -38,7 +39,9 @@ def _convert_to_source_name(source_code):
 
 class ListModules(Action):
     def run(self):
-        if self.options.withfiles:
+        if self.options.format != "text":
+            self._write_records()
+        elif self.options.withfiles:
             for m in self.modules_pool:
                 if not m.isfetched:
                     print("#!UNFETCHED")
@@ -64,3 +67,18 @@ class ListModules(Action):
             for m in self.modules_pool:
                 print("%s\t%s" % (path.relpath(m.path), _convert_to_source_name(m.source)))
 
+    def _write_records(self):
+        """Write a record per module, with its files if asked"""
+        writer = RecordWriter(self.options.format, "path")
+        for m in self.modules_pool:
+            record = {"path": path.relpath(m.path),
+                      "source": _convert_to_source_name(m.source),
+                      "url": m.url,
+                      "fetched": m.isfetched,
+                      "parent": m.parent.url if m.parent else None}
+            if self.options.withfiles and m.isfetched:
+                record["files"] = [{"path": f.path,
+                                    "type": get_file_type(f),
+                                    "library": getattr(f, "library", None)} for f in m.files]
+            writer.write(record)
+        writer.close()
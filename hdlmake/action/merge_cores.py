@@ -19,15 +19,117 @@
 # You should have received a copy of the GNU General Public License
 # along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
 
+"""Merge the sources of a design into one file per language.
+
+The files are written in the order of their dependencies, so that the merged
+file can be compiled from top to bottom, or into one file per library and
+language with --per-library. The Verilog files are preprocessed, by a pool
+of processes for large designs, each one reading a header once for all the
+files it preprocesses. The VHDL files are copied block by block.
+"""
+
 from __future__ import print_function
 import logging
 from action import Action
-from srcfile import VerilogFile, VHDLFile, NGCFile
+from srcfile import VerilogFile, VHDLFile, NGCFile, SourceFileSet
 from vlog_parser import VerilogPreprocessor
 import os
 import os.path
 import time
 import sys
+import shutil
+import itertools
+import multiprocessing
+
+VHDL_HEADER = """
+
+
+
+------------------------------ WARNING -------------------------------
+-- This code has been generated by hdlmake --merge-cores option     --
+-- It is provided for your convenience, to spare you from adding    --
+-- lots of individual source files to ISE/Modelsim/Quartus projects --
+-- mainly for Windows users. Please DO NOT MODIFY this file. If you --
+-- need to change something inside, edit the original source file   --
+-- and re-genrate the merged version!                               --
+----------------------------------------------------------------------
+
+
+
+
+"""
+
+VERILOG_HEADER = """
+
+
+
+////////////////////////////// WARNING ///////////////////////////////
+// This code has been generated by hdlmake --merge-cores option     //
+// It is provided for your convenience, to spare you from adding    //
+// lots of individual source files to ISE/Modelsim/Quartus projects //
+// mainly for Windows users. Please DO NOT MODIFY this file. If you //
+// need to change something inside, edit the original source file   //
+// and re-genrate the merged version!                               //
+//////////////////////////////////////////////////////////////////////
+
+
+
+
+"""
+
+# size of the blocks copied from the sources to the merged files
+CHUNK_SIZE = 64 * 1024
+
+# the Verilog files to preprocess, inherited by the workers of the pool
+_vlog_files = []
+# the headers read by the preprocessors of a process
+_include_cache = {}
+
+
+def _preprocess(index):
+    """Preprocess the Verilog file of the given index in _vlog_files"""
+    vlog = _vlog_files[index]
+    vpp = VerilogPreprocessor(include_cache=_include_cache)
+    for include_path in vlog.include_dirs:
+        vpp.add_path(include_path)
+    vpp.add_path(vlog.dirname)
+    try:
+        return vpp.preprocess(vlog)
+    except SystemExit:
+        # the error is logged, the pool must get an exception to report
+        raise RuntimeError("Can't preprocess %s" % vlog.path)
+
+
+class _MergedFiles(object):
+    """The merged files of a language: one for the whole design, or one per
+    library"""
+
+    def __init__(self, base, extension, header, per_library):
+        self.base = base
+        self.extension = extension
+        self.header = header
+        self.per_library = per_library
+        self.paths = {}
+        self._files = {}
+        if not per_library:
+            self.get(None)
+
+    def get(self, library):
+        """Return the merged file of the library, opened the first time"""
+        key = library if self.per_library else None
+        if key not in self._files:
+            if key is None:
+                path = "%s.%s" % (self.base, self.extension)
+            else:
+                path = "%s_%s.%s" % (self.base, key, self.extension)
+            self._files[key] = open(path, "w")
+            self._files[key].write(self.header)
+            self.paths[key] = path
+        return self._files[key]
+
+    def close(self):
+        for merged_file in self._files.itervalues():
+            merged_file.close()
 
 
 class MergeCores(Action):
@@ -40,66 +142,78 @@ class MergeCores(Action):
             sys.exit("Exiting")
 
     def run(self):
+        from tools.common.sim_schedule import get_compile_order, get_library_waves
+
         pool = self.modules_pool
         self._check_all_fetched_or_quit()
 
-        logging.info("Merging all cores into one source file per language.")
-        flist = pool.build_global_file_set()
-#        if not os.path.exists(self.options.merge_cores):
- #           os.makedirs(self.options.merge_cores)
+        per_library = self.options.per_library
+        if per_library:
+            logging.info("Merging all cores into one source file per library and language.")
+        else:
+            logging.info("Merging all cores into one source file per language.")
+        fileset = pool.build_file_set()
+        pool.solve_dependencies()
+        sources = SourceFileSet()
+        sources.add(fileset.filter(VHDLFile))
+        sources.add(fileset.filter(VerilogFile))
+        order = get_compile_order(sources)
         base = self.options.dest
 
-        f_out = open(base+".vhd", "w")
-        f_out.write("\n\n\n\n")
-        f_out.write("------------------------------ WARNING -------------------------------\n")
-        f_out.write("-- This code has been generated by hdlmake --merge-cores option     --\n")
-        f_out.write("-- It is provided for your convenience, to spare you from adding    --\n")
-        f_out.write("-- lots of individual source files to ISE/Modelsim/Quartus projects --\n")
-        f_out.write("-- mainly for Windows users. Please DO NOT MODIFY this file. If you --\n")
-        f_out.write("-- need to change something inside, edit the original source file   --\n")
-        f_out.write("-- and re-genrate the merged version!                               --\n")
-        f_out.write("----------------------------------------------------------------------\n")
-        f_out.write("\n\n\n\n")
-
-        for vhdl in flist.filter(VHDLFile):
-            f_out.write("\n\n---  File: %s ----\n" % vhdl.rel_path())
-            f_out.write("---  Source: %s\n" % vhdl.module.url)
-            if vhdl.module.revision:
-                f_out.write("---  Revision: %s\n" % vhdl.module.revision)
-            f_out.write("---  Last modified: %s\n" % time.ctime(os.path.getmtime(vhdl.path)))
-            f_out.write(open(vhdl.rel_path(), "r").read()+"\n\n")
-                #print("VHDL: %s" % vhdl.rel_path())
-        f_out.close()
-
-        f_out = open(base+".v", "w")
-
-        f_out.write("\n\n\n\n")
-        f_out.write("////////////////////////////// WARNING ///////////////////////////////\n")
-        f_out.write("// This code has been generated by hdlmake --merge-cores option     //\n")
-        f_out.write("// It is provided for your convenience, to spare you from adding    //\n")
-        f_out.write("// lots of individual source files to ISE/Modelsim/Quartus projects //\n")
-        f_out.write("// mainly for Windows users. Please DO NOT MODIFY this file. If you //\n")
-        f_out.write("// need to change something inside, edit the original source file   //\n")
-        f_out.write("// and re-genrate the merged version!                               //\n")
-        f_out.write("//////////////////////////////////////////////////////////////////////\n")
-        f_out.write("\n\n\n\n")
-
-        for vlog in flist.filter(VerilogFile):
-            f_out.write("\n\n//  File: %s\n" % vlog.rel_path())
-            f_out.write("//  Source: %s\n" % vlog.module.url)
-            if vlog.module.revision:
-                f_out.write("//  Revision: %s\n" % vlog.module.revision)
-            f_out.write("//  Last modified: %s\n" % time.ctime(os.path.getmtime(vlog.path)))
-            vpp = VerilogPreprocessor()
-            for include_path in vlog.include_dirs:
-                vpp.add_path(include_path)
-            vpp.add_path(vlog.dirname)
-            f_out.write(vpp.preprocess(vlog.rel_path()))
-        f_out.close()
-
-        for ngc in flist.filter(NGCFile):
-            import shutil
+        vhdl_out = _MergedFiles(base, "vhd", VHDL_HEADER, per_library)
+        try:
+            for vhdl in [f for f in order if isinstance(f, VHDLFile)]:
+                f_out = vhdl_out.get(vhdl.library)
+                with open(vhdl.path, "r") as source:
+                    f_out.write("\n\n---  File: %s ----\n" % vhdl.rel_path())
+                    f_out.write("---  Source: %s\n" % vhdl.module.url)
+                    if vhdl.module.revision:
+                        f_out.write("---  Revision: %s\n" % vhdl.module.revision)
+                    f_out.write("---  Last modified: %s\n" % time.ctime(os.fstat(source.fileno()).st_mtime))
+                    shutil.copyfileobj(source, f_out, CHUNK_SIZE)
+                f_out.write("\n\n")
+        finally:
+            vhdl_out.close()
+
+        vlog_out = _MergedFiles(base, "v", VERILOG_HEADER, per_library)
+        try:
+            vlog_files = [f for f in order if isinstance(f, VerilogFile)]
+            for vlog, text in itertools.izip(vlog_files, self._preprocess_all(vlog_files)):
+                f_out = vlog_out.get(vlog.library)
+                f_out.write("\n\n//  File: %s\n" % vlog.rel_path())
+                f_out.write("//  Source: %s\n" % vlog.module.url)
+                if vlog.module.revision:
+                    f_out.write("//  Revision: %s\n" % vlog.module.revision)
+                f_out.write("//  Last modified: %s\n" % time.ctime(os.path.getmtime(vlog.path)))
+                f_out.write(text)
+        finally:
+            vlog_out.close()
+
+        for ngc in fileset.filter(NGCFile):
             logging.info("copying NGC file: %s" % ngc.rel_path())
             shutil.copy(ngc.rel_path(), os.getcwd())
 
-        logging.info("Cores merged.")
\ No newline at end of file
+        if per_library:
+            # the libraries of a wave only use the libraries of the previous ones
+            for index, wave in enumerate(get_library_waves(sources)):
+                paths = [merged.paths[lib] for lib in wave for merged in [vhdl_out, vlog_out] if lib in merged.paths]
+                logging.info("Merged files of wave %d: %s" % (index + 1, ' '.join(paths)))
+        logging.info("Cores merged.")
+
+    def _preprocess_all(self, vlog_files):
+        """Yield the preprocessed Verilog files, in order. They are
+        preprocessed by a pool of processes when there are several jobs."""
+        global _vlog_files
+        _vlog_files = vlog_files
+        jobs = self.options.jobs or multiprocessing.cpu_count()
+        if jobs == 1 or len(vlog_files) < 2:
+            for index in range(len(vlog_files)):
+                yield _preprocess(index)
+            return
+        workers = multiprocessing.Pool(min(jobs, len(vlog_files)))
+        try:
+            for text in workers.imap(_preprocess, range(len(vlog_files))):
+                yield text
+        finally:
+            workers.terminate()
+            workers.join()
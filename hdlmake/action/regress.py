@@ -0,0 +1,335 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run the tests of a simulation in parallel.
+
+The tests are listed in the sim_tests variable of the top manifest, each one
+a dictionary with the top it simulates and optionally its name, plusargs,
+generics, seeds, a timeout, a pass_pattern and a fail_pattern. A test with
+several seeds is run once per seed.
+
+The tops are compiled and elaborated by the elab_<top> targets of the
+simulation makefile (see tools.common.sim_tops), so the tests use the
+libraries it compiles. The tests are then run at most -j at a time, each one
+writing its log in the output directory. A test fails when the simulator
+exits with an error, runs for more than its timeout, writes a line matching
+its fail pattern or never writes its pass pattern. The results are written
+as a JUnit XML report.
+"""
+
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from xml.etree import ElementTree
+
+from action import Action
+from dep_file import DepFile
+from util import process
+
+TEST_KEYS = ["name", "top", "plusargs", "generics", "seeds", "timeout", "pass_pattern", "fail_pattern"]
+
+# errors reported by the simulators when no fail_pattern is given
+DEFAULT_FAIL_PATTERN = (r"^(# )?\*\* (Error|Fatal)"     # vsim
+                        r"|\(assertion (error|failure)\)"  # ghdl
+                        r"|^(ERROR|FATAL)\b"             # $error and $fatal of iverilog and isim
+                        r"|\bTEST FAILED\b")
+
+# lines of the log of a failed test copied into the report
+LOG_TAIL = 50
+
+
+class Test(object):
+    """A run of a top, with its arguments and its result"""
+
+    def __init__(self, name, top, plusargs, generics, seed, timeout, pass_pattern, fail_pattern):
+        self.name = name
+        self.top = top
+        self.plusargs = plusargs
+        self.generics = generics
+        self.seed = seed
+        self.timeout = timeout
+        self.pass_pattern = pass_pattern
+        self.fail_pattern = fail_pattern
+        self.command = None
+        self.log_path = None
+        # None when the test passed, else ("failure" or "error", message)
+        self.failure = None
+        self.duration = 0.0
+
+    @property
+    def run_name(self):
+        """The name of the run: the name of the test, and its seed"""
+        if self.seed is None:
+            return self.name
+        return "%s_seed%s" % (self.name, self.seed)
+
+    def __str__(self):
+        return self.run_name
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def get_tests(top_module, tops, tool_object):
+    """Return the tests of the sim_tests variable, one per seed. tops are
+    the tops of the simulation, the only ones a test can run. The seeds are
+    rejected when the tool has neither a seed option nor plusargs."""
+    seeds_supported = (getattr(tool_object, "seed_option", None) is not None or
+                       getattr(tool_object, "plusarg_option", None) is not None)
+    tests = []
+    for index, settings in enumerate(top_module.sim_tests):
+        if not isinstance(settings, dict):
+            raise ValueError("Test %d of sim_tests is not a dictionary" % index)
+        unknown = [key for key in settings if key not in TEST_KEYS]
+        if unknown:
+            raise ValueError("Unrecognized keys in test %d of sim_tests: %s" % (index, ', '.join(sorted(unknown))))
+        top = settings.get("top")
+        if top is None and len(tops) == 1:
+            top = tops[0]
+        if top not in tops:
+            raise ValueError("The top of test %d of sim_tests must be one of the tops of top_module: %s" %
+                             (index, ', '.join(tops)))
+        name = settings.get("name", top)
+        generics = settings.get("generics", {})
+        if not isinstance(generics, dict):
+            raise ValueError("The generics of test %s must be a dictionary" % name)
+        patterns = []
+        for key in ["pass_pattern", "fail_pattern"]:
+            try:
+                patterns.append(re.compile(settings[key], re.MULTILINE) if settings.get(key) else None)
+            except re.error as e:
+                raise ValueError("Wrong %s of test %s: %s" % (key, name, e))
+        pass_pattern, fail_pattern = patterns
+        if fail_pattern is None:
+            fail_pattern = re.compile(DEFAULT_FAIL_PATTERN, re.MULTILINE)
+        seeds = _as_list(settings.get("seeds")) or [None]
+        if seeds != [None] and not seeds_supported:
+            raise ValueError("Seeds are not supported for %s, remove them from test %s" %
+                             (tool_object.get_keys()['name'], name))
+        for seed in seeds:
+            tests.append(Test(name,
+                              top,
+                              _as_list(settings.get("plusargs")),
+                              generics,
+                              seed,
+                              settings.get("timeout"),
+                              pass_pattern,
+                              fail_pattern))
+    names = [test.run_name for test in tests]
+    for name in sorted(set(names)):
+        if names.count(name) > 1:
+            raise ValueError("Several tests of sim_tests are named %s, give them a name" % name)
+    return tests
+
+
+def read_make_variables(path):
+    """Return the variables set on a single line of the makefile, as
+    name := value or name = value"""
+    variables = {}
+    assignment = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)\s*:?=\s*(.*)$")
+    with open(path, "r") as makefile:
+        for line in makefile:
+            match = assignment.match(line.rstrip("\n"))
+            if match is not None and "\\" not in match.group(2):
+                variables[match.group(1)] = match.group(2).strip()
+    return variables
+
+
+def expand_make_variables(text, variables, depth=0):
+    """Expand the make variables used in text, from the variables of the
+    makefile or from the environment, like make does"""
+    def expand(match):
+        name = match.group(1)
+        if name in variables:
+            return expand_make_variables(variables[name], variables, depth + 1) if depth < 10 else ""
+        return os.environ.get(name, "")
+    return re.sub(r"\$\((\w+)\)", expand, text)
+
+
+def check_log(test):
+    """Return the reason the log shows the test failed, None if it passed"""
+    with open(test.log_path, "r") as log_file:
+        log = log_file.read()
+    match = test.fail_pattern.search(log)
+    if match is not None:
+        return "the log matches the fail pattern: " + log[match.start():].split('\n', 1)[0].strip()
+    if test.pass_pattern is not None and test.pass_pattern.search(log) is None:
+        return "the log doesn't match the pass pattern " + test.pass_pattern.pattern
+    return None
+
+
+def _read_log_tail(log_path):
+    try:
+        with open(log_path, "r") as log_file:
+            return ''.join(log_file.readlines()[-LOG_TAIL:])
+    except (IOError, OSError):
+        return ""
+
+
+def write_junit(tests, path, duration):
+    """Write the results of the tests as a JUnit XML report"""
+    failures = len([test for test in tests if test.failure and test.failure[0] == "failure"])
+    errors = len([test for test in tests if test.failure and test.failure[0] == "error"])
+    suite = ElementTree.Element("testsuite", name="hdlmake.regress", tests=str(len(tests)),
+                                failures=str(failures), errors=str(errors), time="%.3f" % duration,
+                                timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    for test in tests:
+        case = ElementTree.SubElement(suite, "testcase", classname=test.top, name=test.run_name,
+                                      time="%.3f" % test.duration)
+        if test.failure:
+            kind, message = test.failure
+            element = ElementTree.SubElement(case, kind, message=message)
+            element.text = _read_log_tail(test.log_path)
+        if test.log_path:
+            ElementTree.SubElement(case, "system-out").text = "log: " + test.log_path
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    ElementTree.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+class RunRegression(Action):
+    """Run the tests of sim_tests in parallel and report their results"""
+
+    def _check_manifest(self):
+        if not self.top_module.sim_tool:
+            logging.error("sim_tool variable must be set in the top manifest.")
+            sys.exit("Exiting")
+        if not self.top_module.sim_tests:
+            logging.error("No test: list them in the sim_tests variable of the top manifest.")
+            sys.exit("Exiting")
+
+    def run(self):
+        from tools.common.sim_tops import get_top_modules, has_multiple_tops
+
+        self._check_all_fetched_or_quit()
+        tool_object = self.tool_object
+        name = tool_object.get_keys()['name']
+        if not hasattr(tool_object, "get_run_command"):
+            logging.error("Regressions are not supported for " + name + ".")
+            sys.exit("Exiting")
+        if not has_multiple_tops(self.top_module):
+            logging.error("The tests are run from the elab_<top> targets of the makefile: "
+                          "list the tops in top_module, e.g. top_module = [\"%s\"]" % self.top_module.top_module)
+            sys.exit("Exiting")
+        if not os.path.exists("Makefile"):
+            logging.error("No simulation makefile, generate it with hdlmake first.")
+            sys.exit("Exiting")
+        try:
+            tests = get_tests(self.top_module, get_top_modules(self.top_module), tool_object)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit("Exiting")
+        if self.options.tests:
+            tests = [test for test in tests
+                     if test.name in self.options.tests or test.run_name in self.options.tests]
+            if not tests:
+                logging.error("No test named " + ', '.join(self.options.tests))
+                sys.exit("Exiting")
+
+        if not self.options.no_compile:
+            tops = sorted(set(test.top for test in tests))
+            logging.info("Compiling %s" % ', '.join(tops))
+            result = process.run("make " + ' '.join("elab_" + top for top in tops))
+            if not result.ok:
+                logging.error("Can't compile the tops: " + str(result))
+                sys.exit(1)
+
+        fileset = self.modules_pool.build_file_set().filter(DepFile)
+        self.modules_pool.solve_dependencies()
+        variables = read_make_variables("Makefile")
+        output_dir = self.options.output_dir
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        for test in tests:
+            stem = os.path.join(output_dir, test.run_name)
+            command = tool_object.get_run_command(fileset, test.top, name=stem)
+            test.command = ' '.join([expand_make_variables(command, variables)] + self._get_test_args(test))
+            test.log_path = stem + ".log"
+
+        jobs = self.options.jobs or multiprocessing.cpu_count()
+        logging.info("Running %d tests, %d at a time" % (len(tests), jobs))
+        start = time.time()
+        workers = ThreadPool(jobs)
+        try:
+            for test in workers.imap_unordered(self._run_test, tests):
+                if test.failure is None:
+                    logging.info("PASS %s (%.1f s)" % (test, test.duration))
+                else:
+                    logging.error("FAIL %s: %s, see %s" % (test, test.failure[1], test.log_path))
+        finally:
+            workers.close()
+        write_junit(tests, self.options.junit, time.time() - start)
+
+        failed = [test for test in tests if test.failure is not None]
+        logging.info("%d of %d tests passed, report written to %s" % (len(tests) - len(failed), len(tests),
+                                                                     self.options.junit))
+        if failed:
+            sys.exit(1)
+
+    def _get_test_args(self, test):
+        """Return the simulator options of the plusargs, generics and seed
+        of the test, as given by the templates of the tool controls"""
+        tool_object = self.tool_object
+        name = tool_object.get_keys()['name']
+        plusarg_option = getattr(tool_object, "plusarg_option", None)
+        generic_option = getattr(tool_object, "generic_option", None)
+        seed_option = getattr(tool_object, "seed_option", None)
+        plusargs = list(test.plusargs)
+        args = []
+        if test.seed is not None:
+            if seed_option is not None:
+                args.append(seed_option % test.seed)
+            else:
+                # read by the testbench with $value$plusargs("seed=%d", ...)
+                plusargs.append("seed=%s" % test.seed)
+        if plusargs:
+            if plusarg_option is not None:
+                args.extend(plusarg_option % plusarg.lstrip('+') for plusarg in plusargs)
+            else:
+                logging.warning("Plusargs are not supported for " + name + ", ignored for " + test.run_name + ".")
+        if test.generics:
+            if generic_option is not None:
+                args.extend(generic_option % (generic, value) for generic, value in sorted(test.generics.iteritems()))
+            else:
+                logging.warning("Generics are not supported for " + name + ", ignored for " + test.run_name + ".")
+        return args
+
+    def _run_test(self, test):
+        result = process.run(test.command, log_path=test.log_path, timeout=test.timeout, echo=False)
+        test.duration = result.duration
+        if result.timed_out:
+            test.failure = ("error", "timed out after %s s" % test.timeout)
+        elif result.returncode != 0:
+            test.failure = ("failure", "exit status %d" % result.returncode)
+        else:
+            reason = check_log(test)
+            if reason is not None:
+                test.failure = ("failure", reason)
+        return test
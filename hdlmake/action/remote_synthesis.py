@@ -42,10 +42,17 @@ class GenerateRemoteSynthesisMakefile(Action):
             sys.exit("Exiting")
 
 
+    def _check_env(self):
+        # probing the connection takes up to a few seconds, so it's only done here
+        if self.env["rsynth_user"] and self.env["rsynth_server"] and not self.env["rsynth_can_connect"]:
+            logging.warning("Can't make a passwordless connection to the remote machine: %s@%s"
+                            % (self.env["rsynth_user"], self.env["rsynth_server"]))
+
+
     def run(self):
         self._check_all_fetched_or_quit()
         self._check_manifest()
-        tool_object = global_mod.tool_module.ToolControls()     
+        tool_object = self.tool_object
         self._generate_remote_synthesis_makefile(tool_object)
 
 
@@ -32,6 +32,8 @@ import importlib
 
 
 class GenerateSimulationMakefile(Action):
+    # simulators accepting a list of names in top_module
+    MULTIPLE_TOPS_TOOLS = ["iverilog", "modelsim", "riviera", "ghdl", "isim"]
 
     def _check_manifest(self):
         if not self.modules_pool.get_top_module().top_module:
@@ -40,18 +42,26 @@ class GenerateSimulationMakefile(Action):
         if not self.modules_pool.get_top_module().sim_tool:
             logging.error("sim_tool variable must be set in the top manifest.")
             sys.exit("Exiting")
+        top_module = self.modules_pool.get_top_module()
+        if (not isinstance(top_module.top_module, basestring) and
+                top_module.sim_tool not in self.MULTIPLE_TOPS_TOOLS):
+            logging.error("A list of top modules is only supported by: " + ', '.join(self.MULTIPLE_TOPS_TOOLS))
+            sys.exit("Exiting")
 
 
     def run(self):
         self._check_all_fetched_or_quit()
         self._check_manifest()
-        tool_object = global_mod.tool_module.ToolControls()
-        self._generate_simulation_makefile(tool_object)
-        logging.info("Simulation makefile generated.")
-
+        tool_object = self.tool_object
+        if self.options.backend == "ninja":
+            self._generate_simulation_ninja(tool_object)
+            logging.info("Simulation ninja file generated.")
+        else:
+            self._generate_simulation_makefile(tool_object)
+            logging.info("Simulation makefile generated.")
 
-    def _generate_simulation_makefile(self, tool_object):
 
+    def _check_tool(self, tool_object, output):
         tool_info = tool_object.get_keys()
         if sys.platform == 'cygwin':
             bin_name = tool_info['windows_bin']
@@ -63,17 +73,70 @@ class GenerateSimulationMakefile(Action):
         name = tool_info['name']
         
         if self.env[path_key] is None and self.options.force is not True:
-            logging.error("Can't generate a " + name + " makefile. " + bin_name + " not found.")
+            logging.error("Can't generate a " + name + " " + output + ". " + bin_name + " not found.")
             sys.exit("Exiting")
             
-        logging.info("Generating " + name + " makefile for simulation.")
+        logging.info("Generating " + name + " " + output + " for simulation.")
+
+    def _generate_simulation_makefile(self, tool_object):
+        self._check_tool(tool_object, "makefile")
+        if self.options.schedule:
+            if hasattr(tool_object, "schedule"):
+                tool_object.schedule = True
+            else:
+                logging.warning("Scheduling is not supported for " + tool_object.get_keys()['name'] + ", ignored.")
+        if self.options.batch_compile:
+            if hasattr(tool_object, "batch"):
+                tool_object.batch = True
+            else:
+                logging.warning("Batch compilation is not supported for " + tool_object.get_keys()['name'] + ", ignored.")
+        if self.options.profile:
+            if hasattr(tool_object, "timing"):
+                tool_object.timing = True
+            else:
+                logging.warning("Profiling is not supported for " + tool_object.get_keys()['name'] + ", ignored.")
+
+        self._map_vendor_libraries(tool_object)
 
         pool = self.modules_pool
         top_module = pool.get_top_module()
         
         fset = pool.build_file_set()
         dep_files = fset.filter(DepFile)
-        dep_solver.solve(dep_files)
+        pool.solve_dependencies()
         
         tool_object.generate_simulation_makefile(dep_files, top_module)
 
+    def _map_vendor_libraries(self, tool_object):
+        """Use the vendor libraries compiled by hdlmake vendor-libs"""
+        from tools.common import vendor_libs
+        top_module = self.modules_pool.get_top_module()
+        if not top_module.sim_vendor_libs:
+            return
+        if not hasattr(tool_object, "vendor_libraries"):
+            logging.warning("Precompiled vendor libraries are not supported for " + tool_object.get_keys()['name'] + ", ignored.")
+            return
+        tool_object.vendor_libraries = vendor_libs.get_vendor_libraries(top_module, tool_object)
+        for library in tool_object.vendor_libraries:
+            if not library.is_compiled():
+                logging.warning("The vendor library %s is not compiled yet, run hdlmake vendor-libs" % library.name)
+
+    def _generate_simulation_ninja(self, tool_object):
+        from tools.common.sim_ninja_support import SimNinjaWriter
+        if not hasattr(tool_object, "get_ninja_rules"):
+            logging.error("The ninja backend is not supported for " + tool_object.get_keys()['name'] + ".")
+            sys.exit("Exiting")
+        self._check_tool(tool_object, "ninja file")
+        self._map_vendor_libraries(tool_object)
+
+        pool = self.modules_pool
+        top_module = pool.get_top_module()
+
+        fset = pool.build_file_set()
+        dep_files = fset.filter(DepFile)
+        pool.solve_dependencies()
+
+        writer = SimNinjaWriter()
+        writer.generate_simulation_ninja(dep_files, top_module,
+                                         tool_object.get_ninja_rules(dep_files, top_module))
+        writer.close()
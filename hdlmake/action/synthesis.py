@@ -47,7 +47,7 @@ class GenerateSynthesisMakefile(Action):
     def run(self):
         self._check_all_fetched_or_quit()
         self._check_manifest()
-        tool_object = global_mod.tool_module.ToolControls()
+        tool_object = self.tool_object
         self._generate_synthesis_makefile(tool_object)
 
 
@@ -58,7 +58,7 @@ class GenerateSynthesisProject(Action):
     def run(self):
         self._check_all_fetched_or_quit()
         self._check_manifest()
-        tool_object = global_mod.tool_module.ToolControls()   
+        tool_object = self.tool_object
         self._generate_synthesis_project(tool_object)
 
 
@@ -176,10 +176,20 @@ end sdb_meta_pkg;""")
                                  module=self.modules_pool.get_module_by_path("."))])\
 
 
-        tool_object.generate_synthesis_project(update=update,
+        timeout = getattr(self.options, "timeout", None)
+        if timeout:
+            if hasattr(tool_object, "timeout"):
+                tool_object.timeout = timeout
+            else:
+                logging.warning(name + " is not run by hdlmake: --timeout ignored")
+
+        result = tool_object.generate_synthesis_project(update=update,
                          tool_version=self.env[version_key],
                          top_mod=self.modules_pool.get_top_module(),
                          fileset = fileset)
+        if result is not None and not result.ok:
+            logging.error("Can't generate the " + name + " project: " + str(result))
+            sys.exit(result.returncode if result.returncode > 0 else 1)
 
         logging.info(name + " project file generated.")
 
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import sys
+import logging
+
+from action import Action
+from tools.common import vendor_libs
+
+
+class CompileVendorLibraries(Action):
+    """Compile the vendor libraries of the top manifest into the shared
+    cache, those not compiled yet (see tools.common.vendor_libs)"""
+
+    def _check_manifest(self):
+        if not self.top_module.sim_tool:
+            logging.error("sim_tool variable must be set in the top manifest.")
+            sys.exit("Exiting")
+
+    def run(self):
+        self._check_all_fetched_or_quit()
+        tool_object = self.tool_object
+        name = tool_object.get_keys()['name']
+        if not hasattr(tool_object, "get_vendor_library_commands"):
+            logging.error("Precompiled vendor libraries are not supported for " + name + ".")
+            sys.exit("Exiting")
+        if not self.top_module.sim_vendor_libs:
+            logging.info("No vendor library in the sim_vendor_libs manifest variable.")
+            return
+        if self.env[tool_object.get_keys()['id'] + '_path'] is None:
+            logging.error("Can't compile the vendor libraries. " + name + " not found.")
+            sys.exit("Exiting")
+
+        libraries = vendor_libs.get_vendor_libraries(self.top_module, tool_object)
+        if self.options.list:
+            for library in libraries:
+                print("%s\t%s\t%s" % (library.name,
+                                       "compiled" if library.is_compiled() else "missing",
+                                       library.path))
+            return
+        failed = vendor_libs.compile_libraries(libraries, self.top_module, tool_object,
+                                               rebuild=self.options.rebuild)
+        if failed:
+            sys.exit(1)
+        logging.info("Vendor libraries ready in " + vendor_libs.get_cache_dir())
@@ -21,10 +21,18 @@
 
 import global_mod
 import os
+import weakref
 from util import path as path_mod
 
 
 class DepRelation(object):
+    """An entity, a package or an include file that a file provides or uses.
+
+    The relations are immutable and interned: creating a relation equal to
+    an existing one returns the existing one, so that the dependency solver
+    compares them by identity and hashes them once. A relation no file uses
+    anymore, e.g. after a file is parsed again by hdlmake serve, is
+    forgotten."""
     # direction
     PROVIDE = 1
     USE = 2
@@ -34,30 +42,46 @@ class DepRelation(object):
     PACKAGE = 2
     INCLUDE = 3
 
-    def __init__(self, obj_name, direction, rel_type):
-        assert direction in [DepRelation.PROVIDE, DepRelation.USE]
-        assert rel_type in [DepRelation.ENTITY, DepRelation.PACKAGE, DepRelation.INCLUDE]
-        self.direction = direction
-        self.rel_type = rel_type
-        self.obj_name = obj_name
+    __slots__ = ("obj_name", "direction", "rel_type", "library", "provide", "_hash", "__weakref__")
 
-    def satisfies(self, rel_b):
-        if rel_b.direction == DepRelation.PROVIDE or self.direction == DepRelation.USE:
-            return False
-        if rel_b.rel_type == self.rel_type and rel_b.obj_name == self.obj_name:
-            return True
-        return False
+    _interned = weakref.WeakValueDictionary()
 
-    def library(self):
-        if self.rel_type == DepRelation.PACKAGE:
-            libdotpackage = self.obj_name
+    def __new__(cls, obj_name, direction, rel_type):
+        key = (obj_name, direction, rel_type)
+        rel = DepRelation._interned.get(key)
+        if rel is not None:
+            return rel
+        assert direction in [DepRelation.PROVIDE, DepRelation.USE]
+        assert rel_type in [DepRelation.ENTITY, DepRelation.PACKAGE, DepRelation.INCLUDE]
+        rel = object.__new__(cls)
+        set_field = super(DepRelation, rel).__setattr__
+        set_field("obj_name", obj_name)
+        set_field("direction", direction)
+        set_field("rel_type", rel_type)
+        # the library of a package, None for the other relations
+        library = None
+        if rel_type == DepRelation.PACKAGE:
             try:
-                lib, package = libdotpackage.split('.')
-                return lib
+                library, package = obj_name.split('.')
             except ValueError:
-                return None
+                pass
+        set_field("library", library)
+        # the relation satisfying a used one, None for a provided one
+        if direction == DepRelation.USE:
+            set_field("provide", DepRelation(obj_name, DepRelation.PROVIDE, rel_type))
         else:
-            return None
+            set_field("provide", None)
+        set_field("_hash", hash(key))
+        return DepRelation._interned.setdefault(key, rel)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DepRelation is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("DepRelation is immutable")
+
+    def satisfies(self, rel_b):
+        return rel_b.provide is self
 
     def __repr__(self):
         dstr = {self.USE: "Use", self.PROVIDE: "Provide"}
@@ -65,41 +89,60 @@ class DepRelation(object):
         return "%s %s '%s'" % (dstr[self.direction], ostr[self.rel_type], self.obj_name)
 
     def __hash__(self):
-        return hash(self.__repr__())
+        return self._hash
 
     def __eq__(self, other):
-        return (isinstance(other, self.__class__)
-                and self.__dict__ == other.__dict__)
+        return self is other
 
     def __ne__(self, other):
-        return not self.__eq__(other)
+        return self is not other
 
 
 class File(object):
+    # a design has many thousands of files: no dictionary per file, and the
+    # derived paths are computed once
+    __slots__ = ("path", "module", "_name", "_purename", "_dirname", "_rel_path")
+
     def __init__(self, path, module=None):
+        if isinstance(path, str):
+            path = intern(path)
         self.path = path
         if module is None:
             self.module = global_mod.top_module
         else:
             assert not isinstance(module, basestring)
             self.module = module
+        self._name = None
+        self._purename = None
+        self._dirname = None
+        self._rel_path = None
 
     @property
     def name(self):
-        return os.path.basename(self.path)
+        if self._name is None:
+            self._name = os.path.basename(self.path)
+        return self._name
 
     @property
     def purename(self):
-        return os.path.splitext(self.name)[0]
+        if self._purename is None:
+            self._purename = os.path.splitext(self.name)[0]
+        return self._purename
 
     @property
     def dirname(self):
-        return os.path.dirname(self.path)
+        if self._dirname is None:
+            self._dirname = os.path.dirname(self.path)
+        return self._dirname
 
     def rel_path(self, dir=None):
         if dir is None:
             dir = os.getcwd()
-        return path_mod.relpath(self.path, dir)
+        # the last relative path is kept with the directory it was computed
+        # against, hdlmake changes directory when fetching or in a matrix
+        if self._rel_path is None or self._rel_path[0] != dir:
+            self._rel_path = (dir, path_mod.relpath(self.path, dir))
+        return self._rel_path[1]
 
     def __str__(self):
         return self.path
@@ -140,6 +183,8 @@ class File(object):
 
 
 class DepFile(File):
+    __slots__ = ("file_path", "_rels", "depends_on", "included_files", "is_parsed", "include_paths")
+
     def __init__(self, file_path, module, include_paths=None):
         from module import Module
         assert isinstance(file_path, basestring)
@@ -149,13 +194,11 @@ class DepFile(File):
         self.file_path = file_path
         self._rels = set()
         self.depends_on = set()  # set of files that the file depends on, items of type DepFile
+        self.included_files = set()  # files pulled in by the preprocessor, items of type DepFile
 
         self.is_parsed = False
         if include_paths is None:
-            include_paths = []
-        else:
-            pass
-        self.file_path = file_path
+            include_paths = ()
         self.include_paths = include_paths
 
     def _parse_if_needed(self):
@@ -177,10 +220,21 @@ class DepFile(File):
     def add_relation(self, rel):
         self._rels.add(rel)
 
+    def invalidate(self):
+        """Forget everything learned from the file, so it is parsed again"""
+        self.is_parsed = False
+        self._rels = set()
+        self.included_files = set()
+        self.depends_on = set()
+
+    def reset_dependencies(self):
+        """Forget the dependencies found by the solver, keep the included files"""
+        self.depends_on = set(self.included_files)
+
     def satisfies(self, rel_b):
         assert isinstance(rel_b, DepRelation)
         self._parse_if_needed()
-        return any(map(lambda x: x.satisfies(rel_b), self.rels))
+        return rel_b.provide in self._rels
 
     def show_relations(self):
         self._parse_if_needed()
@@ -26,6 +26,8 @@ import os
 import sys
 from subprocess import Popen, PIPE
 import re
+import json
+import hashlib
 import logging
 import os.path
 from util import path
@@ -60,23 +62,142 @@ def _red(text):
     return colored(text, 'red')
 
 
+class _ToolProbeCache(object):
+    """Persistent cache for the tool path/version probes.
+
+    Entries are keyed by the tool id, the PATH and every HDLMAKE_* variable,
+    and are only trusted while the modification time of the tool binary stays
+    the same, so that reinstalling a tool invalidates its entry.
+    """
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = path.cache_path("env.json")
+        self.filename = filename
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.filename, "r") as cache_file:
+                    self._entries = json.load(cache_file)
+            except (IOError, OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        tmp_name = "%s.%d.tmp" % (self.filename, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.filename)):
+                os.makedirs(os.path.dirname(self.filename))
+            with open(tmp_name, "w") as cache_file:
+                json.dump(self._entries, cache_file, indent=1, sort_keys=True)
+            os.rename(tmp_name, self.filename)
+        except (IOError, OSError) as e:
+            logging.debug("Can't write the tool probe cache %s: %s" % (self.filename, e))
+
+    @staticmethod
+    def key(tool_id):
+        hdlmake_vars = sorted((name, value) for name, value in os.environ.items()
+                              if name.startswith("HDLMAKE_"))
+        digest = hashlib.sha1(repr((os.environ.get("PATH", ""), hdlmake_vars)).encode("utf-8"))
+        return "%s:%s" % (tool_id, digest.hexdigest())
+
+    @staticmethod
+    def _mtime(binary):
+        try:
+            return os.path.getmtime(binary)
+        except OSError:
+            return None
+
+    def get(self, tool_id):
+        entry = self._load().get(self.key(tool_id))
+        if entry is None:
+            return None
+        if self._mtime(entry["binary"]) != entry["mtime"]:
+            return None
+        return entry
+
+    def put(self, tool_id, binary, tool_path, version):
+        self._load()[self.key(tool_id)] = {"binary": binary,
+                                           "mtime": self._mtime(binary),
+                                           "path": tool_path,
+                                           "version": version}
+        self._save()
+
+
 class Env(dict):
+    """Environment settings relevant to hdlmake.
+
+    Keys are probed lazily: the first time a key is looked up, only the group
+    of settings it belongs to is examined (general settings, a tool path and
+    version, the remote synthesis variables or the remote connection itself),
+    so commands that never ask for a tool don't pay for probing it.
+    """
+
+    _GENERAL_KEYS = ("architecture", "platform", "coredir")
 
     #def __init__(self, options, top_module=None):
     def __init__(self, options):
         dict.__init__(self)
         self.options = options
+        self._probe_cache = _ToolProbeCache()
         #self.top_module = top_module
 
+    def __missing__(self, key):
+        # a lazy probe is silent, whatever the verbosity of the run
+        verbose = print.verbose
+        print.set_verbose(False)
+        try:
+            self._probe(key)
+        finally:
+            print.set_verbose(verbose)
+        if not dict.__contains__(self, key):
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def _probe(self, key):
+        """Examine the group of settings the key belongs to"""
+        if key in self._GENERAL_KEYS:
+            self._check_general()
+        elif key == "rsynth_can_connect":
+            self._check_remote_connection()
+        elif key.startswith("rsynth_"):
+            tool_id = None
+            if key.endswith("_path"):
+                tool_id = key[len("rsynth_"):-len("_path")]
+            tool_object = self._get_tool_object(tool_id)
+            if tool_object is not None:
+                self._check_remote_tool(tool_object)
+            elif tool_id is None:
+                # no tool: only the settings of the remote machine
+                for name in ["rsynth_user", "rsynth_server", "rsynth_use_screen"]:
+                    self._report_and_set_hdlmake_var(name)
+        elif key.endswith("_path") or key.endswith("_version"):
+            tool_object = self._get_tool_object(key.rsplit('_', 1)[0])
+            if tool_object is not None:
+                self._check_tool(tool_object)
 
     def check_env(self, verbose=True):
         print.set_verbose(verbose)
         # Check and determine general environment
         self._check_general()
-        tool_object = global_mod.tool_module.ToolControls()      
-        self._check_tool(tool_object)
+        tool_object = global_mod.tool_module.ToolControls()
+        self._check_tool(tool_object, use_cache=False)
         self._check_remote_tool(tool_object)
-
+        self._check_remote_connection()
+
+    def _get_tool_object(self, tool_id=None):
+        """Get the controls of the given tool, or of the current one if no id is given"""
+        tool_module = global_mod.tool_module
+        if tool_id is None:
+            if tool_module is None:
+                return None
+        elif tool_module is None or tool_module.ToolControls().get_keys()['id'] != tool_id:
+            try:
+                tool_module = importlib.import_module("tools.%s.%s" % (tool_id, tool_id))
+            except ImportError:
+                return None
+        return tool_module.ToolControls()
 
     def _get(self, name):
         assert not name.startswith("HDLMAKE_")
@@ -86,8 +207,13 @@ class Env(dict):
 
 
     def _get_path(self, name):
-        location = os.popen("which %s" % name).read().strip()
-        return os.path.dirname(location)
+        if not name:
+            return ""
+        for directory in os.environ.get("PATH", "").split(os.pathsep):
+            location = os.path.join(directory, name)
+            if os.path.isfile(location) and os.access(location, os.X_OK):
+                return os.path.dirname(os.path.abspath(location))
+        return ""
 
 
     def _is_in_path(self, name, path=None):
@@ -122,7 +248,7 @@ class Env(dict):
             print("'fetchto' variables in the manifests will be respected when fetching.")
 
 
-    def _check_tool(self, info_class):
+    def _check_tool(self, info_class, use_cache=True):
         
         tool_info = info_class.get_keys()
         if sys.platform == 'cygwin':
@@ -134,6 +260,13 @@ class Env(dict):
         version_key = tool_info['id'] + '_version'
         name = tool_info['name']
 
+        cached = self._probe_cache.get(tool_info['id']) if use_cache else None
+        if cached is not None:
+            logging.debug("Using cached probe for " + name + ": %s" % cached)
+            self[path_key] = cached["path"]
+            self[version_key] = cached["version"]
+            return
+
         print("\n### " + name + " tool environment information ###")
         self._report_and_set_hdlmake_var(path_key)
         if self[path_key] is not None:
@@ -150,18 +283,34 @@ class Env(dict):
         if self[path_key] is not None:
             self[version_key] = info_class.detect_version(self[path_key])
             print("Detected " + name +" version %s" % self[version_key])
+            binary = os.path.join(self[path_key], bin_name or "")
+            if os.path.isfile(binary):
+                self._probe_cache.put(tool_info['id'], binary, self[path_key], self[version_key])
+        else:
+            self[version_key] = None
 
 
     def _check_remote_tool(self, info_class):
 
         tool_info = info_class.get_keys()
         remote_path_key = 'rsynth_' + tool_info['id'] + '_path'
-        remote_version_key = 'rsynth_' + tool_info['id'] + '_version'
         name = tool_info['name']
         
         print("\n### Remote tool " + name + " environment information ###")
         self._report_and_set_hdlmake_var("rsynth_user")
         self._report_and_set_hdlmake_var("rsynth_server")
+        self._report_and_set_hdlmake_var(remote_path_key)
+        self._report_and_set_hdlmake_var("rsynth_use_screen")
+        if self["rsynth_use_screen"]:
+            print("Remote execution will use screen.")
+        else:
+            print("To use screen, set it to '1'.")
+
+
+    def _check_remote_connection(self):
+        """Check that a passwordless ssh connection to the remote synthesis
+        machine can be made. This is slow, so only remote actions ask for it"""
+        tool_object = self._get_tool_object()
         can_connect = False
         if self["rsynth_user"] is not None and self["rsynth_server"] is not None:
             ssh_cmd = 'ssh -o BatchMode=yes -o ConnectTimeout=5 %s@%s echo ok 2>&1'
@@ -174,8 +323,14 @@ class Env(dict):
             else:
                 print("Can't make a passwordless connection to the remote machine: %s@%s" % (self["rsynth_user"], self["rsynth_server"]))
                 can_connect = False
+        self["rsynth_can_connect"] = can_connect
 
-        self._report_and_set_hdlmake_var(remote_path_key)
+        if tool_object is None:
+            # no tool to look for on the remote machine
+            return
+        tool_info = tool_object.get_keys()
+        remote_path_key = 'rsynth_' + tool_info['id'] + '_path'
+        name = tool_info['name']
         if can_connect and self[remote_path_key] is not None:
             ssh_cmd = 'ssh -o BatchMode=yes -o ConnectTimeout=5 %s@%s test -e %s 2>&1'
             ssh_cmd = ssh_cmd % (self["rsynth_user"], self["rsynth_server"], self[remote_path_key])
@@ -185,11 +340,6 @@ class Env(dict):
                 print("%s found on remote machine under %s." % (name, self[remote_path_key]))
             else:
                 print("Can't find %s on remote machine under %s." % (name, self[remote_path_key]))
-        self._report_and_set_hdlmake_var("rsynth_use_screen")
-        if self["rsynth_use_screen"]:
-            print("Remote execution will use screen.")
-        else:
-            print("To use screen, set it to '1'.")
 
 
     def _report_and_set_hdlmake_var(self, name):
@@ -29,50 +29,56 @@ import fetch
 import global_mod
 from string import Template
 
-class _StaticClassVariable():
-    pass
-
-_m = _StaticClassVariable()
-_m.initialized = False
+def write_file(filename, content):
+    """Write the content to the file, unless the file already has it.
+    Return True if the file was written."""
+    if os.path.isfile(filename):
+        with open(filename, "r") as old_file:
+            if old_file.read() == content:
+                logging.debug("%s is up to date" % filename)
+                return False
+    elif os.path.isdir(filename):
+        os.rmdir(filename)
+
+    # replace the file atomically: make never sees a half-written makefile
+    tmp_filename = os.path.join(os.path.dirname(filename) or ".",
+                                ".%s.tmp" % os.path.basename(filename))
+    with open(tmp_filename, "w") as new_file:
+        new_file.write(content)
+    os.rename(tmp_filename, filename)
+    return True
 
 
 class MakefileWriter(object):
-    
+    """Write a makefile through an in-memory buffer.
+
+    Nothing is written to disk until close() is called. The makefile is only
+    replaced when its content changed, so its modification time doesn't
+    change for nothing and make doesn't rebuild targets depending on it.
+    """
+
     def __init__(self, filename=None):
-        self._file = None
+        self._buffer = None
         if filename:
             self._filename = filename
         else:
             self._filename = "Makefile"
 
-    def __del__(self):
-        if self._file:
-            self._file.close()
-
 
     def initialize(self):
-        if not _m.initialized:
-            if os.path.exists(self._filename):
-                if os.path.isfile(self._filename):
-                    os.remove(self._filename)
-                elif os.path.isdir(self._filename):
-                    os.rmdir(self._filename)
-
-            self._file = open(self._filename, "a+")
-            _m.initialized = True
+        if self._buffer is None:
+            self._buffer = []
             self.writeln("########################################")
             self.writeln("#  This file was generated by hdlmake  #")
             self.writeln("#  http://ohwr.org/projects/hdl-make/  #")
             self.writeln("########################################")
             self.writeln()
-        elif not self._file:
-            self._file = open(self._filename, "a+")
 
 
     def write(self, line=None):
-        if not _m.initialized:
+        if self._buffer is None:
             self.initialize()
-        self._file.write(line)
+        self._buffer.append(line)
 
 
     def writeln(self, text=None):
@@ -82,6 +88,16 @@ class MakefileWriter(object):
             self.write(text+"\n")
 
 
+    def close(self):
+        """Write the makefile, unless the file already has the same content.
+        Return True if the file was written."""
+        if self._buffer is None:
+            return False
+        content = "".join(self._buffer)
+        self._buffer = None
+        return write_file(self._filename, content)
+
+
     def generate_fetch_makefile(self, modules_pool):
         rp = os.path.relpath
         self.write("#target for fetching all modules stored in repositories\n")
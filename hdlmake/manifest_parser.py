@@ -66,6 +66,7 @@ class ManifestParser(ConfigParser):
 
         self.add_delimiter()
         self.add_option('top_module', default=None, help="Top level entity for synthesis and simulation", type='')
+        self.add_type('top_module', type=[])
 
         self.add_delimiter()
         self.add_option('force_tool', default=None, help="Force certain version of a tool, e.g. 'ise < 13.2' or 'iverilog == 0.9.6",
@@ -89,6 +90,10 @@ class ManifestParser(ConfigParser):
         self.add_option('vcom_opt', default="", help="Additional options for vcom", type='')
         self.add_option('vlog_opt', default="", help="Additional options for vlog", type='')
         self.add_option('vmap_opt', default="", help="Additional options for vmap", type='')
+        self.add_option('sim_vendor_libs', default={}, help="Vendor libraries compiled once by hdlmake vendor-libs, "
+                        "with their source files and directories, e.g. {'unisim': ['$XILINX/vhdl/src/unisims']}", type={})
+        self.add_option('sim_tests', default=[], help="Tests run by hdlmake regress, dictionaries with a top and optionally "
+                        "a name, plusargs, generics, seeds, a timeout, a pass_pattern and a fail_pattern", type=[])
 
         self.add_delimiter()
         self.add_option('iverilog_opt', default="", help="Additional options for iverilog", type='')
@@ -98,6 +103,8 @@ class ManifestParser(ConfigParser):
         self.add_option('modules', default={}, help="List of local modules", type={})
         self.add_option('target', default='', help="What is the target architecture", type='')
         self.add_option('action', default='', help="What is the action that should be taken (simulation/synthesis)", type='')
+        self.add_option('matrix', default=[], help="Configurations run by hdlmake matrix, dictionaries of top manifest variables, "
+                        "e.g. [{'sim_tool': 'modelsim'}, {'sim_tool': 'ghdl'}]", type=[])
 
         self.add_allowed_key('modules', key="svn")
         self.add_allowed_key('modules', key="git")
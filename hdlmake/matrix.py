@@ -0,0 +1,275 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run the automatic flow for several configurations of the top module.
+
+A configuration is a dictionary of top manifest variables (action, sim_tool,
+syn_tool, top_module, syn_device...) replacing those of the top manifest,
+listed in the matrix variable of the top manifest or in a separate file.
+The modules are read, and their files parsed and their dependencies solved,
+once for all the configurations. The files of every configuration are then
+written in a directory of its own by a child process, which inherits the
+parsed files from hdlmake instead of parsing them again, so that several
+configurations are written at the same time.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import copy
+import logging
+import importlib
+import multiprocessing
+
+import global_mod
+from util.configparser import ConfigParser
+
+# the top manifest variables a configuration can set
+MATRIX_VARIABLES = ["action", "target",
+                    "sim_tool", "top_module", "sim_pre_cmd", "sim_post_cmd",
+                    "vsim_opt", "vcom_opt", "vlog_opt", "vmap_opt", "iverilog_opt",
+                    "syn_tool", "syn_device", "syn_grade", "syn_package", "syn_top",
+                    "syn_project", "syn_name", "syn_pre_cmd", "syn_post_cmd"]
+
+# output of the automatic flow, in the directory of every configuration
+LOG_NAME = "hdlmake_matrix.log"
+
+
+class Configuration(object):
+    """A configuration of the matrix: the variables it sets in the top
+    module, the Verilog macros it defines and its output directory"""
+
+    def __init__(self, name, variables, defines, path):
+        self.name = name
+        self.variables = variables
+        self.defines = defines
+        self.path = path
+        self.status = None
+
+    def get_value(self, top_module, name):
+        return self.variables.get(name, getattr(top_module, name))
+
+    def get_tool_name(self, top_module):
+        if self.get_value(top_module, "action").lower() == "synthesis":
+            return self.get_value(top_module, "syn_tool")
+        return self.get_value(top_module, "sim_tool")
+
+    def apply(self, top_module):
+        """Set the variables of the configuration in the top module"""
+        for name, value in self.variables.iteritems():
+            if name in ["action", "target"]:
+                value = value.lower()
+            setattr(top_module, name, value)
+        if "syn_project" in self.variables and "syn_name" not in self.variables:
+            top_module.syn_name = self.variables["syn_project"][:-5]
+
+    def __str__(self):
+        return self.name
+
+
+def read_matrix_file(path):
+    """Return the configurations listed by the matrix variable of a file
+    written like a manifest"""
+    parser = ConfigParser()
+    parser.add_option('matrix', default=[], type=[])
+    parser.add_config_file(path)
+    return parser.parse()["matrix"]
+
+
+def get_configurations(top_module, matrix, output_dir):
+    """Check the configurations of the matrix and return them, with their
+    output directories"""
+    configurations = []
+    for index, settings in enumerate(matrix):
+        if not isinstance(settings, dict):
+            raise ValueError("Configuration %d of the matrix is not a dictionary" % index)
+        variables = dict(settings)
+        name = variables.pop("name", None)
+        path = variables.pop("dir", None)
+        defines = variables.pop("defines", {})
+        unknown = [key for key in variables if key not in MATRIX_VARIABLES]
+        if unknown:
+            raise ValueError("Unrecognized variables in configuration %d of the matrix: %s"
+                             % (index, ', '.join(sorted(unknown))))
+        if isinstance(defines, (list, tuple)):
+            defines = dict((define, None) for define in defines)
+        configuration = Configuration(name, variables, defines, None)
+        if configuration.get_value(top_module, "action").lower() not in ["simulation", "synthesis"]:
+            raise ValueError("The action of configuration %d of the matrix must be simulation or synthesis" % index)
+        if not configuration.get_tool_name(top_module):
+            raise ValueError("No tool for configuration %d of the matrix" % index)
+        if name is None:
+            configuration.name = configuration.get_tool_name(top_module)
+        configuration.path = os.path.abspath(path or os.path.join(output_dir, configuration.name))
+        configurations.append(configuration)
+    names = [c.name for c in configurations]
+    for name in sorted(set(names)):
+        if names.count(name) > 1:
+            raise ValueError("Several configurations of the matrix are named %s, give them a name" % name)
+    return configurations
+
+
+def get_define_options(tool_controls, defines):
+    """Return the options defining the Verilog macros for the tool, as
+    given by the define_option template of its controls"""
+    options = []
+    for name, value in sorted(defines.iteritems()):
+        if value is None:
+            options.append(tool_controls.define_option % name)
+        else:
+            options.append(tool_controls.define_option % ("%s=%s" % (name, value)))
+    return ' '.join(options)
+
+
+def _rebase_include_dirs(modules_pool, old_cwd):
+    """The include directories are relative to the directory hdlmake was
+    started in: make them relative to the output directory"""
+    def rebase(include_dir):
+        return os.path.relpath(os.path.join(old_cwd, include_dir))
+    for module in modules_pool:
+        if module.include_dirs:
+            module.include_dirs = [rebase(d) for d in module.include_dirs]
+    for source_file in modules_pool.build_file_set():
+        if hasattr(source_file, "include_dirs"):
+            source_file.include_dirs = [rebase(d) for d in source_file.include_dirs]
+
+
+def _run_configuration(configuration, options, env, modules_pool, get_actions, run_actions):
+    """Run the automatic flow for the configuration, in its directory.
+    Return the exit status."""
+    top_module = modules_pool.get_top_module()
+    old_cwd = os.getcwd()
+    os.chdir(configuration.path)
+    _rebase_include_dirs(modules_pool, old_cwd)
+    configuration.apply(top_module)
+    options = copy.copy(options)
+    options.command = "auto"
+    try:
+        action = get_actions(options, env, modules_pool)
+        if configuration.defines:
+            tool_controls = global_mod.tool_module.ToolControls
+            if hasattr(tool_controls, "define_option"):
+                # vlog_opt unless the tool reads its own manifest option
+                manifest_option = getattr(tool_controls, "define_manifest_option", "vlog_opt")
+                setattr(top_module, manifest_option,
+                        ' '.join(o for o in [getattr(top_module, manifest_option),
+                                             get_define_options(tool_controls, configuration.defines)] if o))
+            else:
+                logging.warning("Defines are not supported for " + tool_controls().get_keys()['name'] + ", ignored.")
+        if not run_actions(action, modules_pool, options, env):
+            return 1
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    return 0
+
+
+def _start(configuration, options, env, modules_pool, get_actions, run_actions):
+    """Fork a child running the configuration, with its output going to the
+    log of the configuration. Return the pid of the child."""
+    if not os.path.isdir(configuration.path):
+        os.makedirs(configuration.path)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 1
+    try:
+        log_file = open(os.path.join(configuration.path, LOG_NAME), "w")
+        os.dup2(log_file.fileno(), sys.stdout.fileno())
+        os.dup2(log_file.fileno(), sys.stderr.fileno())
+        status = _run_configuration(configuration, options, env, modules_pool, get_actions, run_actions)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def run_matrix(options, env, modules_pool, get_actions, run_actions):
+    """Run the automatic flow for every configuration of the matrix, with
+    at most options.jobs at the same time. Return the exit status."""
+    top_module = modules_pool.get_top_module()
+    if options.matrix_file:
+        if not os.path.exists(options.matrix_file):
+            logging.error("The matrix file %s doesn't exist" % options.matrix_file)
+            return 1
+        matrix = read_matrix_file(options.matrix_file)
+    else:
+        matrix = top_module.matrix
+    if not matrix:
+        logging.error("No configuration: set the matrix variable in the top manifest or give a matrix file")
+        return 1
+    try:
+        configurations = get_configurations(top_module, matrix, options.output_dir)
+    except ValueError as e:
+        logging.error(e)
+        return 1
+    if not modules_pool.is_everything_fetched():
+        logging.error("At least one module remains unfetched. "
+                      "Fetching must be done before makefile generation.")
+        return 1
+
+    # the tool settings are probed, the files parsed and their dependencies
+    # solved once, before the children are started
+    tool_objects = []
+    for configuration in configurations:
+        tool_name = configuration.get_tool_name(top_module)
+        try:
+            tool_module = importlib.import_module("tools.%s.%s" % (tool_name, tool_name))
+        except ImportError as e:
+            logging.error("Unknown tool %s in configuration %s: %s" % (tool_name, configuration, e))
+            return 1
+        tool_object = tool_module.ToolControls()
+        tool_id = tool_object.get_keys()['id']
+        for key in [tool_id + "_path", tool_id + "_version"]:
+            env[key]
+        tool_objects.append(tool_object)
+    modules_pool.solve_dependencies(tool_objects)
+
+    jobs = options.jobs or multiprocessing.cpu_count()
+    logging.info("Running %d configurations, %d at a time" % (len(configurations), jobs))
+    pending = list(configurations)
+    running = {}
+    while pending or running:
+        while pending and len(running) < jobs:
+            configuration = pending.pop(0)
+            running[_start(configuration, options, env, modules_pool, get_actions, run_actions)] = configuration
+        pid, status = os.wait()
+        configuration = running.pop(pid, None)
+        if configuration is None:
+            continue
+        configuration.status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+        log_path = os.path.relpath(os.path.join(configuration.path, LOG_NAME))
+        if configuration.status == 0:
+            logging.info("%s: generated in %s" % (configuration, os.path.relpath(configuration.path)))
+        else:
+            logging.error("%s: failed with exit status %d, see %s" % (configuration, configuration.status, log_path))
+
+    failed = [c for c in configurations if c.status != 0]
+    if failed:
+        logging.error("%d of %d configurations failed: %s" % (len(failed), len(configurations),
+                                                              ', '.join(str(c) for c in failed)))
+        return 1
+    return 0
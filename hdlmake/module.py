@@ -66,12 +66,16 @@ class Module(object):
         self.isparsed = False
         self.isprocessed = False
         self.include_dirs = None
+        # include directory tuples shared by the files of the module
+        self.shared_include_dirs = {}
         self.library = "work"
         self.local = []
         self.git = []
         self.svn = []
         self.target = None
         self.action = None
+        self.matrix = []
+        self.sim_tests = []
         self.vmap_opt = None
         self.vlog_opt = None
         self.vcom_opt = None
@@ -95,6 +99,7 @@ class Module(object):
         self.sim_only_files = None
         self.sim_pre_script = None
         self.sim_post_script = None
+        self.sim_vendor_libs = {}
         self.top_module = None
         self.commit_id = None
 
@@ -346,6 +351,20 @@ class Module(object):
         self.sim_pre_cmd = self.manifest_dict["sim_pre_cmd"]
         self.sim_post_cmd = self.manifest_dict["sim_post_cmd"]
 
+        # the vendor sources usually live in the tool installation, so
+        # absolute paths and environment variables are allowed
+        self.sim_vendor_libs = {}
+        for library, paths in self.manifest_dict["sim_vendor_libs"].iteritems():
+            lib_paths = []
+            for filepath in self._flatten_list(paths):
+                filepath = path_mod.rel2abs(os.path.expanduser(os.path.expandvars(filepath)), self.path)
+                if not os.path.exists(filepath):
+                    logging.warning("The source %s of the vendor library %s listed in %s doesn't exist" %
+                                    (filepath, library, self.path))
+                    continue
+                lib_paths.append(filepath)
+            self.sim_vendor_libs[library.lower()] = lib_paths
+
         self.bit_file_targets = SourceFileSet()
         if len(self.manifest_dict["bit_file_targets"]) != 0:
             paths = self._make_list_of_paths(self.manifest_dict["bit_file_targets"])
@@ -388,6 +407,8 @@ class Module(object):
                                                             source=fetch.GITSUBMODULE))
         self.target = self.manifest_dict["target"].lower()
         self.action = self.manifest_dict["action"].lower()
+        self.matrix = self.manifest_dict["matrix"]
+        self.sim_tests = self.manifest_dict["sim_tests"]
 
         if self.manifest_dict["syn_name"] is None and self.manifest_dict["syn_project"] is not None:
             self.syn_name = self.manifest_dict["syn_project"][:-5]  # cut out .xise from the end
@@ -189,10 +189,10 @@ class ModulePool(list):
                 else:
                     logging.debug("NOT appended to fetch queue: " + str(mod.url))
 
-    def solve_dependencies(self):
+    def solve_dependencies(self, tool_objects=None):
         """Set dependencies for all project files"""
         if not self._deps_solved:
-            dep_solver.solve(self.build_file_set())
+            dep_solver.solve(self.build_file_set(), tool_objects)
             self._deps_solved = True
 
     def build_file_set(self):
@@ -206,20 +206,75 @@ class ModulePool(list):
 
     def build_global_file_set(self):
         """Build set of all files from manifests plus all include files from sources"""
-        from srcfile import SourceFileSet   
+        from srcfile import SourceFileSet
+        from dep_file import DepFile
         files = self.build_file_set()
         assert isinstance(files, SourceFileSet)
         self.solve_dependencies()
-        ret = []
-        for file in files:
-            try:
-                for dep_file in file.dep_depends_on:
-                    if dep_file not in ret:
-                        ret.add(dep_file)
-                ret.add(file)
-            except:
-                pass
-        return files
+        ret = SourceFileSet()
+        ret.add(files)
+        for source_file in files.filter(DepFile):
+            ret.add(source_file.included_files)
+        return ret
+
+    def get_watched_paths(self):
+        """Return the files and the directories the pool was built from.
+
+        The files are the manifests, the source files and the files they
+        include. The directories are those whose whole content is listed in
+        a manifest and the modules that don't have a manifest yet.
+        """
+        files = set()
+        dirs = set()
+        for module in self:
+            if not module.isfetched:
+                continue
+            if module.manifest is None:
+                dirs.add(module.path)
+                continue
+            files.add(module.manifest.path)
+            if module.manifest_dict is None:
+                continue
+            for entry in (module._flatten_list(module.manifest_dict["files"]) +
+                          module._flatten_list(module.manifest_dict["sim_only_files"])):
+                entry_path = path_mod.rel2abs(entry, module.path)
+                if os.path.isdir(entry_path):
+                    dirs.add(entry_path)
+        for file in self.build_file_set():
+            files.add(file.path)
+            for included_file in getattr(file, "included_files", ()):
+                files.add(included_file.path)
+        return files, dirs
+
+    def invalidate_files(self, paths):
+        """Make the files at the given paths, and the files including them,
+        to be parsed again. The solved dependencies are forgotten."""
+        from dep_file import DepFile
+        paths = set(paths)
+        for dep_file in self.build_file_set().filter(DepFile):
+            if dep_file.path in paths or any(f.path in paths for f in dep_file.included_files):
+                dep_file.invalidate()
+            else:
+                dep_file.reset_dependencies()
+        self._deps_solved = False
+
+    def reuse_parsed_files(self, other_pool):
+        """Take the relations of the files already parsed in other pool, so
+        that only the new and the invalidated files have to be parsed"""
+        from dep_file import DepFile
+        from srcfile import SourceFileFactory
+        parsed = dict(((f.path, f.library), f)
+                      for f in other_pool.build_file_set().filter(DepFile) if f.is_parsed)
+        sff = SourceFileFactory()
+        for dep_file in self.build_file_set().filter(DepFile):
+            old_file = parsed.get((dep_file.path, dep_file.library))
+            if old_file is None or dep_file.is_parsed:
+                continue
+            dep_file.rels = set(old_file.rels)
+            dep_file.included_files = set(sff.new(path=f.path, module=dep_file.module)
+                                          for f in old_file.included_files)
+            dep_file.depends_on = set(dep_file.included_files)
+            dep_file.is_parsed = True
 
     def get_top_module(self):
         return self.top_module
@@ -28,6 +28,7 @@ from dep_file import DepFile
 from srcfile import VHDLFile, VerilogFile, SVFile
 
 import global_mod
+from tools.common import library_catalog
 
 
 class DepParser(object):
@@ -73,7 +74,10 @@ class ParserFactory(object):
 #             f.dep_resolved = True
 
 
-def solve(fileset):
+def solve(fileset, tool_objects=None):
+    """Find the files satisfying the relations of every file of the fileset.
+    The libraries of the given tools, the tool of the command by default,
+    are not looked for in the fileset."""
     from srcfile import SourceFileSet
     from dep_file import DepRelation
     assert isinstance(fileset, SourceFileSet)
@@ -83,6 +87,23 @@ def solve(fileset):
     #     print(fle.path)
     #     for rel in fle.rels:
     #         print('\t' + str(rel))
+    # the libraries of the tool and the vendor libraries compiled by hdlmake
+    # vendor-libs, except those compiled from the fileset
+    if tool_objects is None:
+        tool_objects = [global_mod.tool_module.ToolControls()]
+    standard_libraries = set()
+    for tool_object in tool_objects:
+        standard_libraries.update(library_catalog.get_standard_libraries(tool_object))
+    if global_mod.top_module is not None:
+        standard_libraries.update(global_mod.top_module.sim_vendor_libs)
+    standard_libraries.difference_update(f.library.lower() for f in fset if f.library)
+    # the files providing every relation, a relation being satisfied by
+    # the files providing its counterpart
+    providers = {}
+    for dep_file in fset:
+        for rel in dep_file.rels:
+            if rel.direction is DepRelation.PROVIDE:
+                providers.setdefault(rel, []).append(dep_file)
     not_satisfied = 0
     for investigated_file in fset:
         logging.debug("Dependency solver investigates %s (%d relations)" % (investigated_file, len(investigated_file.rels)))
@@ -91,15 +112,10 @@ def solve(fileset):
                 continue
             if rel.rel_type is DepRelation.INCLUDE:  # INCLUDE are already solved by preprocessor
                 continue
-            if rel.library() in global_mod.tool_module.ToolControls().get_standard_libraries():  # dont care about standard libs
+            if rel.library in standard_libraries:  # dont care about standard libs
                 continue
-            satisfied_by = set()
-            for dep_file in fset:
-               # if dep_file is investigated_file:
-               #     continue
-                if dep_file.satisfies(rel):
-                    investigated_file.depends_on.add(dep_file)
-                    satisfied_by.add(dep_file)
+            satisfied_by = set(providers.get(rel.provide, []))
+            investigated_file.depends_on.update(satisfied_by)
             if len(satisfied_by) > 1:
                 logging.warning("Relation %s satisfied by multpiple (%d) files: %s",
                                 str(rel),
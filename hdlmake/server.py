@@ -0,0 +1,303 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keep the modules of a project in memory and run hdlmake commands for
+thin clients connecting over a Unix socket, or every time the sources
+change.
+
+The server watches the manifests, the source files and the files they
+include. A changed source file is only parsed again, together with the
+files including it. A changed manifest makes the server read the modules
+again, but the relations of the unchanged files are kept.
+
+A request is a line of JSON: {"argv": [...], "cwd": "..."}. The answer is a
+line of JSON: {"status": <exit status>, "stdout": "...", "stderr": "..."}.
+A status of null tells the client to run the command by itself.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import errno
+import socket
+import select
+import signal
+import logging
+import traceback
+from StringIO import StringIO
+
+import global_mod
+from util.filewatcher import new_watcher
+
+SOCKET_NAME = ".hdlmake.sock"
+
+# options that change how the manifests are read: the server can't answer
+# requests using other values than its own
+_POOL_OPTIONS = ["arbitrary_code", "allow_unknown"]
+
+
+def get_socket_path(socket_path=None):
+    if socket_path:
+        return os.path.abspath(socket_path)
+    if os.environ.get("HDLMAKE_SERVER"):
+        return os.path.abspath(os.environ["HDLMAKE_SERVER"])
+    return os.path.join(os.getcwd(), SOCKET_NAME)
+
+
+def _receive(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return json.loads("".join(chunks))
+
+
+def forward(argv):
+    """Run the command on the server of the current directory.
+
+    Return the exit status of the command, or None if there is no server
+    that can run it.
+    """
+    socket_path = get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}) + "\n")
+        sock.shutdown(socket.SHUT_WR)
+        reply = _receive(sock)
+    except (socket.error, ValueError) as e:
+        logging.debug("No answer from the server at %s: %s" % (socket_path, e))
+        return None
+    finally:
+        sock.close()
+    if reply["status"] is None:
+        return None
+    sys.stdout.write(reply["stdout"].encode("utf-8"))
+    sys.stderr.write(reply["stderr"].encode("utf-8"))
+    return reply["status"]
+
+
+def _exit_status(code, stderr):
+    """Translate the argument of sys.exit() to an exit status, as python does"""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=stderr)
+    return 1
+
+
+class WatchedPool(object):
+    """A module pool kept in step with the files it was built from"""
+
+    def __init__(self, modules_pool, load_pool):
+        self.modules_pool = modules_pool
+        self.reload_needed = False
+        self._load_pool = load_pool
+        files, dirs = modules_pool.get_watched_paths()
+        self.watcher = new_watcher(files, dirs)
+
+    def refresh(self, changed=None):
+        """Invalidate what depends on the changed files, by default on the
+        files changed since the last call. Return the changed files."""
+        if changed is None:
+            changed = self.watcher.changes()
+        if not changed:
+            return changed
+        logging.debug("Changed: %s" % ", ".join(sorted(changed)))
+        manifests = set(m.manifest.path for m in self.modules_pool if m.manifest is not None)
+        self.modules_pool.invalidate_files(changed)
+        if changed & (manifests | self.watcher.dirs):
+            self.reload_needed = True
+        return changed
+
+    def reload_if_needed(self):
+        """Read the modules again if a manifest changed. Return True if the
+        pool was reloaded."""
+        if not self.reload_needed:
+            return False
+        logging.info("Manifests changed, reading the modules again")
+        old_pool = self.modules_pool
+        self.modules_pool = self._load_pool()
+        self.modules_pool.reuse_parsed_files(old_pool)
+        self.reload_needed = False
+        return True
+
+    def update_watched_paths(self):
+        """Watch the files found since the pool was built, e.g. includes"""
+        files, dirs = self.modules_pool.get_watched_paths()
+        self.watcher.update(files, dirs)
+
+    def close(self):
+        self.watcher.close()
+
+
+class Server(object):
+    def __init__(self, options, env, modules_pool, parse_options, load_pool, run_command, socket_path=None):
+        self.options = options
+        self.env = env
+        self.root = os.getcwd()
+        self.socket_path = get_socket_path(socket_path)
+        self._parse_options = parse_options
+        self._run_command = run_command
+        self._socket = None
+        self._pool = WatchedPool(modules_pool, load_pool)
+
+    def serve_forever(self):
+        self._listen()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        logging.info("hdlmake server listening on %s" % self.socket_path)
+        try:
+            while True:
+                waited = [self._socket]
+                if self._pool.watcher.fileno() is not None:
+                    waited.append(self._pool.watcher.fileno())
+                readable, _, _ = select.select(waited, [], [])
+                if self._socket in readable:
+                    connection, _ = self._socket.accept()
+                    try:
+                        self._serve_connection(connection)
+                    finally:
+                        connection.close()
+                else:
+                    self._pool.refresh()
+        except KeyboardInterrupt:
+            logging.info("hdlmake server stopped")
+        finally:
+            self._socket.close()
+            os.remove(self.socket_path)
+            self._pool.close()
+
+    def _listen(self):
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except socket.error as e:
+                if e.errno not in [errno.ECONNREFUSED, errno.ENOENT]:
+                    raise
+                os.remove(self.socket_path)  # left over by a dead server
+            else:
+                probe.close()
+                logging.error("Another hdlmake server is listening on %s" % self.socket_path)
+                sys.exit("Exiting")
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.socket_path)
+        self._socket.listen(5)
+
+    def _serve_connection(self, connection):
+        try:
+            request = _receive(connection)
+        except ValueError:
+            logging.warning("Malformed request")
+            return
+        reply = self._run_request(request)
+        connection.sendall(json.dumps(reply) + "\n")
+
+    def _run_request(self, request):
+        argv = request.get("argv", [])
+        if request.get("cwd") != self.root:
+            return {"status": None}
+
+        stdout, stderr = sys.stdout, sys.stderr
+        handlers = [h for h in logging.getLogger().handlers if isinstance(h, logging.StreamHandler)]
+        streams = [h.stream for h in handlers]
+        level = logging.getLogger().level
+        out, err = StringIO(), StringIO()
+        sys.stdout, sys.stderr = out, err
+        for handler in handlers:
+            handler.stream = err
+        status = 0
+        try:
+            options = self._parse_options(argv)
+            if any(getattr(options, o) != getattr(self.options, o) for o in _POOL_OPTIONS):
+                return {"status": None}
+            numeric_level = getattr(logging, options.log.upper(), None)
+            if isinstance(numeric_level, int):
+                logging.getLogger().setLevel(numeric_level)
+            global_mod.options = options
+            self._pool.refresh()
+            self._pool.reload_if_needed()
+            self._run_command(options, self.env, self._pool.modules_pool)
+        except SystemExit as e:
+            status = _exit_status(e.code, err)
+        except Exception:
+            # a broken manifest mustn't stop the server: the previous pool
+            # is kept until the modules can be read again
+            traceback.print_exc(file=err)
+            status = 1
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            for handler, stream in zip(handlers, streams):
+                handler.stream = stream
+            logging.getLogger().setLevel(level)
+            global_mod.options = self.options
+        self._pool.update_watched_paths()
+        return {"status": status,
+                "stdout": out.getvalue().decode("utf-8", "replace"),
+                "stderr": err.getvalue().decode("utf-8", "replace")}
+
+
+def watch(options, env, modules_pool, load_pool, get_actions, run_actions):
+    """Run the automatic flow, then run it again every time a manifest or a
+    source file changes.
+
+    The synthesis project is only updated when the modules were read again,
+    as editing a source file doesn't change the project. The Makefile is
+    only written when its content changes.
+    """
+    from action import GenerateSynthesisProject
+    pool = WatchedPool(modules_pool, load_pool)
+    options.command = "auto"
+    update_project = True
+    try:
+        while True:
+            if pool.reload_needed:
+                try:
+                    pool.reload_if_needed()
+                except SystemExit:
+                    logging.error("Can't read the modules, waiting for changes")
+                    pool.refresh(pool.watcher.wait())
+                    continue
+                update_project = True
+
+            modules_pool = pool.modules_pool
+            try:
+                action = get_actions(options, env, modules_pool)
+                if not update_project:
+                    action = [a for a in action if a is not GenerateSynthesisProject]
+                run_actions(action, modules_pool, options, env)
+                update_project = False
+            except SystemExit as e:
+                if e.code:
+                    logging.error("The automatic flow failed, waiting for changes")
+            pool.update_watched_paths()
+
+            logging.info("Watching %d files for changes" % len(pool.watcher.files))
+            pool.refresh(pool.watcher.wait())
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
+    finally:
+        pool.close()
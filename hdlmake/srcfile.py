@@ -29,8 +29,23 @@ from module import Module
 from util import path as path_mod
 from dep_file import DepFile, File
 
+def _get_include_dirs(module, include_dirs, dirname=None):
+    """Return the include directories as a tuple shared by the files of the
+    module having the same ones, followed by dirname relative to the current
+    directory. The tuples are kept by the module, so they go away with the
+    module pool."""
+    key = (tuple(include_dirs or ()), dirname, dirname and os.getcwd())
+    shared = module.shared_include_dirs
+    if key not in shared:
+        dirs = key[0]
+        if dirname is not None:
+            dirs += (path_mod.relpath(dirname),)
+        shared[key] = dirs
+    return shared[key]
+
 
 class SourceFile(DepFile):
+    __slots__ = ("library",)
     cur_index = 0
 
     def __init__(self, path, module, library=None):
@@ -43,13 +58,15 @@ class SourceFile(DepFile):
         DepFile.__init__(self,
                          file_path=path,
                          module=module,
-                         include_paths=module.include_dirs[:])
+                         include_paths=_get_include_dirs(module, module.include_dirs))
 
     def __hash__(self):
         return hash(self.path + self.library)
 
 
 class VHDLFile(SourceFile):
+    __slots__ = ("vcom_opt",)
+
     def __init__(self, path, module, library=None, vcom_opt=None):
         SourceFile.__init__(self, path=path, module=module, library=library)
         if not vcom_opt:
@@ -68,100 +85,99 @@ class VHDLFile(SourceFile):
 
 
 class VerilogFile(SourceFile):
+    __slots__ = ("vlog_opt", "vsim_opt", "include_dirs")
+
     def __init__(self, path, module, library=None, vlog_opt=None, include_dirs=None):
         SourceFile.__init__(self, path=path, module=module, library=library)
         if not vlog_opt:
             self.vlog_opt = ""
         else:
             self.vlog_opt = vlog_opt
-        self.include_dirs = []
-        if include_dirs:
-            self.include_dirs.extend(include_dirs)
-        self.include_dirs.append(path_mod.relpath(self.dirname))
+        self.include_dirs = _get_include_dirs(self.module, include_dirs, self.dirname)
 
 
 class SVFile(VerilogFile):
-    pass
+    __slots__ = ()
 
 
 class UCFFile(File):
-    pass
+    __slots__ = ()
 
 
 class TCLFile(File):
-    pass
+    __slots__ = ()
 
 
 class XISEFile(File):
-    pass
+    __slots__ = ()
 
 
 class CDCFile(File):
-    pass
+    __slots__ = ()
 
 
 class SignalTapFile(File):
-    pass
+    __slots__ = ()
 
 
 class SDCFile(File):
     # Synopsys Design Constraints
-    pass
+    __slots__ = ()
 
 
 class QIPFile(File):
-    pass
+    __slots__ = ()
 
 
 class DPFFile(File):
-    pass
+    __slots__ = ()
 
 
 class XMPFile(File):
     # Xilinx Embedded Micro Processor
-    pass
+    __slots__ = ()
 
 class PPRFile(File):
     # Xilinx PlanAhead Project
-    pass
+    __slots__ = ()
 
 class XPRFile(File):
     # Xilinx Vivado Project
-    pass
+    __slots__ = ()
 
 class BDFile(File):
     # Xilinx Block Design
-    pass
+    __slots__ = ()
 
 class XCOFile(File):
     # Xilinx Core Generator File
-    pass
+    __slots__ = ()
 
 # class NGCFile(SourceFile):
 #     def __init__(self, path, module):
 #         SourceFile.__init__(self, path=path, module=module)
 class NGCFile(File):
     # Xilinx Generated Netlist File
-    pass
+    __slots__ = ()
 
 class LDFFile(File):
     # Lattice Diamond Project File
-    pass
+    __slots__ = ()
 
 class LPFFile(File):
     # Lattice Preference/Constraint File
-    pass
+    __slots__ = ()
 
 class EDFFile(File):
     # EDIF Netlist Files
-    pass
+    __slots__ = ()
 
 class PDCFile(File):
     # Physical Design Constraints
-    pass
+    __slots__ = ()
 
 class WBGenFile(File):
-    pass
+    __slots__ = ()
 
 
 class SourceFileSet(set):
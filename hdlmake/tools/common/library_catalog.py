@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Find the libraries provided by a tool installation.
+
+Besides the few libraries every tool knows (ieee, std...), the libraries
+compiled with a simulator installation (unisim, xpm, altera_mf...) are mapped
+in its .ini file, modelsim.ini or xilinxsim.ini. The names read from it are
+cached in ~/.cache/hdlmake/libraries.json, keyed by the path of the file and
+trusted while its modification time stays the same, so the file is only read
+again when the installation changes.
+"""
+
+import os
+import json
+import logging
+
+from util import path as path_mod
+
+_catalogs = {}
+
+
+class _LibraryCache(object):
+    """Persistent cache of the libraries read from the .ini files"""
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = path_mod.cache_path("libraries.json")
+        self.filename = filename
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.filename, "r") as cache_file:
+                    self._entries = json.load(cache_file)
+            except (IOError, OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        tmp_name = "%s.%d.tmp" % (self.filename, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.filename)):
+                os.makedirs(os.path.dirname(self.filename))
+            with open(tmp_name, "w") as cache_file:
+                json.dump(self._entries, cache_file, indent=1, sort_keys=True)
+            os.rename(tmp_name, self.filename)
+        except (IOError, OSError) as e:
+            logging.debug("Can't write the library cache %s: %s" % (self.filename, e))
+
+    def get(self, ini_path, mtime):
+        entry = self._load().get(ini_path)
+        if entry is None or entry["mtime"] != mtime:
+            return None
+        return entry["libraries"]
+
+    def put(self, ini_path, mtime, libraries):
+        self._load()[ini_path] = {"mtime": mtime, "libraries": libraries}
+        self._save()
+
+
+_cache = _LibraryCache()
+
+
+def read_ini_libraries(ini_path):
+    """Return the names of the libraries mapped in a modelsim.ini or a
+    xilinxsim.ini file, as lines <library> = <path>. Only the [Library]
+    section is read in a file with sections; the others entry of
+    modelsim.ini, pointing to another file, is not a library."""
+    libraries = []
+    section = None
+    ini = open(ini_path, "r")
+    for line in ini:
+        line = line.split('--')[0].strip()
+        if line == "" or line[0] in ";#":
+            continue
+        if line.startswith('['):
+            section = line.strip('[]').strip().lower()
+            continue
+        if section not in [None, "library"] or '=' not in line:
+            continue
+        library = line.split('=')[0].strip().lower()
+        if library and library != "others" and library not in libraries:
+            libraries.append(library)
+    ini.close()
+    return libraries
+
+
+def get_ini_libraries(ini_path):
+    """Return the set of the libraries mapped in the .ini file, read once
+    per version of the file"""
+    ini_path = os.path.abspath(ini_path)
+    try:
+        mtime = os.path.getmtime(ini_path)
+    except OSError:
+        logging.debug("No library file %s" % ini_path)
+        return frozenset()
+    key = (ini_path, mtime)
+    if key not in _catalogs:
+        libraries = _cache.get(ini_path, mtime)
+        if libraries is None:
+            try:
+                libraries = read_ini_libraries(ini_path)
+            except (IOError, OSError) as e:
+                logging.warning("Can't read the libraries of %s: %s" % (ini_path, e))
+                libraries = []
+            else:
+                _cache.put(ini_path, mtime, libraries)
+            logging.debug("%d libraries mapped in %s" % (len(libraries), ini_path))
+        _catalogs[key] = frozenset(libraries)
+    return _catalogs[key]
+
+
+def get_standard_libraries(tool_object):
+    """Return the set of the libraries the tool provides: those listed by
+    its get_standard_libraries(), and those mapped in the .ini file returned
+    by its get_library_ini(), for the tools having one"""
+    libraries = set(library.lower() for library in tool_object.get_standard_libraries())
+    if hasattr(tool_object, "get_library_ini"):
+        ini_path = tool_object.get_library_ini()
+        if ini_path:
+            libraries.update(get_ini_libraries(ini_path))
+    return libraries
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Read the files of existing synthesis projects.
+
+An existing project is updated with the files missing from it and by
+removing the files no longer in the fileset, instead of adding every file
+again: the tool doesn't have to go through thousands of files, and leaves
+the project untouched when nothing changed. The paths returned here are
+relative to the current directory, like the rel_path() of the source files.
+"""
+
+import os
+import logging
+from xml.etree import cElementTree as ElementTree
+
+
+def _local_name(tag):
+    """Strip the namespace of an ElementTree tag"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _normalize(path, base):
+    return os.path.normpath(os.path.relpath(os.path.join(base, path)))
+
+
+def read_xpr_files(path):
+    """Return the design sources and the constraints of a Vivado (.xpr) or
+    PlanAhead (.ppr) project. The files copied into the project directory
+    are left out, as hdlmake never adds them."""
+    base = os.path.dirname(path) or "."
+    files = []
+    fileset_types = []
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        tag = _local_name(element.tag)
+        if tag == "FileSet":
+            if event == "start":
+                fileset_types.append(element.get("Type"))
+            else:
+                fileset_types.pop()
+        elif tag == "File" and event == "start" and fileset_types[-1:] in [["DesignSrcs"], ["Constrs"]]:
+            file_path = element.get("Path", "")
+            if file_path.startswith("$PPRDIR/"):
+                files.append(_normalize(file_path[len("$PPRDIR/"):], base))
+        if event == "end":
+            element.clear()  # the attributes were read at the start
+    return files
+
+
+def read_ldf_files(path):
+    """Return the sources of the default implementation of a Diamond (.ldf)
+    project"""
+    base = os.path.dirname(path) or "."
+    tree = ElementTree.parse(path)
+    root = tree.getroot()
+    default = root.get("default_implementation")
+    for implementation in root.iter():
+        if _local_name(implementation.tag) != "Implementation":
+            continue
+        if default is not None and implementation.get("title") != default:
+            continue
+        return [_normalize(source.get("name"), base)
+                for source in implementation
+                if _local_name(source.tag) == "Source" and source.get("name")]
+    return []
+
+
+def get_changes(current, files, extensions):
+    """Compare the paths in a project with the source files it should have.
+
+    Return the files missing from the project, and the paths in the project
+    that are not in the files anymore. Only the paths with one of the given
+    extensions are removed: the files added to the project by other means
+    than hdlmake are kept.
+    """
+    current_paths = set(current)
+    wanted_paths = set(os.path.normpath(f.rel_path()) for f in files)
+    added = [f for f in files if os.path.normpath(f.rel_path()) not in current_paths]
+    removed = []
+    for path in current:
+        extension = os.path.splitext(path)[1][1:].lower()
+        if path not in wanted_paths and extension in extensions:
+            removed.append(path)
+            wanted_paths.add(path)  # listed once
+    return added, removed
+
+
+def log_changes(name, added, removed):
+    logging.info("%s project: %d files to add, %d files to remove" % (name, len(added), len(removed)))
+    for f in added:
+        logging.debug("Adding %s" % f.rel_path())
+    for path in removed:
+        logging.debug("Removing %s" % path)
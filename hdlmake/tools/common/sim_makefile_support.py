@@ -23,9 +23,25 @@
 
 from makefile_writer import MakefileWriter
 import os
+import re
 import string
+import itertools
 from string import Template
 
+# marker of the mapping of the vendor libraries compiled by hdlmake vendor-libs
+VENDOR_LIBS_MARKER = ".vendor_libs"
+
+
+def timing_variables():
+    """Return the makefile variables of the timing shim: a recipe run as
+    $(TIMED) <command> logs the time taken by the command. The shim is run
+    by HDLMAKE_TIMING, which can be given to make to use another python or
+    another copy of the script."""
+    from util.timing import TIMING_LOG, get_shim_command
+    return ("HDLMAKE_TIMING ?= %s\n" % get_shim_command() +
+            "HDLMAKE_TIMING_LOG := %s\n" % TIMING_LOG +
+            "TIMED = $(HDLMAKE_TIMING) $(HDLMAKE_TIMING_LOG) $@ \"$^\" --\n")
+
 
 class VsimMakefileWriter(MakefileWriter):
     """A Makefile writer for simulation suitable for vsim based simulators.
@@ -34,6 +50,16 @@ class VsimMakefileWriter(MakefileWriter):
       - Modelsim
       - Riviera
     """
+
+    # options of the vendor libraries
+    vendor_library_flags = "-quiet"
+    # vlog option defining a Verilog macro, added to vlog_opt by hdlmake matrix
+    define_option = "+define+%s"
+    # vsim options of the tests run by hdlmake regress
+    plusarg_option = "+%s"
+    generic_option = "-g%s=%s"
+    seed_option = "-sv_seed %s"
+
     def __init__(self):
 
         # additional global flags to pass to every invocation of these commands
@@ -55,6 +81,21 @@ class VsimMakefileWriter(MakefileWriter):
         # These are files copied into your working directory by a make rule
         # The key is the filename, the value is the file source path
         self.copy_rules = {}
+
+        # Order the compilations for parallel make runs: critical path first,
+        # one compilation at a time in each library
+        self.schedule = False
+
+        # Compile the files of one library and one level of the dependency
+        # graph with a single vcom/vlog run
+        self.batch = False
+
+        # Log the time taken by every compilation (see util.timing)
+        self.timing = False
+
+        # Vendor libraries compiled by hdlmake vendor-libs, mapped from the
+        # cache (see tools.common.vendor_libs)
+        self.vendor_libraries = []
         super(VsimMakefileWriter, self).__init__()
 
     def generate_simulation_makefile(self, fileset, top_module):
@@ -64,11 +105,17 @@ class VsimMakefileWriter(MakefileWriter):
         etc are defined by the specific tool.
         """
         from srcfile import VerilogFile, VHDLFile, SVFile
-        
-	self.vlog_flags.append(self.__get_rid_of_vsim_incdirs(top_module.vlog_opt))
-	self.vcom_flags.append(top_module.vcom_opt)
-	self.vmap_flags.append(top_module.vmap_opt)
-	self.vsim_flags.append(top_module.vsim_opt) 
+
+        from tools.common.sim_tops import get_top_modules, has_multiple_tops, write_top_rules
+
+        self._add_top_module_flags(top_module)
+        vendor_deps = self.additional_deps[:]
+        if self.vendor_libraries:
+            self.additional_deps.append(VENDOR_LIBS_MARKER)
+            self.additional_clean.append(VENDOR_LIBS_MARKER)
+        tops = get_top_modules(top_module) if has_multiple_tops(top_module) else []
+        for top in tops:
+            self.additional_clean.extend(["%s.log" % top, "%s.transcript" % top, "%s.wlf" % top])
 
         tmp = """## variables #############################
 PWD := $(shell pwd)
@@ -84,6 +131,8 @@ PWD := $(shell pwd)
         self.writeln("VSIM_FLAGS := %s" % (' '.join(self.vsim_flags)))
         self.writeln("VLOG_FLAGS := %s" % (' '.join(self.vlog_flags)))
         self.writeln("VMAP_FLAGS := %s" % (' '.join(self.vmap_flags)))
+        if self.timing:
+            self.write(timing_variables())
         self.write("VERILOG_SRC := ")
         for vl in fileset.filter(VerilogFile):
             self.write(vl.rel_path() + " \\\n")
@@ -120,13 +169,36 @@ PWD := $(shell pwd)
         self.write(' '.join([lib + "/." + lib for lib in libs]))
         self.write('\n')
 
+        order_only = {}
+        groups = []
+        if self.batch:
+            from tools.common.sim_schedule import get_compile_groups
+            groups = get_compile_groups(fileset, self._get_batch_key)
+            if self.schedule:
+                order_only = self._write_schedule(groups, lambda group: group.path)
+            else:
+                self.write("SIM_OBJ := ")
+                for group in groups:
+                    self.write(group.path + " \\\n")
+                self.write('\n')
+        elif self.schedule:
+            order_only = self._write_schedule(fileset, self._get_marker)
+
         self.writeln("## rules #################################")
         self.writeln()
         self.writeln("local: sim_pre_cmd simulation sim_post_cmd")
         self.writeln()
-        self.writeln("simulation: %s $(LIB_IND) $(VERILOG_OBJ) $(VHDL_OBJ)" % (' '.join(self.additional_deps)),)
-        self.writeln("$(VERILOG_OBJ) : " + ' '.join(self.additional_deps))
-        self.writeln("$(VHDL_OBJ): $(LIB_IND) " + ' '.join(self.additional_deps))
+        if self.schedule:
+            # make starts the prerequisites in the given order
+            self.writeln("simulation: %s $(LIB_IND) $(SIM_OBJ)" % (' '.join(self.additional_deps)),)
+            self.writeln("$(SIM_OBJ): " + ' '.join(self.additional_deps))
+        elif self.batch:
+            self.writeln("simulation: %s $(LIB_IND) $(SIM_OBJ)" % (' '.join(self.additional_deps)),)
+            self.writeln("$(SIM_OBJ): $(LIB_IND) " + ' '.join(self.additional_deps))
+        else:
+            self.writeln("simulation: %s $(LIB_IND) $(VERILOG_OBJ) $(VHDL_OBJ)" % (' '.join(self.additional_deps)),)
+            self.writeln("$(VERILOG_OBJ) : " + ' '.join(self.additional_deps))
+            self.writeln("$(VHDL_OBJ): $(LIB_IND) " + ' '.join(self.additional_deps))
         self.writeln()
 
         simcommands = string.Template("""sim_pre_cmd:
@@ -152,6 +224,21 @@ sim_post_cmd:
 
         for filename, filesource in self.copy_rules.iteritems():
             self.write(self.__create_copy_rule(filename, filesource))
+        if self.vendor_libraries:
+            # mapped again when a library is compiled again
+            done_markers = [library.done_marker for library in self.vendor_libraries]
+            self.writeln("%s: %s" % (VENDOR_LIBS_MARKER, ' '.join(vendor_deps + done_markers)))
+            self.writeln("\t\t%s && touch $@" % self._get_vendor_map_command("$(VMAP_FLAGS)"))
+            self.writeln()
+            for library in self.vendor_libraries:
+                self.writeln("%s:" % library.done_marker)
+                self.writeln("\t\t@echo \"The vendor library %s is not compiled, run hdlmake vendor-libs\" && false" %
+                             library.name)
+                self.writeln()
+
+        if tops:
+            write_top_rules(self, [(top, self._get_top_prerequisites(fileset, top, groups), [],
+                                    self.get_run_command(fileset, top)) for top in tops])
 
         self.writeln("clean:")
         tmp = "\t\trm -rf $(LIBS) " + ' '.join(self.additional_clean)
@@ -161,13 +248,18 @@ sim_post_cmd:
         self.writeln()
 
         for lib in libs:
-            self.write(lib + "/." + lib + ":\n")
+            self.write(lib + "/." + lib + ":")
+            self.write(' '.join([""] + order_only.get(lib, [])) + "\n")
             vmap_command = "vmap $(VMAP_FLAGS)"
             self.write(' '.join(["\t(vlib", lib, "&&", vmap_command,
                                          lib, "&&", "touch", lib + "/." + lib, ")"]))
             self.write(' '.join(["||", "rm -rf", lib, "\n"]))
             self.write('\n\n')
 
+        if self.batch:
+            self._write_batch_rules(groups, fileset, order_only)
+            return
+
         # rules for all _primary.dat files for sv
         for vl in fileset.filter(VerilogFile):
             self.write("%s: %s" % (os.path.join(vl.library, vl.purename, ".%s_%s" % (vl.purename, vl.extension())),
@@ -180,6 +272,8 @@ sim_post_cmd:
                     self.write(" \\\n" + os.path.join(dep_file.library, name, ".%s_%s" % (name, extension)))
                 else: #the file is included -> we depend directly on the file
                     self.write(" \\\n" + dep_file.rel_path())
+            if vl in order_only:
+                self.write(" \\\n" + ' '.join(order_only[vl]))
 
             self.writeln()
 
@@ -194,8 +288,9 @@ sim_post_cmd:
             # self.write(incdir)
             # self.writeln(vl.vlog_opt+" $<")
             ####
-            compile_template = Template("\t\tvlog -work ${library} $$(VLOG_FLAGS) ${sv_option} +incdir+${include_dirs} ${vlog_opt} $$<")
-            compile_line = compile_template.substitute(library=vl.library,
+            compile_template = Template("\t\t${timed}vlog -work ${library} $$(VLOG_FLAGS) ${sv_option} +incdir+${include_dirs} ${vlog_opt} $$<")
+            compile_line = compile_template.substitute(timed=self._timed(),
+                                                 library=vl.library,
                                                  sv_option="-sv" if isinstance(vl, SVFile) else "",
                                                  include_dirs='+'.join(vl.include_dirs),
                                                  vlog_opt=vl.vlog_opt)
@@ -219,12 +314,184 @@ sim_post_cmd:
                     self.write(" \\\n" + os.path.join(dep_file.library, name, ".%s_%s" % (name, extension)))
                 else: #the file is included -> we depend directly on the file
                     self.write(" \\\n" + dep_file.rel_path())
+            if vhdl in order_only:
+                self.write(" \\\n" + ' '.join(order_only[vhdl]))
 
             self.writeln()
-            self.writeln(' '.join(["\t\tvcom $(VCOM_FLAGS)", vhdl.vcom_opt, "-work", lib, "$< "]))
+            self.writeln(' '.join(["\t\t" + self._timed() + "vcom $(VCOM_FLAGS)", vhdl.vcom_opt, "-work", lib, "$< "]))
             self.writeln("\t\t@mkdir -p $(dir $@) && touch $@ \n")
             self.writeln()
 
+    def _timed(self):
+        return "$(TIMED) " if self.timing else ""
+
+    def _get_top_prerequisites(self, fileset, top, groups):
+        """Return the compilations the top needs: the markers of its files,
+        or the groups holding them in batch mode"""
+        from tools.common.sim_tops import get_top_files
+        top_files = get_top_files(fileset, top)
+        if self.batch:
+            prerequisites = [group.path for group in groups
+                             if any(f in top_files for f in group.files)]
+        else:
+            prerequisites = [self._get_marker(f) for f in top_files]
+        return ["$(LIB_IND)"] + prerequisites + self.additional_deps
+
+    def get_run_command(self, fileset, top, flags="$(VSIM_FLAGS)", name=None):
+        """Return the command running the simulation of the top in batch
+        mode, writing name.transcript and name.wlf (the top by default)"""
+        from tools.common.sim_tops import get_top_library
+        name = name or top
+        return 'vsim -c %s -l %s.transcript -wlf %s.wlf -do "run -all; quit -f" %s.%s' % (
+            flags, name, name, get_top_library(fileset, top), top)
+
+    def _get_marker(self, source_file):
+        return os.path.join(source_file.library, source_file.purename,
+                            ".%s_%s" % (source_file.purename, source_file.extension()))
+
+    def _get_vendor_map_command(self, vmap_flags):
+        return " && ".join("vmap %s %s %s" % (vmap_flags, library.name, library.library_path)
+                           for library in self.vendor_libraries)
+
+    def get_vendor_library_commands(self, library, files, used):
+        """Return the commands compiling the files of the vendor library, in
+        the directory of the library in the cache. The libraries it uses are
+        mapped in a local modelsim.ini."""
+        commands = ["vlib " + library.name]
+        commands.extend("vmap %s %s" % (used_library.name, used_library.library_path) for used_library in used)
+        # the consecutive files of a language are compiled together
+        for kind, kind_files in itertools.groupby(files, key=lambda f: self._get_batch_key(f)[0]):
+            paths = ' '.join(f.path for f in kind_files)
+            if kind == "vhdl":
+                commands.append("vcom %s -work %s %s" % (self.vendor_library_flags, library.name, paths))
+            else:
+                commands.append("vlog %s -work %s %s %s" % (self.vendor_library_flags, library.name,
+                                                            "-sv" if kind == "sv" else "", paths))
+        return commands
+
+    def _get_batch_key(self, source_file):
+        from srcfile import VHDLFile, SVFile
+        if isinstance(source_file, VHDLFile):
+            return ("vhdl", source_file.vcom_opt)
+        elif isinstance(source_file, SVFile):
+            return ("sv", source_file.vlog_opt)
+        return ("verilog", source_file.vlog_opt)
+
+    def _write_batch_rules(self, groups, fileset, order_only):
+        """Write a rule for each group of files, compiling all of them when
+        one of the files or of their dependencies changes"""
+        for group in groups:
+            sources = [f.rel_path() for f in group.files]
+            includes = sorted(set(d.rel_path() for f in group.files for d in f.depends_on
+                                  if d is not f and d not in fileset))
+            self.write("%s: %s" % (group.path, " \\\n".join(sources)))
+            for dep in sorted(d.path for d in group.depends_on) + includes:
+                self.write(" \\\n" + dep)
+            if group in order_only:
+                self.write(" \\\n" + ' '.join(order_only[group]))
+            self.writeln()
+            if group.kind == "vhdl":
+                self.writeln(' '.join(["\t\t" + self._timed() + "vcom $(VCOM_FLAGS)", group.files[0].vcom_opt, "-work", group.library] +
+                                      sources))
+            else:
+                include_dirs = []
+                for source_file in group.files:
+                    include_dirs.extend(d for d in source_file.include_dirs if d not in include_dirs)
+                self.writeln(' '.join(["\t\t" + self._timed() + "vlog -work", group.library, "$(VLOG_FLAGS)",
+                                       "-sv" if group.kind == "sv" else "",
+                                       "+incdir+" + '+'.join(include_dirs), group.files[0].vlog_opt] +
+                                      sources))
+            self.writeln("\t\t@touch $@")
+            self.writeln()
+
+    def _write_schedule(self, units, marker):
+        """Write the compilation markers in scheduling order, and return the
+        order-only prerequisites of the libraries and of the compilation
+        units (files or groups of files).
+
+        The files of a library are compiled one after the other, in the
+        order of the schedule: concurrent compilations could corrupt the
+        library. The libraries are created one at a time, as vmap rewrites
+        the ini file, a library being created after the libraries it uses."""
+        from tools.common.sim_schedule import get_compile_order, get_library_waves
+
+        order_only = {}
+        previous_lib = None
+        for wave in get_library_waves(units):
+            for lib in wave:
+                if previous_lib is not None:
+                    order_only[lib] = ["|", previous_lib + "/." + previous_lib]
+                previous_lib = lib
+
+        self.write("SIM_OBJ := ")
+        last_in_lib = {}
+        for unit in get_compile_order(units):
+            self.write(marker(unit) + " \\\n")
+            order_only[unit] = ["|", unit.library + "/." + unit.library]
+            if unit.library in last_in_lib:
+                order_only[unit].append(last_in_lib[unit.library])
+            last_in_lib[unit.library] = marker(unit)
+        self.write('\n')
+        return order_only
+
+    def get_ninja_rules(self, fileset, top_module):
+        """Describe the vsim commands for the ninja backend (see
+        tools.common.sim_ninja_support)"""
+        from tools.common.sim_tops import get_top_modules, has_multiple_tops
+
+        self._add_top_module_flags(top_module)
+
+        variables = [(var, self._resolve_make_variables(value))
+                     for var, value in sorted(self.custom_variables.iteritems())]
+        variables.append(("VCOM_FLAGS", self._resolve_make_variables(' '.join(self.vcom_flags))))
+        variables.append(("VSIM_FLAGS", self._resolve_make_variables(' '.join(self.vsim_flags))))
+        variables.append(("VLOG_FLAGS", self._resolve_make_variables(' '.join(self.vlog_flags))))
+        variables.append(("VMAP_FLAGS", self._resolve_make_variables(' '.join(self.vmap_flags))))
+
+        prerequisites = []
+        for filename, filesource in sorted(self.copy_rules.iteritems()):
+            filesource = self._resolve_make_variables(filesource)
+            if "$$" in filesource:
+                # the source depends on the environment: it can't be an input
+                prerequisites.append({"outputs": [filename],
+                                      "command": "cmp -s %s $out || cp %s $out" % (filesource, filesource)})
+            else:
+                prerequisites.append({"outputs": [filename],
+                                      "inputs": [filesource],
+                                      "command": "cmp -s $in $out || cp $in $out"})
+
+        if self.vendor_libraries:
+            prerequisites.append({"outputs": [VENDOR_LIBS_MARKER],
+                                  "inputs": sorted(self.copy_rules) + [library.done_marker
+                                                                       for library in self.vendor_libraries],
+                                  "command": "%s && touch $out" % self._get_vendor_map_command("$VMAP_FLAGS")})
+
+        rules = {"variables": variables,
+                 "prerequisites": prerequisites,
+                 "library": "vlib $lib && vmap $VMAP_FLAGS $lib",
+                 "compile": {"vhdl": "vcom $VCOM_FLAGS $opt -work $lib $in",
+                             "verilog": "vlog -work $lib $VLOG_FLAGS $incdirs $opt $in",
+                             "sv": "vlog -work $lib $VLOG_FLAGS -sv $incdirs $opt $in"},
+                 "include_flags": lambda dirs: "+incdir+" + '+'.join(dirs)}
+        if has_multiple_tops(top_module):
+            rules["run"] = [{"top": top,
+                             "command": self.get_run_command(fileset, top, "$VSIM_FLAGS")}
+                            for top in get_top_modules(top_module)]
+        return rules
+
+    def _add_top_module_flags(self, top_module):
+        self.vlog_flags.append(self.__get_rid_of_vsim_incdirs(top_module.vlog_opt))
+        self.vcom_flags.append(top_module.vcom_opt)
+        self.vmap_flags.append(top_module.vmap_opt)
+        self.vsim_flags.append(top_module.vsim_opt)
+
+    def _resolve_make_variables(self, text):
+        """Expand the custom variables used in text. The other make variables
+        are left to the shell, which reads them from the environment."""
+        for var, value in self.custom_variables.iteritems():
+            text = text.replace("$(%s)" % var, value)
+        return re.sub(r"\$\((\w+)\)", r"$${\1}", text)
+
     def __create_copy_rule(self, name, src):
         """Get a Makefile rule named name, which depends on src, copying it to
         the local directory."""
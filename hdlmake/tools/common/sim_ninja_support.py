@@ -0,0 +1,279 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Ninja build files for simulation.
+
+The simulators supporting the ninja backend describe their commands with a
+get_ninja_rules(fileset, top_module) method, returning a dictionary with:
+
+  - "variables": list of (name, value) pairs defined at the top of the file
+  - "prerequisites": list of dictionaries with "outputs", "inputs" and
+    "command", for files needed by every compilation (e.g. modelsim.ini)
+  - "library": command creating the library $lib, or None
+  - "compile": dictionary with the "vhdl", "verilog" and "sv" commands
+    compiling $in into library $lib ("sv" defaults to "verilog"). $opt holds the file options and
+    $incdirs the include directories, formatted by "include_flags"
+  - "include_flags": function formatting a list of include directories
+  - "workdir": function returning the directory of a library, given to the
+    compile commands as $workdir, if the tool needs it
+  - "elaborate": dictionary (or list of dictionaries, one per top) with
+    "outputs", "command" and optionally "inputs", "implicit", "depfile" and
+    "pool", for the step run after all compilations. Without "implicit",
+    the sources lacking a compile command are added to its inputs. The
+    elaborations of a pool (e.g. "lib_work") are run one at a time
+  - "run": list of dictionaries with "top", "command" and "inputs", for
+    the elab_<top> and run_<top> targets of a simulation with several tops
+    (see tools.common.sim_tops). Without "inputs", a top needs every
+    compilation
+
+Every command is written as is, so a literal $ has to be written $$.
+"""
+
+import os
+from makefile_writer import MakefileWriter
+
+
+def escape_path(path):
+    """Escape a path for the build and input lists of a ninja file"""
+    return path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+
+def escape_value(value):
+    """Escape a text for the right side of a ninja variable"""
+    return value.replace("$", "$$")
+
+
+def marker_path(source_file):
+    """Return the file touched after the compilation of the source file, the
+    same one as in the simulation makefiles"""
+    return os.path.join(source_file.library, source_file.purename,
+                        ".%s_%s" % (source_file.purename, source_file.extension()))
+
+
+def library_marker_path(library):
+    return os.path.join(library, "." + library)
+
+
+class NinjaWriter(MakefileWriter):
+    """Write a ninja file, buffered and only replaced when it changed"""
+
+    def __init__(self, filename=None):
+        super(NinjaWriter, self).__init__(filename or "build.ninja")
+
+    def variable(self, key, value, indent=0):
+        if value is None:
+            return
+        self.writeln("%s%s = %s" % ("  " * indent, key, value))
+
+    def pool(self, name, depth):
+        self.writeln("pool %s" % name)
+        self.variable("depth", depth, indent=1)
+        self.writeln()
+
+    def rule(self, name, command, description=None, depfile=None, deps=None,
+             restat=False, generator=False):
+        self.writeln("rule %s" % name)
+        self.variable("command", command, indent=1)
+        self.variable("description", description, indent=1)
+        self.variable("depfile", depfile, indent=1)
+        self.variable("deps", deps, indent=1)
+        if restat:
+            self.variable("restat", 1, indent=1)
+        if generator:
+            self.variable("generator", 1, indent=1)
+        self.writeln()
+
+    def build(self, outputs, rule, inputs=(), implicit=(), order_only=(),
+              variables=(), pool=None):
+        line = "build %s: %s" % (' '.join(escape_path(o) for o in outputs), rule)
+        if inputs:
+            line += " " + ' '.join(escape_path(i) for i in inputs)
+        if implicit:
+            line += " | " + ' '.join(escape_path(i) for i in implicit)
+        if order_only:
+            line += " || " + ' '.join(escape_path(i) for i in order_only)
+        self.writeln(line)
+        for key, value in variables:
+            self.variable(key, value, indent=1)
+        if pool:
+            self.variable("pool", pool, indent=1)
+        self.writeln()
+
+    def default(self, targets):
+        self.writeln("default %s" % ' '.join(escape_path(t) for t in targets))
+
+
+class SimNinjaWriter(NinjaWriter):
+    """Ninja counterpart of the simulation makefiles.
+
+    Every source file is compiled by its own build statement, touching the
+    same marker file as the makefiles do. Compilations into one library
+    share a pool of depth 1, as the simulators don't support concurrent
+    writes to a library. The files included by a Verilog source are written
+    to a depfile when it's compiled.
+    """
+
+    def generate_simulation_ninja(self, fileset, top_module, rules):
+        from srcfile import VerilogFile, VHDLFile, SVFile
+
+        self.writeln("ninja_required_version = 1.3")
+        self.writeln()
+        if rules.get("variables"):
+            for name, value in rules["variables"]:
+                self.variable(name, value)
+            self.writeln()
+
+        libs = sorted(set(f.library for f in fileset))
+        for lib in libs:
+            self.pool("lib_" + lib, 1)
+        elaborations = rules.get("elaborate") or []
+        if isinstance(elaborations, dict):
+            elaborations = [elaborations]
+        for pool in sorted(set(e["pool"] for e in elaborations if e.get("pool"))):
+            if pool not in ["lib_" + lib for lib in libs]:
+                self.pool(pool, 1)
+
+        order_only = []
+        if top_module.sim_pre_cmd:
+            self.rule("sim_pre_cmd", top_module.sim_pre_cmd)
+            self.build(["sim_pre_cmd"], "sim_pre_cmd")
+            order_only.append("sim_pre_cmd")
+
+        prerequisites = []
+        for index, prerequisite in enumerate(rules.get("prerequisites", [])):
+            name = "prerequisite_%d" % index
+            # the copy leaves the output untouched when it's up to date
+            self.rule(name, prerequisite["command"], restat=True)
+            self.build(prerequisite["outputs"], name,
+                       implicit=prerequisite.get("inputs", []),
+                       order_only=order_only)
+            prerequisites.extend(prerequisite["outputs"])
+
+        lib_markers = []
+        if rules.get("library"):
+            self.rule("library",
+                      "%s && touch $out" % rules["library"],
+                      description="library $lib")
+            for lib in libs:
+                self.build([library_marker_path(lib)], "library",
+                           implicit=prerequisites,
+                           order_only=order_only,
+                           variables=[("lib", lib)],
+                           pool="lib_" + lib)
+                lib_markers.append(library_marker_path(lib))
+
+        compile_rules = rules.get("compile", {})
+        for kind, command in sorted(compile_rules.items()):
+            command += " && mkdir -p $$(dirname $out) && touch $out"
+            depfile = None
+            deps = None
+            if kind in ["verilog", "sv"]:
+                command += " && echo \"$out: $includes\" > $out.d"
+                depfile = "$out.d"
+                deps = "gcc"
+            self.rule(kind, command,
+                      description="%s $in" % kind,
+                      depfile=depfile,
+                      deps=deps)
+
+        markers = []
+        sources = []
+        for source_file in sorted(fileset, key=lambda f: f.path):
+            if isinstance(source_file, SVFile):
+                kind = "sv"
+            elif isinstance(source_file, VerilogFile):
+                kind = "verilog"
+            elif isinstance(source_file, VHDLFile):
+                kind = "vhdl"
+            else:
+                continue
+            if kind == "sv" and "sv" not in compile_rules:
+                kind = "verilog"
+            if kind not in compile_rules:
+                sources.append(source_file.rel_path())
+                continue
+            dependencies = []
+            includes = []
+            for dep_file in source_file.depends_on:
+                if dep_file is source_file:
+                    continue
+                if dep_file in fileset:
+                    dependencies.append(marker_path(dep_file))
+                else:
+                    includes.append(dep_file.rel_path())
+            variables = [("lib", source_file.library)]
+            if "workdir" in rules:
+                variables.append(("workdir", escape_value(rules["workdir"](source_file.library))))
+            if kind == "vhdl":
+                variables.append(("opt", escape_value(source_file.vcom_opt)))
+            else:
+                variables.append(("opt", escape_value(source_file.vlog_opt)))
+                variables.append(("incdirs", escape_value(rules["include_flags"](source_file.include_dirs))))
+                variables.append(("includes", escape_value(' '.join(sorted(includes)))))
+                includes = []
+            self.build([marker_path(source_file)], kind,
+                       inputs=[source_file.rel_path()],
+                       implicit=sorted(dependencies) + sorted(includes) + prerequisites,
+                       order_only=[library_marker_path(source_file.library)] if lib_markers else order_only,
+                       variables=variables,
+                       pool="lib_" + source_file.library)
+            markers.append(marker_path(source_file))
+
+        simulation = markers[:]
+        for index, elaborate in enumerate(elaborations):
+            name = "elaborate" if index == 0 else "elaborate_%d" % index
+            self.rule(name, elaborate["command"],
+                      description="elaborate $out",
+                      depfile="$out.d" if elaborate.get("depfile") else None,
+                      deps="gcc" if elaborate.get("depfile") else None)
+            if "implicit" in elaborate:
+                inputs = elaborate.get("inputs", [])
+                implicit = elaborate["implicit"]
+            else:
+                inputs = elaborate.get("inputs", []) + sources
+                implicit = []
+            self.build(elaborate["outputs"], name,
+                       inputs=inputs,
+                       implicit=implicit + markers + prerequisites,
+                       order_only=lib_markers or order_only,
+                       pool=elaborate.get("pool"))
+            simulation.extend(elaborate["outputs"])
+        self.build(["simulation"], "phony", inputs=simulation)
+
+        # never built, so the tops are run again every time
+        runs = rules.get("run") or []
+        for run in runs:
+            name = "run_" + run["top"]
+            self.rule(name, "%s > %s.log 2>&1" % (run["command"], run["top"]), description="run " + run["top"])
+            self.build(["elab_" + run["top"]], "phony", inputs=run.get("inputs") or ["simulation"])
+            self.build([name], name, implicit=["elab_" + run["top"]])
+        if runs:
+            self.build(["regress"], "phony", inputs=["run_" + run["top"] for run in runs])
+
+        local = ["simulation"]
+        if top_module.sim_pre_cmd:
+            local.insert(0, "sim_pre_cmd")
+        if top_module.sim_post_cmd:
+            self.rule("sim_post_cmd", top_module.sim_post_cmd)
+            self.build(["sim_post_cmd"], "sim_post_cmd", implicit=["simulation"])
+            local.append("sim_post_cmd")
+        self.build(["local"], "phony", inputs=local)
+        self.default(["local"])
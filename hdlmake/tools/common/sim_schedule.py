@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Order the compilations of a simulation over the solved dependencies.
+
+Only the relations between the compiled files (the files of the fileset)
+are considered: an included file is not compiled by itself. The relations
+are expected to be acyclic, but a cycle doesn't make the functions fail: the
+files left in a cycle are placed after the others.
+"""
+
+import os
+import heapq
+import hashlib
+import logging
+
+
+def get_dependencies(fileset):
+    """Return a dictionary mapping each file to the compiled files it uses"""
+    return dict((f, set(d for d in f.depends_on if d is not f and d in fileset))
+                for f in fileset)
+
+
+def _get_users(dependencies):
+    users = dict((f, set()) for f in dependencies)
+    for source_file, deps in dependencies.iteritems():
+        for dep_file in deps:
+            users[dep_file].add(source_file)
+    return users
+
+
+def _topological_order(dependencies, key):
+    """Kahn's algorithm, taking the ready file with the smallest key first"""
+    users = _get_users(dependencies)
+    pending = dict((f, len(deps)) for f, deps in dependencies.iteritems())
+    ready = [(key(f), f) for f, count in pending.iteritems() if count == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        _, source_file = heapq.heappop(ready)
+        order.append(source_file)
+        for user in users[source_file]:
+            pending[user] -= 1
+            if pending[user] == 0:
+                heapq.heappush(ready, (key(user), user))
+    if len(order) != len(dependencies):
+        cycle = sorted(set(dependencies) - set(order), key=key)
+        logging.warning("Circular dependencies between: " + ', '.join(str(f) for f in cycle))
+        order.extend(cycle)
+    return order
+
+
+def get_critical_path_lengths(fileset, cost=None):
+    """Return a dictionary mapping each file to the cost of the longest chain
+    of compilations starting with it (the file included). By default every
+    compilation costs 1."""
+    if cost is None:
+        cost = lambda f: 1
+    dependencies = get_dependencies(fileset)
+    users = _get_users(dependencies)
+    lengths = {}
+    for source_file in reversed(_topological_order(dependencies, key=lambda f: f.path)):
+        lengths[source_file] = cost(source_file) + max([lengths.get(u, 0) for u in users[source_file]] or [0])
+    return lengths
+
+
+def get_compile_order(fileset, cost=None):
+    """Return the files in an order satisfying their dependencies, where the
+    file starting the longest chain of compilations comes first among the
+    files that can be compiled"""
+    lengths = get_critical_path_lengths(fileset, cost)
+    return _topological_order(get_dependencies(fileset),
+                              key=lambda f: (-lengths[f], f.path))
+
+
+def get_levels(fileset):
+    """Return a dictionary mapping each file to its level: 0 for the files
+    that use no other file, 1 + the highest level of its dependencies for
+    the others"""
+    dependencies = get_dependencies(fileset)
+    levels = {}
+    for source_file in _topological_order(dependencies, key=lambda f: f.path):
+        levels[source_file] = 1 + max([levels.get(d, -1) for d in dependencies[source_file]] or [-1])
+    return levels
+
+
+def get_library_waves(fileset):
+    """Group the libraries in waves: a library only uses libraries from the
+    previous waves. Return a list of sorted lists of library names."""
+    dependencies = dict((f.library, set()) for f in fileset)
+    for source_file, deps in get_dependencies(fileset).iteritems():
+        dependencies[source_file.library].update(d.library for d in deps if d.library != source_file.library)
+    levels = {}
+    for lib in _topological_order(dependencies, key=lambda lib: lib):
+        levels[lib] = 1 + max([levels.get(d, -1) for d in dependencies[lib]] or [-1])
+    waves = [[] for _ in range(max(levels.values() or [-1]) + 1)]
+    for lib, level in levels.iteritems():
+        waves[level].append(lib)
+    return [sorted(wave) for wave in waves]
+
+
+class CompileGroup(object):
+    """Files compiled by a single command: they belong to the same library
+    and to the same level, so none of them uses another one.
+
+    A group has the attributes of a file used by the functions above, so
+    groups can be scheduled like files: its path is its marker file.
+    """
+
+    def __init__(self, library, kind, level, files, path):
+        self.library = library
+        self.kind = kind
+        self.level = level
+        self.files = files
+        self.path = path
+        self.depends_on = set()
+
+    def __str__(self):
+        return self.path
+
+
+def get_compile_groups(fileset, key):
+    """Group the files of the fileset by library, level and key(file). The
+    key tells which files can be compiled by the same command (e.g. the
+    language and the options), its first item is used to name the marker
+    file. Return the groups ordered by level and library.
+
+    The name of the marker holds a hash of the key and of the files of the
+    group: a file joining a group, even older than the marker, gives a new
+    marker, so the group is compiled again."""
+    levels = get_levels(fileset)
+    files = {}
+    for source_file in sorted(fileset, key=lambda f: f.path):
+        group_key = (levels[source_file], source_file.library, key(source_file))
+        files.setdefault(group_key, []).append(source_file)
+
+    groups = []
+    group_of = {}
+    for (level, library, file_key) in sorted(files):
+        group_files = files[(level, library, file_key)]
+        digest = hashlib.sha1('\n'.join([repr(file_key)] + [f.path for f in group_files])).hexdigest()
+        name = ".batch_%s_%d_%s" % (file_key[0], level, digest[:8])
+        group = CompileGroup(library, file_key[0], level, group_files,
+                             os.path.join(library, name))
+        groups.append(group)
+        for source_file in group.files:
+            group_of[source_file] = group
+
+    dependencies = get_dependencies(fileset)
+    for group in groups:
+        for source_file in group.files:
+            group.depends_on.update(group_of[d] for d in dependencies[source_file])
+        group.depends_on.discard(group)  # only with circular dependencies
+    return groups
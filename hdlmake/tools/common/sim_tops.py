@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Simulations with several tops.
+
+The top_module of a simulation can be a list of tops, e.g. the testbenches
+of a regression over the same sources. The sources are then compiled once,
+into the libraries shared by all the tops, and every top gets its own
+targets: elab_<top> elaborates it, run_<top> runs it in batch mode and
+writes the output of the simulator to <top>.log, and regress runs all the
+tops, in parallel with make -j. The runs are not stopped by a failing one
+with make -k.
+"""
+
+import logging
+
+
+def get_top_modules(top_module):
+    """Return the list of the tops of the simulation, as top_module can be
+    a single name or a list of names"""
+    if isinstance(top_module.top_module, basestring):
+        return [top_module.top_module]
+    return list(top_module.top_module)
+
+
+def has_multiple_tops(top_module):
+    """Tell if the simulation was given a list of tops, even of one top:
+    only then the makefile has the targets of every top"""
+    return not isinstance(top_module.top_module, basestring)
+
+
+def provides_top(source_file, top):
+    """Tell if the file provides the entity or the module named top"""
+    from dep_file import DepRelation
+    return any(rel.direction == DepRelation.PROVIDE and rel.rel_type == DepRelation.ENTITY and
+               rel.obj_name.split('.', 1)[-1].lower() == top.lower() for rel in source_file.rels)
+
+
+def get_top_library(fileset, top):
+    """Return the library of the file providing the top, work if no file
+    provides it"""
+    from srcfile import VerilogFile, VHDLFile
+    for source_file in sorted(fileset, key=lambda f: f.path):
+        if isinstance(source_file, (VerilogFile, VHDLFile)) and provides_top(source_file, top):
+            return source_file.library
+    return "work"
+
+
+def get_top_files(fileset, top):
+    """Return the files used by the top, dependencies first. If no file
+    provides the top, all the files are returned."""
+    from srcfile import VerilogFile, VHDLFile
+    sources = [f for f in sorted(fileset, key=lambda f: f.path)
+               if isinstance(f, (VerilogFile, VHDLFile))]
+    roots = [f for f in sources if provides_top(f, top)]
+    if not roots:
+        logging.warning("No file provides the top module %s, using all the files" % top)
+        roots = sources
+    ret = []
+    visited = set()
+
+    def visit(source_file):
+        if source_file in visited:
+            return
+        visited.add(source_file)
+        for dep_file in sorted(source_file.depends_on, key=lambda f: f.path):
+            if dep_file in fileset:
+                visit(dep_file)
+        ret.append(source_file)
+
+    for root in roots:
+        visit(root)
+    return ret
+
+
+def get_log_files(tops):
+    return ["%s.log" % top for top in tops]
+
+
+def write_top_rules(writer, tops):
+    """Write the elab_<top>, run_<top> and regress targets. tops is a list
+    of (top, prerequisites, elaboration commands, run command)."""
+    writer.writeln("## tops ##################################")
+    writer.writeln("regress: " + ' '.join("run_" + top for top, _, _, _ in tops))
+    writer.writeln()
+    for top, prerequisites, elab_commands, run_command in tops:
+        writer.writeln("elab_%s: %s" % (top, ' '.join(prerequisites)))
+        for command in elab_commands:
+            writer.writeln("\t\t" + command)
+        writer.writeln("run_%s: elab_%s" % (top, top))
+        writer.writeln("\t\t%s > %s.log 2>&1" % (run_command, top))
+        writer.writeln()
+    writer.writeln(".PHONY: regress " + ' '.join("elab_%s run_%s" % (top, top) for top, _, _, _ in tops))
+    writer.writeln()
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Compile the vendor libraries of the simulations once, in a shared cache.
+
+The libraries listed in the sim_vendor_libs manifest variable (e.g. unisim,
+xpm or altera_mf, with their sources) are compiled by ``hdlmake vendor-libs``
+into ~/.cache/hdlmake/vendor-libs, or into $HDLMAKE_VENDOR_LIBS, a directory
+the developers or the CI jobs can share. Each library has a directory per
+tool and tool version, and per key: a hash of the tool, of the compile
+options and of the content of the sources. A library is thus compiled once
+per combination, by the first run needing it, and the simulation makefiles
+map it from the cache instead of compiling it.
+
+A compiled library records the keys of the vendor libraries it was compiled
+against, and is compiled again when one of them changes. The compilation
+takes place in a temporary directory renamed at the end, so a failed or
+concurrent run never leaves a half compiled library behind.
+"""
+
+import os
+import json
+import shutil
+import pipes
+import hashlib
+import logging
+
+import global_mod
+from util import path as path_mod
+from util import process
+
+# file written in the directory of a library once it is compiled
+DONE_MARKER = ".hdlmake_done"
+
+VENDOR_SOURCE_EXTENSIONS = ['vhd', 'vhdl', 'v', 'sv']
+
+_digests = {}
+
+
+class VendorLibrary(object):
+    """A vendor library and its place in the cache"""
+
+    def __init__(self, name, paths, key, path):
+        self.name = name
+        self.paths = paths
+        self.key = key
+        self.path = path
+
+    @property
+    def library_path(self):
+        """The compiled library, as given to vmap or to ghdl -P"""
+        return os.path.join(self.path, self.name)
+
+    @property
+    def done_marker(self):
+        return os.path.join(self.path, DONE_MARKER)
+
+    def get_record(self):
+        """Return what was recorded when the library was compiled, None if
+        it is not compiled"""
+        try:
+            with open(self.done_marker, "r") as done_file:
+                return json.load(done_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def is_compiled(self):
+        return self.get_record() is not None
+
+    def __str__(self):
+        return self.name
+
+
+def get_cache_dir():
+    return os.environ.get("HDLMAKE_VENDOR_LIBS") or path_mod.cache_path("vendor-libs")
+
+
+def get_source_paths(paths):
+    """Return the sources listed in paths: the files, and the HDL files
+    found in the directories and their subdirectories, sorted"""
+    sources = []
+    for path in paths:
+        if not os.path.isdir(path):
+            sources.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.rsplit('.', 1)[-1].lower() in VENDOR_SOURCE_EXTENSIONS:
+                    sources.append(os.path.join(dirpath, filename))
+    return sources
+
+
+def _get_digest(path):
+    """Return the hash of the content of the file, computed once per version
+    of the file"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    if key not in _digests:
+        with open(path, "rb") as source:
+            _digests[key] = hashlib.sha1(source.read()).hexdigest()
+    return _digests[key]
+
+
+def _as_text(value):
+    """The settings read from the tool probe cache are unicode strings"""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+
+def _get_tool_info(tool_object):
+    tool_id = tool_object.get_keys()['id']
+    return (tool_id,
+            global_mod.env[tool_id + "_path"],
+            global_mod.env[tool_id + "_version"],
+            tool_object.vendor_library_flags)
+
+
+def get_vendor_libraries(top_module, tool_object):
+    """Return the vendor libraries of the top module, sorted by name, with
+    their keys and their directories in the cache"""
+    tool_info = _get_tool_info(tool_object)
+    tool_id, tool_path, tool_version, flags = tool_info
+    tool_dir = os.path.join(get_cache_dir(), "%s-%s" % (tool_id, tool_version or "unknown"))
+    libraries = []
+    for name, paths in sorted(top_module.sim_vendor_libs.iteritems()):
+        # the sources are known by their names, not by where they are
+        sources = sorted((os.path.basename(source), _get_digest(source))
+                         for source in get_source_paths(paths))
+        key = hashlib.sha1('\n'.join(_as_text(value) for value in tool_info + (name,) + tuple(sources))).hexdigest()
+        libraries.append(VendorLibrary(name, paths, key, os.path.join(tool_dir, "%s-%s" % (name, key[:12]))))
+    return libraries
+
+
+def _solve(libraries, top_module):
+    """Parse the sources of the libraries and solve their dependencies.
+    Return a dictionary mapping each library to its files."""
+    from srcfile import SourceFileFactory, SourceFileSet
+    from dep_file import DepFile
+    import new_dep_solver as dep_solver
+
+    sff = SourceFileFactory()
+    fileset = SourceFileSet()
+    for library in libraries:
+        for source in get_source_paths(library.paths):
+            fileset.add(sff.new(path=source,
+                                module=top_module,
+                                library=library.name,
+                                vcom_opt="",
+                                vlog_opt="",
+                                include_dirs=[os.path.dirname(source)]))
+    fileset = fileset.filter(DepFile)
+    dep_solver.solve(fileset)
+    files = dict((library.name, set()) for library in libraries)
+    for source_file in fileset:
+        files[source_file.library].add(source_file)
+    return files
+
+
+def compile_libraries(libraries, top_module, tool_object, rebuild=False):
+    """Compile the libraries missing from the cache, or compiled against
+    other versions of the vendor libraries they use. Return the libraries
+    that failed."""
+    from tools.common.sim_schedule import get_compile_order, get_library_waves
+
+    files = _solve(libraries, top_module)
+    by_name = dict((library.name, library) for library in libraries)
+    failed = []
+    for wave in get_library_waves(set(f for lib_files in files.itervalues() for f in lib_files)):
+        for name in wave:
+            library = by_name[name]
+            uses = sorted(set(d.library for f in files[name] for d in f.depends_on
+                              if d.library != name and d.library in by_name))
+            if any(by_name[used] in failed for used in uses):
+                logging.error("Not compiling %s, a library it uses failed" % name)
+                failed.append(library)
+                continue
+            uses_keys = dict((used, by_name[used].key) for used in uses)
+            record = library.get_record()
+            if not rebuild and record is not None and record.get("uses") == uses_keys:
+                logging.info("The vendor library %s is up to date in %s" % (name, library.path))
+                continue
+            order = get_compile_order(files[name])
+            if not _compile(library, order, [by_name[used] for used in uses], uses_keys, tool_object):
+                failed.append(library)
+    return failed
+
+
+def _compile(library, order, used, uses_keys, tool_object):
+    tool_id, tool_path, tool_version, flags = _get_tool_info(tool_object)
+    logging.info("Compiling the vendor library %s (%d files) into %s" % (library.name, len(order), library.path))
+    staging = "%s.%d.tmp" % (library.path, os.getpid())
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    log_path = os.path.join(staging, "compile.log")
+    commands = tool_object.get_vendor_library_commands(library, order, used)
+    result = process.run("cd %s && %s" % (pipes.quote(staging), " && ".join(commands)),
+                         log_path=log_path, echo=False)
+    if not result.ok:
+        failed_log = library.path + ".failed.log"
+        shutil.copy(log_path, failed_log)
+        shutil.rmtree(staging)
+        logging.error("Can't compile the vendor library %s, see %s" % (library.name, failed_log))
+        return False
+
+    record = {"library": library.name,
+              "key": library.key,
+              "tool": tool_id,
+              "tool_path": tool_path,
+              "tool_version": tool_version,
+              "flags": flags,
+              "files": [f.path for f in order],
+              "uses": uses_keys}
+    with open(os.path.join(staging, DONE_MARKER), "w") as done_file:
+        json.dump(record, done_file, indent=1, sort_keys=True)
+
+    if os.path.exists(library.path + ".failed.log"):
+        os.remove(library.path + ".failed.log")
+    if os.path.exists(library.path):
+        # compiled against other versions of the libraries it uses, or
+        # compiled again on request
+        shutil.rmtree(library.path, ignore_errors=True)
+    try:
+        os.rename(staging, library.path)
+    except OSError:
+        # another run compiled it in the meantime
+        shutil.rmtree(staging, ignore_errors=True)
+        if not library.is_compiled():
+            logging.error("Can't move the vendor library %s into %s" % (library.name, library.path))
+            return False
+    return True
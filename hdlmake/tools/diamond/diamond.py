@@ -32,12 +32,19 @@ from string import Template
 import fetch
 
 from makefile_writer import MakefileWriter
+from util import tcl_session
+from tools.common import project_files
+
+# extensions of the files added by hdlmake, which it may remove from a project
+DIAMOND_PROJECT_EXTENSIONS = ['vhd', 'vhdl', 'vho', 'v', 'vh', 'vo', 'vm', 'sv', 'svh', 'edf', 'edif', 'edi', 'edn', 'lpf']
 
 DIAMOND_STANDARD_LIBS = ['ieee', 'std']
 
 
 class ToolControls(MakefileWriter):
 
+    timeout = None
+
     def detect_version(self, path):
         return 'unknown'
 
@@ -138,16 +145,21 @@ mrproper:
         self.filename = top_mod.syn_project
         self.header = None
         self.tclname = 'temporal.tcl'
+        self.logname = 'hdlmake_diamond.log'
+        self.removed = []
+        self.add_files(fileset)
         if update is True:
             self.update_project()
+            if not self.update_files():
+                logging.info("Diamond project is up to date.")
+                return None
         else:
             self.create_project(top_mod.syn_device,
                                top_mod.syn_grade,
                                top_mod.syn_package,
                                top_mod.syn_top)
-        self.add_files(fileset)
         self.emit(update=update)
-        self.execute()        
+        return self.execute()
 
     def emit(self, update=False):
         f = open(self.tclname, "w")
@@ -160,26 +172,34 @@ mrproper:
     def execute(self):
         # The binary name for Diamond is different in Linux and Windows 
         if sys.platform == 'cygwin':
-            tmp = 'pnmainc {0}'
+            cmd = 'pnmainc'
         else:
-            tmp = 'diamondc {0}'
-        cmd = tmp.format(self.tclname)
-        p = subprocess.Popen(cmd, shell=True, stderr=subprocess.PIPE)
-        ## But do not wait till diamond finish, start displaying output immediately ##
-        while True:
-            out = p.stderr.read(1)
-            if out == '' and p.poll() != None:
-                break
-            if out != '':
-                sys.stdout.write(out)
-                sys.stdout.flush()
+            cmd = 'diamondc'
+        session = tcl_session.get_session(cmd)
+        result = session.source(self.tclname, log_path=self.logname, timeout=self.timeout)
         os.remove(self.tclname)
+        return result
 
 
     def add_files(self, fileset):
         for f in fileset:
             self.files.append(f)
 
+    def update_files(self):
+        """Keep in the files only those missing from the existing project,
+        and list the files of the project to remove. Return False when
+        the project is up to date."""
+        from srcfile import VHDLFile, VerilogFile, SVFile, EDFFile, LPFFile
+        # the preferences file created with the project is never removed
+        default_lpf = os.path.normpath(self.filename+'.lpf')
+        current = [path for path in project_files.read_ldf_files(self.filename+'.ldf')
+                   if path != default_lpf]
+        sources = [f for f in self.files
+                   if isinstance(f, (VHDLFile, VerilogFile, SVFile, EDFFile, LPFFile))]
+        self.files, self.removed = project_files.get_changes(current, sources, DIAMOND_PROJECT_EXTENSIONS)
+        project_files.log_changes("Diamond", self.files, self.removed)
+        return bool(self.files or self.removed)
+
     def create_project(self, 
                        syn_device,
                        syn_grade,
@@ -197,17 +217,19 @@ mrproper:
     def __emit_files(self, update=False):
         tmp = 'prj_src {0} \"{1}\"'
         ret = []
+        for path in self.removed:
+            line = ''
+            if path.lower().endswith('.lpf'):
+                # the active preferences file can't be removed
+                line = line+'\n'+tmp.format('enable', self.filename+'.lpf')
+            line = line+'\n'+tmp.format('remove', path)
+            ret.append(line)
         from srcfile import VHDLFile, VerilogFile, SVFile, EDFFile, LPFFile
         for f in self.files:
             line = ''
             if isinstance(f, VHDLFile) or isinstance(f, VerilogFile) or isinstance(f, SVFile) or isinstance(f, EDFFile):
-                if update == True:
-                    line = line+'\n'+tmp.format('remove', f.rel_path())
                 line = line+'\n'+tmp.format('add', f.rel_path())
             elif isinstance(f, LPFFile):
-                if update == True:
-                    line = line+'\n'+tmp.format('enable', self.filename+'.lpf') 
-                    line = line+'\n'+tmp.format('remove', f.rel_path())
                 line = line+'\n'+tmp.format('add -exclude', f.rel_path())
                 line = line+'\n'+tmp.format('enable', f.rel_path())
             else:
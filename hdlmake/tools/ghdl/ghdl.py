@@ -22,16 +22,33 @@
 #
 
 
+import os
 import string
 from string import Template
 import fetch
 from makefile_writer import MakefileWriter
+from tools.common.sim_makefile_support import timing_variables
+from tools.common.sim_tops import (get_top_modules, get_top_library, get_top_files, get_log_files,
+                                   has_multiple_tops, write_top_rules)
 
 import logging
 
 
 class ToolControls(MakefileWriter):
 
+    # options of the vendor libraries, e.g. for std_logic_arith in unisim
+    vendor_library_flags = "-fexplicit -frelaxed-rules --ieee=synopsys"
+    # run option of the tests run by hdlmake regress
+    generic_option = "-g%s=%s"
+
+    def __init__(self):
+        # Log the time taken by every analysis (see util.timing)
+        self.timing = False
+        # Vendor libraries compiled by hdlmake vendor-libs, used from the
+        # cache (see tools.common.vendor_libs)
+        self.vendor_libraries = []
+        super(ToolControls, self).__init__()
+
     def detect_version(self, path):
         pass
 
@@ -50,37 +67,127 @@ class ToolControls(MakefileWriter):
         return GHDL_STANDARD_LIBS
 
 
+    def get_ninja_rules(self, fileset, top_module):
+        elaborate = []
+        for top in get_top_modules(top_module):
+            top_library = get_top_library(fileset, top)
+            elaborate.append({"outputs": [self._get_elab_marker(top_library, top)],
+                              "command": "ghdl -e --work=%s --workdir=%s $GHDL_LIB_FLAGS %s && touch $out" %
+                                         (top_library, self._get_workdir(top_library), top),
+                              "pool": "lib_" + top_library if has_multiple_tops(top_module) else None})
+        rules = {"variables": [("GHDL_LIB_FLAGS", self._get_lib_flags(fileset))],
+                 "library": "mkdir -p $lib",
+                 "compile": {"vhdl": "ghdl -a --work=$lib --workdir=$workdir $GHDL_LIB_FLAGS $in"},
+                 "workdir": self._get_workdir,
+                 "elaborate": elaborate}
+        if has_multiple_tops(top_module):
+            rules["run"] = [{"top": top,
+                             "inputs": elaboration["outputs"],
+                             "command": self.get_run_command(fileset, top, "$GHDL_LIB_FLAGS")}
+                            for top, elaboration in zip(get_top_modules(top_module), elaborate)]
+        return rules
+
+    def _get_elab_marker(self, top_library, top):
+        return os.path.join(top_library, ".%s_elab" % top)
+
+    def get_run_command(self, fileset, top, flags="$(GHDL_FLAGS) $(GHDL_LIB_FLAGS)", name=None):
+        """Return the command running the simulation of the top. It writes
+        no file, so name is not used."""
+        top_library = get_top_library(fileset, top)
+        return "ghdl -r --work=%s --workdir=%s %s %s" % (top_library, self._get_workdir(top_library), flags, top)
+
+    def _get_workdir(self, library):
+        """The work library is analyzed in the current directory, as ghdl
+        does by default, so that ghdl -r finds it without options. Every
+        other library has its own directory."""
+        if library == "work":
+            return "."
+        return library
+
+    def _get_lib_flags(self, fileset):
+        flags = ["-P" + lib for lib in sorted(set(f.library for f in fileset)) if self._get_workdir(lib) != "."]
+        flags.extend("-P" + library.library_path for library in self.vendor_libraries)
+        return ' '.join(flags)
+
+    def get_vendor_library_commands(self, library, files, used):
+        """Return the commands analyzing the files of the vendor library, in
+        the directory of the library in the cache"""
+        from srcfile import VHDLFile
+        vhdl_files = [f for f in files if isinstance(f, VHDLFile)]
+        if len(vhdl_files) != len(files):
+            logging.warning("GHDL only analyzes the VHDL files of the vendor library " + library.name)
+        lib_flags = ' '.join("-P" + used_library.library_path for used_library in used)
+        return ["mkdir -p " + library.name,
+                "ghdl -a %s --work=%s --workdir=%s %s %s" % (self.vendor_library_flags, library.name, library.name,
+                                                            lib_flags, ' '.join(f.path for f in vhdl_files))]
+
     def generate_simulation_makefile(self, fileset, top_module):
         # TODO: vhdl87 vs vhdl97 options
         
         from srcfile import VHDLFile
+        from tools.common.sim_schedule import get_compile_order
+
+        # every library but work is analyzed in its own directory, so that
+        # the libraries can be analyzed by separate (and parallel) ghdl runs.
+        # The analyses of a library rewrite its .cf file: they are run one
+        # after the other, in the order of the schedule.
+        vhdl_files = fileset.filter(VHDLFile)
+        libs = sorted(set(f.library for f in vhdl_files))
+        order = get_compile_order(vhdl_files)
+        last_in_lib = dict((f.library, self._get_marker(f)) for f in order)
+        tops = get_top_modules(top_module)
+        top_libraries = [get_top_library(fileset, top) for top in tops]
+        if has_multiple_tops(top_module):
+            top_variables = "TOP_MODULES := " + ' '.join(tops)
+        else:
+            top_variables = "TOP_MODULE := %s\nTOP_LIBRARY := %s" % (top_module.top_module, top_libraries[0])
 
-        makefile_tmplt_1 = string.Template("""TOP_MODULE := ${top_module}
+        makefile_tmplt_1 = string.Template("""${top_variables}
 GHDL_CRAP := \
 *.cf
 
-
-#target for performing local simulation
-local: sim_pre_cmd simulation sim_post_cmd
-
-simulation:
+GHDL_FLAGS :=
+GHDL_LIB_FLAGS := ${lib_flags}
+${timing_variables}
 """)
 
         makefile_text_1 = makefile_tmplt_1.substitute(
-            top_module=top_module.top_module
+            top_variables=top_variables,
+            lib_flags=self._get_lib_flags(vhdl_files),
+            timing_variables=timing_variables() if self.timing else ""
         )
         self.write(makefile_text_1)
+        if has_multiple_tops(top_module):
+            # the executables written by the elaborations, and the logs
+            self.writeln("GHDL_CRAP += " + ' '.join([top.lower() for top in tops] + get_log_files(tops)))
+            self.writeln()
 
-        self.writeln("\t\t# Analyze sources")
-        for vhdl in fileset.filter(VHDLFile):
-            self.writeln("\t\tghdl -a " + vhdl.rel_path())
+        self.write("VHDL_SRC := ")
+        for vhdl in vhdl_files:
+            self.write(vhdl.rel_path() + " \\\n")
         self.writeln()
 
-        self.writeln("\t\t# Elaborate design")
-        self.writeln("\t\tghdl -e $(TOP_MODULE)")
+        self.write("VHDL_OBJ := ")
+        for vhdl in vhdl_files:
+            self.write(self._get_marker(vhdl) + " \\\n")
         self.writeln()
 
-        makefile_tmplt_2 = string.Template("""      
+        self.writeln("LIBS := " + ' '.join(libs))
+        self.writeln("LIB_IND := " + ' '.join([os.path.join(lib, "." + lib) for lib in libs]))
+        if has_multiple_tops(top_module):
+            self.writeln("ELAB_IND := " + ' '.join(self._get_elab_marker(top_library, top)
+                                                   for top, top_library in zip(tops, top_libraries)))
+        else:
+            self.writeln("ELAB_IND := $(TOP_LIBRARY)/.$(TOP_MODULE)_elab")
+        self.writeln()
+
+        makefile_tmplt_2 = string.Template("""#target for performing local simulation
+local: sim_pre_cmd simulation sim_post_cmd
+
+simulation: $$(LIB_IND) $$(VHDL_OBJ) $$(ELAB_IND)
+$$(VHDL_OBJ): $$(LIB_IND)
+
+${elab_rules}
 sim_pre_cmd:
 \t\t${sim_pre_cmd}
 
@@ -89,7 +196,7 @@ sim_post_cmd:
 
 #target for cleaning all intermediate stuff
 clean:
-\t\trm -rf $$(GHDL_CRAP)
+\t\trm -rf $$(GHDL_CRAP) $$(LIBS)
 
 #target for cleaning final files
 mrproper: clean
@@ -109,8 +216,70 @@ mrproper: clean
         else:
             sim_post_cmd = ''
 
+        if has_multiple_tops(top_module):
+            # every top is elaborated once the units it uses are analyzed,
+            # after the analyses of its library and one elaboration at a time
+            # in a library
+            elab_rules = ""
+            for top, top_library in zip(tops, top_libraries):
+                elab_marker = self._get_elab_marker(top_library, top)
+                order_only = [m for m in [last_in_lib.get(top_library)] if m]
+                elab_rules += "%s: %s" % (elab_marker,
+                                          ' '.join(self._get_marker(f) for f in get_top_files(vhdl_files, top)))
+                if order_only:
+                    elab_rules += " | " + ' '.join(order_only)
+                elab_rules += "\n\t\t%sghdl -e $(GHDL_FLAGS) --work=%s --workdir=%s $(GHDL_LIB_FLAGS) %s\n" % (
+                    self._timed(), top_library, self._get_workdir(top_library), top)
+                elab_rules += "\t\t@touch $@\n\n"
+                last_in_lib[top_library] = elab_marker
+        else:
+            elab_rules = ("$(ELAB_IND): $(VHDL_OBJ)\n"
+                          "\t\t%sghdl -e $(GHDL_FLAGS) --work=$(TOP_LIBRARY) --workdir=%s "
+                          "$(GHDL_LIB_FLAGS) $(TOP_MODULE)\n"
+                          "\t\t@touch $@\n" % (self._timed(), self._get_workdir(top_libraries[0])))
+
         makefile_text_2 = makefile_tmplt_2.substitute(
+            elab_rules=elab_rules,
             sim_pre_cmd=sim_pre_cmd,
             sim_post_cmd=sim_post_cmd,
         )
         self.write(makefile_text_2)
+
+        for lib in libs:
+            self.writeln(os.path.join(lib, "." + lib) + ":")
+            self.writeln("\t\tmkdir -p %s && touch $@" % lib)
+            self.writeln()
+
+        # each unit is analyzed once the units it uses are, and after the
+        # previous unit of its library
+        previous_in_lib = {}
+        for vhdl in order:
+            self.write("%s: %s" % (self._get_marker(vhdl), vhdl.rel_path()))
+            prerequisites = []
+            for dep_file in [dfile for dfile in vhdl.depends_on if dfile is not vhdl]:
+                if dep_file in fileset:
+                    prerequisites.append(self._get_marker(dep_file))
+                else:
+                    prerequisites.append(dep_file.rel_path())
+            for prerequisite in prerequisites:
+                self.write(" \\\n" + prerequisite)
+            if vhdl.library in previous_in_lib and previous_in_lib[vhdl.library] not in prerequisites:
+                self.write(" \\\n| " + previous_in_lib[vhdl.library])
+            previous_in_lib[vhdl.library] = self._get_marker(vhdl)
+            self.writeln()
+            self.writeln("\t\t%sghdl -a $(GHDL_FLAGS) --work=%s --workdir=%s $(GHDL_LIB_FLAGS) $<" %
+                         (self._timed(), vhdl.library, self._get_workdir(vhdl.library)))
+            self.writeln("\t\t@mkdir -p $(dir $@) && touch $@")
+            self.writeln()
+
+        if has_multiple_tops(top_module):
+            write_top_rules(self, [(top, [self._get_elab_marker(top_library, top)], [],
+                                    self.get_run_command(fileset, top))
+                                   for top, top_library in zip(tops, top_libraries)])
+
+    def _timed(self):
+        return "$(TIMED) " if self.timing else ""
+
+    def _get_marker(self, source_file):
+        return os.path.join(source_file.library, source_file.purename,
+                            ".%s_%s" % (source_file.purename, source_file.extension()))
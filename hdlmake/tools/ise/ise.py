@@ -22,13 +22,13 @@
 #
 
 from __future__ import print_function
-import xml.dom.minidom
-import xml.parsers.expat
+from xml.etree import ElementTree
 import logging
 import re
 import global_mod
 import os
 import sys
+from collections import OrderedDict
 from subprocess import Popen, PIPE
 
 import new_dep_solver as dep_solver
@@ -37,9 +37,8 @@ import string
 from string import Template
 import fetch
 
-from makefile_writer import MakefileWriter
-
-XmlImpl = xml.dom.minidom.getDOMImplementation()
+from makefile_writer import MakefileWriter, write_file
+from tools.common import project_files
 
 
 FAMILY_NAMES = {
@@ -53,6 +52,9 @@ FAMILY_NAMES = {
     "XC7K": "Kintex7",
     "XC7A": "Artix7"}
 
+# extensions of the files hdlmake writes in a project
+ISE_PROJECT_EXTENSIONS = ['vhd', 'vhdl', 'vho', 'v', 'vh', 'vo', 'vm', 'sv', 'svh', 'ucf', 'cdc', 'ngc']
+
 
 class ToolControls(MakefileWriter):
 
@@ -304,37 +306,13 @@ mrproper:
                 self.write("include %s\n" % f)
 
 
-    class StringBuffer(list):
-        def __init__(self):
-            self.append("")
-            self.__blank = re.compile("^[ \t\n]+$")
-
-        def write(self, what):
-            if what == "":
-                return
-            elif re.match(self.__blank, what):
-                if self[len(self)-1] != "":
-                    self.append("")
-                else:
-                    pass
-            elif what[len(what)-1] == "\n":
-                self[len(self)-1] += what[:len(what)-1]
-                self.append("")
-            else:
-                self[len(self)-1] += what
-
-
     def generate_synthesis_project(self, update=False, tool_version='', top_mod=None, fileset=None):
-        self.props = {}
+        # the properties keep the order of the project file
+        self.props = OrderedDict()
         self.files = []
         self.libs = []
-        self.xml_doc = None
-        self.xml_files = []
-        self.xml_props = []
-        self.xml_libs = []
-        self.xml_ise = None
-        self.xml_project = None
-        self.xml_bindings = None
+        # the sections of the project written back as they are
+        self.xml_sections = None
         self.top_mod = top_mod
         self.ise = tool_version
 
@@ -353,6 +331,10 @@ mrproper:
                 logging.error("Error while reading the project file.\n"
                               "Are you sure that syn_project indicates a correct ISE project file?")
                 raise
+            added, removed = project_files.get_changes(self.current_files,
+                                                       [f for f in self.files if self._get_file_type(f)],
+                                                       ISE_PROJECT_EXTENSIONS)
+            project_files.log_changes("ISE", added, removed)
         else:
             self.add_initial_properties()
         
@@ -394,165 +376,123 @@ mrproper:
         self.add_property("Implementation Top", "Architecture|"+tm.syn_top)
         self.add_property("Implementation Top Instance Path", "/"+tm.syn_top)
 
-    def _parse_props(self):
-        for xmlp in self.xml_project.getElementsByTagName("properties")[0].getElementsByTagName("property"):
-            self.add_property(
-                name=xmlp.getAttribute("xil_pn:name"),
-                value=xmlp.getAttribute("xil_pn:value"),
-                is_default=(xmlp.getAttribute("xil_pn:valueState") == "default")
-            )
-
-        self.xml_props = self._purge_dom_node(name="properties", where=self.xml_doc.documentElement)
+    def _parse_props(self, node):
+        for xmlp in node:
+            if xmlp.tag == _xise_tag("property"):
+                self.add_property(
+                    name=_xise_attribute(xmlp, "name"),
+                    value=_xise_attribute(xmlp, "value"),
+                    is_default=(_xise_attribute(xmlp, "valueState") == "default")
+                )
 
-    def _parse_libs(self):
-        for l in self.xml_project.getElementsByTagName("libraries")[0].getElementsByTagName("library"):
-            self._add_lib(l.getAttribute("xil_pn:name"))
-        self.xml_libs = self._purge_dom_node(name="libraries", where=self.xml_doc.documentElement)
+    def _parse_libs(self, node):
+        for l in node:
+            if l.tag == _xise_tag("library"):
+                self._add_lib(_xise_attribute(l, "name"))
 
     def load_xml(self, filename):
-        f = open(filename)
-        self.xml_doc = xml.dom.minidom.parse(f)
-        self.xml_project = self.xml_doc.getElementsByTagName("project")[0]
-        import sys
+        """Read an existing project. The properties and the libraries are
+        kept, the files and the bindings are replaced by those of the
+        fileset, and the other sections are written back as they are."""
         try:
-            self._parse_props()
-        except xml.parsers.expat.ExpatError:
-            print("Error while parsing existing file's properties:")
+            tree = ElementTree.parse(filename, ElementTree.XMLParser(target=_CommentedTreeBuilder()))
+        except SyntaxError:
+            print("Error while parsing the existing project file:")
             print(str(sys.exc_info()))
             quit()
 
-        try:
-            self._parse_libs()
-        except xml.parsers.expat.ExpatError:
-            print("Error while parsing existing file's libraries:")
-            print(str(sys.exc_info()))
-            quit()
-
-        where = self.xml_doc.documentElement
-        self.xml_files = self._purge_dom_node(name="files", where=where)
-        self.xml_bindings = self._purge_dom_node(name="bindings", where=where)
-        try:
-            node = where.getElementsByTagName("version")[0]
-            if not self.ise:
-                self.ise = tuple(node.getAttribute("xil_pn:ise_version").split('.'))
-            where.removeChild(node)
-        except:
-            pass
-        f.close()
+        self.current_files = []
+        self.xml_sections = []
+        for node in tree.getroot():
+            if node.tag == _xise_tag("properties"):
+                self._parse_props(node)
+            elif node.tag == _xise_tag("libraries"):
+                self._parse_libs(node)
+            elif node.tag == _xise_tag("files"):
+                self.current_files = [os.path.normpath(_xise_attribute(fp, "name"))
+                                      for fp in node if fp.tag == _xise_tag("file")]
+            elif node.tag == _xise_tag("version"):
+                if not self.ise:
+                    self.ise = _xise_attribute(node, "ise_version")
+            elif node.tag == _xise_tag("bindings"):
+                pass
+            elif isinstance(node.tag, basestring):
+                self.xml_sections.append(node)
         self._set_values_from_manifest()
 
-    def _purge_dom_node(self, name, where):
-        try:
-            node = where.getElementsByTagName(name)[0]
-            where.removeChild(node)
-        except:
-            pass
-        new = self.xml_doc.createElement(name)
-        where.appendChild(new)
-        return new
-
-    def _output_files(self, node):
-        from srcfile import UCFFile, VHDLFile, VerilogFile, CDCFile, NGCFile
-
-        for f in self.files:
-            fp = self.xml_doc.createElement("file")
-            fp.setAttribute("xil_pn:name", os.path.relpath(f.path))
-            if isinstance(f, VHDLFile):
-                fp.setAttribute("xil_pn:type", "FILE_VHDL")
-            elif isinstance(f, VerilogFile):
-                fp.setAttribute("xil_pn:type", "FILE_VERILOG")
-            elif isinstance(f, UCFFile):
-                fp.setAttribute("xil_pn:type", "FILE_UCF")
-            elif isinstance(f, CDCFile):
-                fp.setAttribute("xil_pn:type", "FILE_CDC")
-            elif isinstance(f, NGCFile):
-                fp.setAttribute("xil_pn:type", "FILE_NGC")
-            else:
+    def _output_files(self, lines):
+        entries = []
+        for seq_id, f in enumerate(self.files, 1):
+            file_type = self._get_file_type(f)
+            if not file_type:
                 continue
+            entries.append(_xise_line(2, "file", [("name", os.path.relpath(f.path)),
+                                                  ("type", file_type)], empty=False))
+            library = getattr(f, "library", "work")
+            if library != "work":
+                entries.append(_xise_line(3, "library", [("name", library)]))
+            entries.append(_xise_line(3, "association", [("name", "Implementation"),
+                                                         ("seqID", str(seq_id))]))
+            entries.append("</file>")
+        _output_section(lines, "files", entries)
+
+    def _get_file_type(self, f):
+        from srcfile import UCFFile, VHDLFile, VerilogFile, CDCFile, NGCFile
+        if isinstance(f, VHDLFile):
+            return "FILE_VHDL"
+        elif isinstance(f, VerilogFile):
+            return "FILE_VERILOG"
+        elif isinstance(f, UCFFile):
+            return "FILE_UCF"
+        elif isinstance(f, CDCFile):
+            return "FILE_CDC"
+        elif isinstance(f, NGCFile):
+            return "FILE_NGC"
+        return None
+
+    def _output_bindings(self, lines):
+        from srcfile import CDCFile
+        _output_section(lines, "bindings",
+                        [_xise_line(2, "binding", [("location", self.top_mod.syn_top),
+                                                   ("name", b.rel_path())])
+                         for b in self.files if isinstance(b, CDCFile)])
 
-            assoc = self.xml_doc.createElement("association")
-            assoc.setAttribute("xil_pn:name", "Implementation")
-            assoc.setAttribute("xil_pn:seqID", str(self.files.index(f)+1))
-
-            try:
-                if(f.library != "work"):
-                    lib = self.xml_doc.createElement("library")
-                    lib.setAttribute("xil_pn:name", f.library)
-                    fp.appendChild(lib)
-            except:
-                pass
+    def _output_props(self, lines):
+        _output_section(lines, "properties",
+                        [prop.emit_xml() for prop in self.props.itervalues()])
 
-            fp.appendChild(assoc)
-            node.appendChild(fp)
+    def _output_libs(self, lines):
+        _output_section(lines, "libraries",
+                        [_xise_line(2, "library", [("name", l)]) for l in self.libs])
 
-    def _output_bindings(self, node):
-        from srcfile import CDCFile
-        for b in [f for f in self.files if isinstance(f, CDCFile)]:
-            bp = self.xml_doc.createElement("binding")
-            bp.setAttribute("xil_pn:location", self.top_mod.syn_top)
-            bp.setAttribute("xil_pn:name", b.rel_path())
-            node.appendChild(bp)
-
-    def _output_props(self, node):
-        for name, prop in self.props.iteritems():
-            node.appendChild(prop.emit_xml(self.xml_doc))
-
-    def _output_libs(self, node):
-        for l in self.libs:
-            ll = self.xml_doc.createElement("library")
-            ll.setAttribute("xil_pn:name", l)
-            node.appendChild(ll)
-
-    def _output_ise(self, node):
-        i = self.xml_doc.createElement("version")
-        i.setAttribute("xil_pn:ise_version", '%s' % (self.ise))
-        i.setAttribute("xil_pn:schema_version", "2")
-        node.appendChild(i)
+    def _output_ise(self, lines):
+        lines.append(_xise_line(1, "version", [("ise_version", '%s' % (self.ise)),
+                                               ("schema_version", "2")]))
 
     def emit_xml(self, filename=None):
-        if not self.xml_doc:
+        if self.xml_sections is None:
             self.create_empty_project()
-        else:
-            self._output_ise(self.xml_doc.documentElement)
         logging.debug("Writing .xise file for version " + str(self.ise))
-        self._output_bindings(self.xml_bindings)
-        self._output_files(self.xml_files)
-        self._output_props(self.xml_props)
-        self._output_libs(self.xml_libs)
-        output_file = open(filename, "w")
-        string_buffer = self.StringBuffer()
-        self.xml_doc.writexml(string_buffer, newl="\n", addindent="\t")
-        output_file.write('\n'.join(string_buffer))
-        output_file.close()
+        lines = ['<?xml version="1.0" ?>',
+                 '<project xmlns="%s" xmlns:xil_pn="%s">' % (XISE_NAMESPACE, XISE_NAMESPACE)]
+        for node in self.xml_sections:
+            _output_node(lines, node, 1)
+        self._output_props(lines)
+        self._output_libs(lines)
+        self._output_files(lines)
+        self._output_bindings(lines)
+        self._output_ise(lines)
+        lines.append("</project>")
+        lines.append("")
+        if not write_file(filename, '\n'.join(lines)):
+            logging.info("The .xise project file is up to date")
 
     def create_empty_project(self):
-        self.xml_doc = XmlImpl.createDocument("http://www.xilinx.com/XMLSchema", "project", None)
-        top_element = self.xml_doc.documentElement
-        top_element.setAttribute("xmlns", "http://www.xilinx.com/XMLSchema")
-        top_element.setAttribute("xmlns:xil_pn", "http://www.xilinx.com/XMLSchema")
-
-        header = self.xml_doc.createElement("header")
-        header.appendChild(self.xml_doc.createTextNode(""))
-
-        amf = self.xml_doc.createElement("autoManagedFiles")
-        amf.appendChild(self.xml_doc.createTextNode(""))
-
-        self.xml_props = self.xml_doc.createElement("properties")
-        self.xml_files = self.xml_doc.createElement("files")
-        self.xml_libs = self.xml_doc.createElement("libraries")
-        self.xml_bindings = self.xml_doc.createElement("bindings")
-
-        version = self.xml_doc.createElement("version")
-        version.setAttribute("xil_pn:ise_version", self.ise)
-        version.setAttribute("xil_pn:schema_version", "2")
-
-        top_element.appendChild(header)
-        top_element.appendChild(amf)
-        top_element.appendChild(self.xml_props)
-        top_element.appendChild(self.xml_libs)
-        top_element.appendChild(self.xml_files)
-        top_element.appendChild(self.xml_bindings)
-        top_element.appendChild(version)
+        self.xml_sections = []
+        for name in ["header", "autoManagedFiles"]:
+            section = ElementTree.Element(_xise_tag(name))
+            section.text = ""
+            self.xml_sections.append(section)
 
 
 
@@ -562,15 +502,105 @@ class ISEProjectProperty:
         self.value = value
         self.is_default = is_default
 
-    def emit_xml(self, doc):
-        prop = doc.createElement("property")
-        prop.setAttribute("xil_pn:name", self.name)
-        prop.setAttribute("xil_pn:value", self.value)
+    def emit_xml(self):
         if self.is_default:
-            prop.setAttribute("xil_pn:valueState", "default")
+            value_state = "default"
         else:
-            prop.setAttribute("xil_pn:valueState", "non-default")
+            value_state = "non-default"
+        return _xise_line(2, "property", [("name", self.name),
+                                          ("value", self.value),
+                                          ("valueState", value_state)])
+
+
+# The project files are written line by line, the same way xml.dom.minidom
+# wrote them in former versions: the attributes are sorted and the end tag
+# of an element with children starts its line. This keeps the projects
+# under version control unchanged.
+
+XISE_NAMESPACE = "http://www.xilinx.com/XMLSchema"
+
+
+def _xise_tag(name):
+    return "{%s}%s" % (XISE_NAMESPACE, name)
+
+
+def _xise_attribute(node, name):
+    return _to_str(node.get(_xise_tag(name), ""))
 
-        return prop
 
+def _to_str(text):
+    if isinstance(text, unicode):
+        return text.encode("utf-8")
+    return text
 
+
+def _escape(text):
+    return _to_str(text).replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def _xise_line(depth, name, attributes, empty=True):
+    """Return the line of an element with the given xil_pn attributes"""
+    return _start_tag(depth, name, [("xil_pn:" + key, value) for key, value in attributes], empty)
+
+
+def _start_tag(depth, name, attributes, empty):
+    return "%s<%s%s%s" % ("\t" * depth, name,
+                          ''.join(' %s="%s"' % (key, _escape(value)) for key, value in sorted(attributes)),
+                          "/>" if empty else ">")
+
+
+def _output_section(lines, name, entries):
+    if entries:
+        lines.append("\t<%s>" % name)
+        lines.extend(entries)
+        lines.append("</%s>" % name)
+    else:
+        lines.append("\t<%s/>" % name)
+
+
+def _qualified_name(name, attribute=False):
+    if name.startswith("{"):
+        namespace, name = name[1:].split("}", 1)
+        if attribute and namespace == XISE_NAMESPACE:
+            return "xil_pn:" + name
+    return name
+
+
+def _output_node(lines, node, depth):
+    """Write an element read from a project with its comments and text"""
+    indent = "\t" * depth
+    if node.tag is ElementTree.Comment:
+        lines.append("%s<!--%s-->" % (indent, _to_str(node.text)))
+        return
+    name = _qualified_name(node.tag)
+    attributes = [(_qualified_name(key, attribute=True), value) for key, value in node.items()]
+    if len(node) == 0:
+        # minidom wrote the sections created empty as <x></x>, and these
+        # are read back without text
+        if not node.text:
+            lines.append("%s</%s>" % (_start_tag(depth, name, attributes, empty=False), name))
+        elif node.text.strip():
+            lines.append("%s%s</%s>" % (_start_tag(depth, name, attributes, empty=False),
+                                        _escape(node.text), name))
+        else:
+            lines.append(_start_tag(depth, name, attributes, empty=False))
+            lines.append("</%s>" % name)
+        return
+    lines.append(_start_tag(depth, name, attributes, empty=False))
+    texts = [node.text] + [child.tail for child in node]
+    for text, child in zip(texts, list(node) + [None]):
+        # the blanks around the text are the indentation of the children
+        if text and text.strip():
+            lines.append(indent + "\t" + _escape(text.strip()))
+        if child is not None:
+            _output_node(lines, child, depth + 1)
+    lines.append("</%s>" % name)
+
+
+class _CommentedTreeBuilder(ElementTree.TreeBuilder):
+    """Keep the comments of the project, e.g. in its header"""
+
+    def comment(self, data):
+        self.start(ElementTree.Comment, {})
+        self.data(data)
+        self.end(ElementTree.Comment)
@@ -27,6 +27,7 @@ import os.path
 from subprocess import Popen, PIPE
 
 import os
+import logging
 import sys
 
 import string
@@ -35,6 +36,13 @@ import fetch
 import global_mod
 
 from makefile_writer import MakefileWriter
+from tools.common.sim_makefile_support import timing_variables
+from tools.common import library_catalog
+from tools.common.sim_tops import (get_top_modules, get_top_library, get_top_files, get_log_files,
+                                   has_multiple_tops, write_top_rules)
+
+# commands run by the simulations of the tops
+ISIM_RUN_TCL = "isim_run.tcl"
 
 
 ISIM_STANDARD_LIBS = ['std', 'ieee', 'ieee_proposed', 'vl', 'synopsys',
@@ -45,6 +53,19 @@ ISIM_STANDARD_LIBS = ['std', 'ieee', 'ieee_proposed', 'vl', 'synopsys',
 
 class ToolControls(MakefileWriter):
 
+    # vlogcomp option defining a Verilog macro, added to vlog_opt by hdlmake matrix
+    define_option = "-d %s"
+    # simulation executable option of the tests run by hdlmake regress
+    plusarg_option = "-testplusarg %s"
+
+    def __init__(self):
+        # Compile the files of one library and one level of the dependency
+        # graph with a single vhpcomp/vlogcomp run
+        self.batch = False
+        # Log the time taken by every compilation (see util.timing)
+        self.timing = False
+        super(ToolControls, self).__init__()
+
     def get_keys(self):
         tool_info = {
             'name': 'ISim',
@@ -57,6 +78,12 @@ class ToolControls(MakefileWriter):
     def get_standard_libraries(self):
         return ISIM_STANDARD_LIBS
 
+    def get_library_ini(self):
+        """The xilinxsim.ini of the installation, mapping the vendor libraries"""
+        if global_mod.env["isim_path"]:
+            return XilinxsiminiReader().path
+        return None
+
     def detect_version(self, path):
         isim = Popen("%s --version | awk '{print $2}'" % os.path.join(path, "vlogcomp"),
                      shell=True,
@@ -71,13 +98,50 @@ class ToolControls(MakefileWriter):
         return isim_version
 
 
+    def get_ninja_rules(self, fileset, top_module):
+        xilinxsim_ini = os.path.join(XilinxsiminiReader.xilinxsim_ini_dir(), "xilinxsim.ini")
+        rules = {"variables": [("VHPCOMP_FLAGS", "-intstyle default -incremental -initfile xilinxsim.ini"),
+                              ("VLOGCOMP_FLAGS", "-intstyle default -incremental -initfile xilinxsim.ini " +
+                               self.__get_rid_of_isim_incdirs(top_module.vlog_opt))],
+                # the libraries are appended to the copy, which is made again
+                # (together with the libraries) only when the original changes
+                "prerequisites": [{"outputs": ["xilinxsim.ini"],
+                                   "inputs": [xilinxsim_ini],
+                                   "command": "cp $in $out"}],
+                "library": "mkdir -p $lib && echo \"$lib=$lib\" >> xilinxsim.ini",
+                "compile": {"vhdl": "vhpcomp $VHPCOMP_FLAGS $opt -work $lib=./$lib $in",
+                            "verilog": "vlogcomp -work $lib=./$lib $VLOGCOMP_FLAGS $incdirs $opt $in"},
+                "include_flags": lambda dirs: "-i " + ' '.join(dirs) if dirs else "",
+                "elaborate": {"outputs": ["isim_proj"],
+                              "command": "fuse work.%s -intstyle ise -incremental -o $out" % top_module.top_module}}
+        if has_multiple_tops(top_module):
+            # one fuse at a time, as they share the isim directory
+            tops = get_top_modules(top_module)
+            rules["elaborate"] = [{"outputs": [self._get_fuse_output(top)],
+                                   "command": "fuse %s.%s -intstyle ise -incremental -o $out" %
+                                              (get_top_library(fileset, top), top),
+                                   "pool": "fuse"}
+                                  for top in tops]
+            rules["prerequisites"].append({"outputs": [ISIM_RUN_TCL],
+                                           "inputs": [],
+                                           "command": "echo \"run all\" > $out && echo \"quit\" >> $out"})
+            rules["run"] = [{"top": top,
+                             "inputs": [self._get_fuse_output(top), ISIM_RUN_TCL],
+                             "command": self.get_run_command(fileset, top)}
+                            for top in tops]
+        return rules
+
     def generate_simulation_makefile(self, fileset, top_module):
         from srcfile import VerilogFile, VHDLFile
         #from tools.ise import XilinxsiminiReader
+        tops = get_top_modules(top_module)
+        if has_multiple_tops(top_module):
+            top_variables = "TOP_MODULES := " + ' '.join(tops)
+        else:
+            top_variables = "TOP_MODULE := " + top_module.top_module + "\nFUSE_OUTPUT ?= isim_proj"
         make_preambule_p1 = """## variables #############################
 PWD := $(shell pwd)
-TOP_MODULE := """ + top_module.top_module + """
-FUSE_OUTPUT ?= isim_proj
+""" + top_variables + """
 
 XILINX_INI_PATH := """ + XilinxsiminiReader.xilinxsim_ini_dir() + """
 
@@ -85,12 +149,13 @@ VHPCOMP_FLAGS := -intstyle default -incremental -initfile xilinxsim.ini
 ISIM_FLAGS :=
 VLOGCOMP_FLAGS := -intstyle default -incremental -initfile xilinxsim.ini """ + self.__get_rid_of_isim_incdirs(top_module.vlog_opt) + """
 """
+        if self.timing:
+            make_preambule_p1 += timing_variables()
         make_preambule_p2 = string.Template("""## rules #################################
 local: sim_pre_cmd simulation sim_post_cmd
 
-simulation: xilinxsim.ini $$(LIB_IND) $$(VERILOG_OBJ) $$(VHDL_OBJ) fuse
-$$(VERILOG_OBJ): $$(LIB_IND) xilinxsim.ini
-$$(VHDL_OBJ): $$(LIB_IND) xilinxsim.ini
+simulation: xilinxsim.ini $$(LIB_IND) ${objs} ${elaborations}
+${obj_deps}
 
 sim_pre_cmd:
 \t\t${sim_pre_cmd}
@@ -100,12 +165,11 @@ sim_post_cmd:
 
 xilinxsim.ini: $$(XILINX_INI_PATH)/xilinxsim.ini
 \t\tcp $$< .
-fuse:
-\t\tfuse work.$$(TOP_MODULE) -intstyle ise -incremental -o $$(FUSE_OUTPUT)
+${fuse_rules}
 
 clean:
 \t\trm -rf ./xilinxsim.ini $$(LIBS) fuse.xmsgs fuse.log fuseRelaunch.cmd isim isim.log \
-isim.wdb isim_proj isim_proj.*
+isim.wdb isim_proj isim_proj.*${top_clean}
 .PHONY: clean sim_pre_cmd sim_post_cmd simulation
 
 """)
@@ -158,7 +222,40 @@ isim.wdb isim_proj isim_proj.*
         else:
             sim_post_cmd = ''
 
-        make_text_p2 = make_preambule_p2.substitute(sim_pre_cmd=sim_pre_cmd, sim_post_cmd=sim_post_cmd)
+        if self.batch:
+            from tools.common.sim_schedule import get_compile_groups
+            groups = get_compile_groups(fileset, self._get_batch_key)
+            self.write("GROUP_OBJ := ")
+            for group in groups:
+                self.write(group.path + " \\\n")
+            self.write('\n')
+            objs = "$(GROUP_OBJ)"
+            obj_deps = "$(GROUP_OBJ): $(LIB_IND) xilinxsim.ini"
+        else:
+            objs = "$(VERILOG_OBJ) $(VHDL_OBJ)"
+            obj_deps = "$(VERILOG_OBJ): $(LIB_IND) xilinxsim.ini\n$(VHDL_OBJ): $(LIB_IND) xilinxsim.ini"
+
+        if has_multiple_tops(top_module):
+            # one fuse at a time, as they share the isim directory
+            elaborations = ' '.join(self._get_fuse_output(top) for top in tops)
+            fuse_rules = ISIM_RUN_TCL + ":\n\t\techo \"run all\" > $@ && echo \"quit\" >> $@\n"
+            for index, top in enumerate(tops):
+                top_objs = self._get_top_objs(fileset, top, groups if self.batch else None)
+                if index > 0:
+                    top_objs.extend(["|", self._get_fuse_output(tops[index - 1])])
+                fuse_rules += "%s: xilinxsim.ini $(LIB_IND) %s\n" % (self._get_fuse_output(top), ' '.join(top_objs))
+                fuse_rules += "\t\tfuse %s.%s -intstyle ise -incremental -o $@\n" % (get_top_library(fileset, top), top)
+            top_clean = " " + ' '.join([ISIM_RUN_TCL] +
+                                       ["%s %s.* %s.wdb %s.isim.log" % (self._get_fuse_output(top), self._get_fuse_output(top), top, top)
+                                        for top in tops] + get_log_files(tops))
+        else:
+            elaborations = "fuse"
+            fuse_rules = "fuse:\n\t\tfuse work.$(TOP_MODULE) -intstyle ise -incremental -o $(FUSE_OUTPUT)"
+            top_clean = ""
+
+        make_text_p2 = make_preambule_p2.substitute(sim_pre_cmd=sim_pre_cmd, sim_post_cmd=sim_post_cmd,
+                                                    objs=objs, obj_deps=obj_deps, elaborations=elaborations,
+                                                    fuse_rules=fuse_rules, top_clean=top_clean)
         self.writeln(make_text_p2)
 
         # ISim does not have a vmap command to insert additional libraries in
@@ -174,6 +271,15 @@ isim.wdb isim_proj isim_proj.*
             # Modify xilinxsim.ini file by including the extra local libraries
             #self.write(' '.join(["\t(echo """, lib+"="+lib+"/."+lib, ">>", "${XILINX_INI_PATH}/xilinxsim.ini"]))
 
+        if has_multiple_tops(top_module):
+            write_top_rules(self, [(top, [self._get_fuse_output(top), ISIM_RUN_TCL], [],
+                                    self.get_run_command(fileset, top))
+                                   for top in tops])
+
+        if self.batch:
+            self._write_batch_rules(groups, fileset)
+            return
+
         #rules for all _primary.dat files for sv
         #incdir = ""
         objs = []
@@ -185,7 +291,7 @@ isim.wdb isim_proj isim_proj.*
             self.write(os.path.join(comp_obj, '.'+vl.purename+"_"+vl.extension())+': ')
             self.write(vl.rel_path() + ' ')
             self.writeln(' '.join([fname.rel_path() for fname in vl.depends_on]))
-            self.write("\t\tvlogcomp -work "+vl.library+"=./"+vl.library)
+            self.write("\t\t" + self._timed() + "vlogcomp -work "+vl.library+"=./"+vl.library)
             self.write(" $(VLOGCOMP_FLAGS) ")
             #if isinstance(vl, SVFile):
             #    self.write(" -sv ")
@@ -209,7 +315,7 @@ isim.wdb isim_proj isim_proj.*
             #self.write(os.path.join(lib, purename, "."+purename+"_"+ vhdl.extension()) + ": "+ vhdl.rel_path()+" " + os.path.join(lib, purename, "."+purename) + '\n')
             #self.writeln(".PHONY: " + os.path.join(comp_obj, "."+purename+"_"+ vhdl.extension()))
             self.write(os.path.join(comp_obj, "."+purename+"_" + vhdl.extension()) + ": " + vhdl.rel_path()+" " + os.path.join(lib, purename, "."+purename) + '\n')
-            self.writeln(' '.join(["\t\tvhpcomp $(VHPCOMP_FLAGS)", vhdl.vcom_opt, "-work", lib+"=./"+lib, "$< "]))
+            self.writeln(' '.join(["\t\t" + self._timed() + "vhpcomp $(VHPCOMP_FLAGS)", vhdl.vcom_opt, "-work", lib+"=./"+lib, "$< "]))
             self.writeln("\t\t@mkdir -p $(dir $@) && touch $@\n")
             self.writeln()
             # dependency meta-target. This rule just list the dependencies of the above file
@@ -228,6 +334,57 @@ isim.wdb isim_proj isim_proj.*
             self.writeln("\t\t@mkdir -p $(dir $@) && touch $@\n")
 
 
+    def _timed(self):
+        return "$(TIMED) " if self.timing else ""
+
+    def _get_fuse_output(self, top):
+        return "isim_" + top
+
+    def _get_top_objs(self, fileset, top, groups=None):
+        """Return the compilation markers of the files used by the top, or
+        of the groups they are compiled in"""
+        top_files = get_top_files(fileset, top)
+        if groups is not None:
+            return [group.path for group in groups if any(f in top_files for f in group.files)]
+        return [os.path.join(f.library, f.purename, "." + f.purename + "_" + f.extension()) for f in top_files]
+
+    def get_run_command(self, fileset, top, name=None):
+        """Return the command running the simulation of the top, writing
+        name.isim.log and name.wdb (the top by default)"""
+        name = name or top
+        return "./%s -tclbatch %s -log %s.isim.log -wdb %s.wdb" % (self._get_fuse_output(top), ISIM_RUN_TCL, name, name)
+
+    def _get_batch_key(self, source_file):
+        from srcfile import VHDLFile
+        if isinstance(source_file, VHDLFile):
+            return ("vhdl", source_file.vcom_opt)
+        return ("verilog", source_file.vlog_opt)
+
+    def _write_batch_rules(self, groups, fileset):
+        """Write a rule for each group of files, compiling all of them when
+        one of the files or of their dependencies changes"""
+        for group in groups:
+            sources = [f.rel_path() for f in group.files]
+            includes = sorted(set(d.rel_path() for f in group.files for d in f.depends_on
+                                  if d is not f and d not in fileset))
+            self.write("%s: %s" % (group.path, " \\\n".join(sources)))
+            for dep in sorted(d.path for d in group.depends_on) + includes:
+                self.write(" \\\n" + dep)
+            self.writeln()
+            work = group.library + "=./" + group.library
+            if group.kind == "vhdl":
+                self.writeln(' '.join(["\t\t" + self._timed() + "vhpcomp $(VHPCOMP_FLAGS)", group.files[0].vcom_opt, "-work", work] +
+                                      sources))
+            else:
+                include_dirs = []
+                for source_file in group.files:
+                    include_dirs.extend(d for d in source_file.include_dirs if d not in include_dirs)
+                self.writeln(' '.join(["\t\t" + self._timed() + "vlogcomp -work", work, "$(VLOGCOMP_FLAGS)",
+                                       "-i", ' '.join(include_dirs), group.files[0].vlog_opt] +
+                                      sources))
+            self.writeln("\t\t@touch $@")
+            self.writeln()
+
     # FIX. Make it more robust
     def __get_rid_of_isim_incdirs(self, vlog_opt):
         if not vlog_opt:
@@ -257,30 +414,9 @@ class XilinxsiminiReader(object):
 
     # Parse the xilinxsim.ini file to get the referenced libraries
     def get_libraries(self):
-        libs = []
-
-        try:
-            ini = open(self.path, "r")
-        except Exception:
+        if not os.path.isfile(self.path):
             raise RuntimeError("Can't open existing xilinxsim.ini file")
-
-        #p.info("Reading 'xilinxsim.ini' located in: '"+ str(self.path))
-
-        # Read loggical libraries name, skipping comments and other
-        #possible sections
-        for line in ini:
-            # Read line by line, skipping comments and striping newline
-            line = line.split('--')[0].strip()
-            # Still in comments section
-            if line == "":
-                continue
-
-            # Not in comments section. Library section:
-            #<logical_library> = <phisical_path>
-            line = line.split('=')
-            lib = line[0].strip()
-            libs.append(lib.lower())
-        return libs
+        return sorted(library_catalog.get_ini_libraries(self.path))
 
     @staticmethod
     def xilinxsim_ini_dir():
@@ -26,8 +26,11 @@ from subprocess import Popen, PIPE
 import string
 from string import Template
 import fetch
+import logging
 
 from makefile_writer import MakefileWriter
+from tools.common.sim_makefile_support import timing_variables
+from tools.common.sim_tops import get_top_modules, get_top_files, has_multiple_tops, write_top_rules
 
 
 IVERILOG_STANDARD_LIBS = ['std', 'ieee', 'ieee_proposed', 'vl', 'synopsys',
@@ -38,6 +41,18 @@ IVERILOG_STANDARD_LIBS = ['std', 'ieee', 'ieee_proposed', 'vl', 'synopsys',
 
 class ToolControls(MakefileWriter):
 
+    # iverilog option defining a Verilog macro, added to iverilog_opt by
+    # hdlmake matrix
+    define_option = "-D%s"
+    define_manifest_option = "iverilog_opt"
+    # vvp option of the tests run by hdlmake regress
+    plusarg_option = "+%s"
+
+    def __init__(self):
+        # Log the time taken by every elaboration (see util.timing)
+        self.timing = False
+        super(ToolControls, self).__init__()
+
 
     def get_keys(self):
         tool_info = {
@@ -61,45 +76,73 @@ class ToolControls(MakefileWriter):
         return version
 
 
+    def get_ninja_rules(self, fileset, top_module):
+        # nothing is compiled before the elaboration, which reads the files
+        # listed in the command file of the top
+        elaborate = []
+        for top in get_top_modules(top_module):
+            command_file, _ = self._write_top_files(fileset, top)
+            top_files = get_top_files(fileset, top)
+            includes = set(f.rel_path() for source_file in top_files
+                           for f in getattr(source_file, "included_files", []))
+            elaborate.append({"outputs": [top + ".vvp"],
+                              "inputs": [command_file],
+                              "implicit": [f.rel_path() for f in top_files] + sorted(includes),
+                              "command": "iverilog %s-s %s -o $out -c $in" % (_get_options(top_module), top)})
+        rules = {"elaborate": elaborate}
+        if has_multiple_tops(top_module):
+            rules["run"] = [{"top": top,
+                             "inputs": [top + ".vvp"],
+                             "command": self.get_run_command(fileset, top)}
+                            for top in get_top_modules(top_module)]
+        return rules
+
+    def get_run_command(self, fileset, top, name=None):
+        """Return the command running the simulation of the top. It writes
+        no file, so name is not used."""
+        return "vvp %s.vvp" % top
+
     def generate_simulation_makefile(self, fileset, top_module):
         # TODO FLAGS: 2009 enables SystemVerilog (ongoing support) and partial VHDL support
 
-        # TODO: include dir
-        
-        from srcfile import VerilogFile, VHDLFile, SVFile
+        tops = get_top_modules(top_module)
 
-        makefile_tmplt_1 = string.Template("""TOP_MODULE := ${top_module}
+        # the command files and the depfiles of the tops are written by
+        # hdlmake, like the makefile: make clean keeps them
+        makefile_tmplt_1 = string.Template("""TOP_MODULES := ${top_modules}
 IVERILOG_CRAP := \
-run.command \
 ivl_vhdl_work
 
 #target for performing local simulation
 local: sim_pre_cmd simulation sim_post_cmd
 
-simulation:
+simulation: $$(TOP_MODULES:%=%.vvp)
+${timing_variables}
 """)
 
         makefile_text_1 = makefile_tmplt_1.substitute(
-            top_module=top_module.top_module
+            top_modules=' '.join(tops),
+            timing_variables=timing_variables() if self.timing else ""
         )
         self.write(makefile_text_1)
-
-        self.writeln("\t\techo \"# IVerilog command file, generated by HDLMake\" > run.command")
-
-        for vl in fileset.filter(VerilogFile):
-            self.writeln("\t\techo \"" + vl.rel_path() + "\" >> run.command")
-
-        for vhdl in fileset.filter(VHDLFile):
-            self.writeln("\t\techo \"" + vhdl.rel_path() + "\" >> run.command")
-
-        for sv in fileset.filter(SVFile):
-            self.writeln("\t\techo \"" + sv.rel_path() + "\" >> run.command")
-
-
-        makefile_tmplt_2 = string.Template("""      
-\t\tiverilog -s $$(TOP_MODULE) -o $$(TOP_MODULE).vvp -c run.command
-
-sim_pre_cmd:
+        if has_multiple_tops(top_module):
+            self.writeln("IVERILOG_CRAP += $(TOP_MODULES:%=%.log)")
+            self.writeln()
+
+        # every top is elaborated from the files it uses only, so editing
+        # a file rebuilds the tops depending on it and nothing else
+        for top in tops:
+            command_file, dep_file = self._write_top_files(fileset, top)
+            self.write("%s.vvp: %s" % (top, command_file))
+            for source_file in get_top_files(fileset, top):
+                self.write(" \\\n" + source_file.rel_path())
+            self.writeln()
+            self.writeln("\t\t%siverilog %s-s %s -o $@ -c %s" % ("$(TIMED) " if self.timing else "",
+                                                                _get_options(top_module), top, command_file))
+            self.writeln("-include %s" % dep_file)
+            self.writeln()
+
+        makefile_tmplt_2 = string.Template("""sim_pre_cmd:
 \t\t${sim_pre_cmd}
 
 sim_post_cmd:
@@ -132,67 +175,43 @@ mrproper: clean
         )
         self.write(makefile_text_2)
 
-
-    # Below is the old makefile generator: I'll keep it for some time while testing
-
-    def generate_iverilog_makefile(self, fileset, top_module, modules_pool):
-        print('javi checkpoint 0')
-        from srcfile import VerilogFile
-
-        for f in global_mod.top_module.incl_makefiles:
-            self.writeln("include " + f)
-        target_list = []
-        for vl in fileset.filter(VerilogFile):
-            rel_dir_path = os.path.dirname(vl.rel_path())
-            if rel_dir_path:
-                rel_dir_path = rel_dir_path + '/'
-            target_name = os.path.join(rel_dir_path+vl.purename)
-            target_list.append(target_name)
-
-            dependencies_string = ' '.join([f.rel_path() for f in vl.depends_on if (f.name != vl.name)])
-            include_dirs = list(set([os.path.dirname(f.rel_path()) for f in vl.depends_on if f.name.endswith("vh")]))
-            while "" in include_dirs:
-                include_dirs.remove("")
-            include_dir_string = " -I".join(include_dirs)
-            if include_dir_string:
-                include_dir_string = ' -I'+include_dir_string
-                self.writeln("VFLAGS_"+target_name+"="+include_dir_string)
-            self.writeln('# jd checkpoint')
-            self.writeln(target_name+"_deps = "+dependencies_string)
-        print('javi target_list', target_list)
-
-        sim_only_files = []
-        for m in global_mod.mod_pool:
-            for f in m.sim_only_files:
-                sim_only_files.append(f.name)
-        print('javi sim_only_files', sim_only_files)
-
-        # bit file targets are those that are only used in simulation
-        bit_targets = []
-        for m in global_mod.mod_pool:
-            bit_targets = bit_targets + list(m.bit_file_targets)
-        print('javi bit_targets', bit_targets)
-
-        for bt in bit_targets:
-            bt = bt.purename
-            bt_syn_deps = []
-            # This can perhaps be done faster (?)
-            for vl in fileset.filter(VerilogFile):
-                if vl.purename == bt:
-                    for f in vl.depends_on:
-                        if (f.name != vl.name and f.name not in sim_only_files):
-                            bt_syn_deps.append(f)
-            self.writeln(bt+'syn_deps = '+ ' '.join([f.rel_path() for f in bt_syn_deps]))
-            if not os.path.exists("%s.ucf" % bt):
-                logging.warning("The file %s.ucf doesn't exist!" % bt)
-            self.writeln(bt+".bit:\t"+bt+".v $("+bt+"syn_deps) "+bt+".ucf")
-            part=(global_mod.top_module.syn_device+'-'+
-                  global_mod.top_module.syn_package+
-                  global_mod.top_module.syn_grade)
-            self.writeln("\tPART="+part+" $(SYNTH) "+bt+" $^")
-            self.writeln("\tmv _xilinx/"+bt+".bit $@")
-
-        self.writeln("clean:")
-        self.writeln("\t\trm -f "+" ".join(target_list)+"\n\t\trm -rf _xilinx")
-
-
+        if has_multiple_tops(top_module):
+            write_top_rules(self, [(top, [top + ".vvp"], [], self.get_run_command(fileset, top)) for top in tops])
+
+    def _write_top_files(self, fileset, top):
+        """Write the command file of the top and the depfile listing the
+        files included by its sources. The files are only written when
+        their content changes, so that make doesn't rebuild the top."""
+        top_files = get_top_files(fileset, top)
+        command_file = top + ".command"
+        dep_file = top + ".vvp.d"
+
+        writer = MakefileWriter(command_file)
+        include_dirs = []
+        for source_file in top_files:
+            for include_dir in getattr(source_file, "include_dirs", []):
+                if include_dir not in include_dirs:
+                    include_dirs.append(include_dir)
+        for include_dir in include_dirs:
+            writer.writeln("+incdir+" + include_dir)
+        for source_file in top_files:
+            writer.writeln(source_file.rel_path())
+        writer.close()
+
+        includes = sorted(set(f.rel_path() for source_file in top_files
+                              for f in getattr(source_file, "included_files", [])))
+        writer = MakefileWriter(dep_file)
+        writer.writeln("%s.vvp: %s" % (top, ' '.join(includes)))
+        # the headers are targets too, so that removing one doesn't break make
+        for include in includes:
+            writer.writeln()
+            writer.writeln("%s:" % include)
+        writer.close()
+        return command_file, dep_file
+
+
+def _get_options(top_module):
+    """Return the iverilog_opt of the top module, followed by a space"""
+    if top_module.iverilog_opt:
+        return top_module.iverilog_opt + " "
+    return ""
@@ -23,6 +23,7 @@
 
 import subprocess
 import sys
+import logging
 import os
 
 import string
@@ -30,6 +31,7 @@ from string import Template
 import fetch
 
 from makefile_writer import MakefileWriter
+from util import process
 
 
 LIBERO_STANDARD_LIBS = ['ieee', 'std']
@@ -37,6 +39,8 @@ LIBERO_STANDARD_LIBS = ['ieee', 'std']
 
 class ToolControls(MakefileWriter):
 
+    timeout = None
+
 
     def detect_version(self, path):
         return 'unknown'
@@ -138,6 +142,7 @@ mrproper:
         self.syn_top = top_mod.syn_top
         self.header = None
         self.tclname = 'temporal.tcl'
+        self.logname = 'hdlmake_libero.log'
 
         if update is True:
             self.update_project()
@@ -145,7 +150,7 @@ mrproper:
             self.create_project()
         self.add_files(fileset)
         self.emit()
-        self.execute()     
+        return self.execute()
 
 
     def emit(self, update=False):
@@ -159,16 +164,9 @@ mrproper:
     def execute(self):
         tmp = 'libero SCRIPT:{0}'
         cmd = tmp.format(self.tclname)
-        p = subprocess.Popen(cmd, shell=True, stderr=subprocess.PIPE)
-        ## But do not wait till Libero finish, start displaying output immediately ##
-        while True:
-            out = p.stderr.read(1)
-            if out == '' and p.poll() != None:
-                break
-            if out != '':
-                sys.stdout.write(out)
-                sys.stdout.flush()
+        result = process.run(cmd, log_path=self.logname, timeout=self.timeout)
         os.remove(self.tclname)
+        return result
 
 
     def add_files(self, fileset):
@@ -60,7 +60,21 @@ class ToolControls(VsimMakefileWriter):
     def get_standard_libraries(self):
         return MODELSIM_STANDARD_LIBS
 
+    def get_library_ini(self):
+        """The modelsim.ini of the installation, mapping the vendor libraries"""
+        if global_mod.env["modelsim_path"]:
+            return os.path.join(global_mod.env["modelsim_path"], "..", "modelsim.ini")
+        return None
+
     def generate_simulation_makefile(self, fileset, top_module):
+        self._add_modelsim_ini()
+        super(ToolControls, self).generate_simulation_makefile(fileset, top_module)
+
+    def get_ninja_rules(self, fileset, top_module):
+        self._add_modelsim_ini()
+        return super(ToolControls, self).get_ninja_rules(fileset, top_module)
+
+    def _add_modelsim_ini(self):
         self.vcom_flags.extend(["-modelsimini", "modelsim.ini"])
         self.vlog_flags.extend(["-modelsimini", "modelsim.ini"])
         self.vmap_flags.extend(["-modelsimini", "modelsim.ini"])
@@ -73,5 +87,4 @@ class ToolControls(VsimMakefileWriter):
         self.additional_clean.extend(["./modelsim.ini", "transcript", "*.vcd", "*.wlf"])
 
         self.copy_rules["modelsim.ini"] = os.path.join("$(MODELSIM_INI_PATH)", "modelsim.ini")
-        super(ToolControls, self).generate_simulation_makefile(fileset, top_module)
 
@@ -31,13 +31,20 @@ import fetch
 import logging
 
 from makefile_writer import MakefileWriter
+from util import tcl_session
+from tools.common import project_files
 
 
+# extensions of the files added by hdlmake, which it may remove from a project
+PLANAHEAD_PROJECT_EXTENSIONS = ['vhd', 'vhdl', 'vho', 'v', 'vh', 'vo', 'vm', 'sv', 'svh', 'ucf', 'ngc', 'xmp', 'xco']
+
 PLANAHEAD_STANDARD_LIBS = ['ieee', 'std']
 
 
 class ToolControls(MakefileWriter):
 
+    timeout = None
+
     
     def detect_version(self, path):
         return 'unknown'
@@ -144,9 +151,15 @@ mrproper:
         self.filename = top_mod.syn_project
         self.header = None
         self.tclname = 'temporal.tcl'
+        self.logname = 'hdlmake_planahead.log'
+        self.removed = []
+        self.add_files(fileset)
         if update is True:
             logging.info("Existing project detected: updating...")
             self.update_project()
+            if not self.update_files():
+                logging.info("PlanAhead project is up to date.")
+                return None
         else:
             logging.info("No previous project: creating a new one...")
             self.create_project()
@@ -154,11 +167,11 @@ mrproper:
                                    top_mod.syn_grade,
                                    top_mod.syn_package,
                                    top_mod.syn_top)
-        self.add_files(fileset)
         self.emit()
-        self.execute()
-
-        logging.info("PlanAhead project file generated.")
+        result = self.execute()
+        if result.ok:
+            logging.info("PlanAhead project file generated.")
+        return result
 
 
     def emit(self):
@@ -169,28 +182,34 @@ mrproper:
         f.write(self.__emit_files())
         f.write('update_compile_order -fileset sources_1\n')
         f.write('update_compile_order -fileset sim_1\n')
-        f.write('exit\n')
+        f.write('close_project\n')
         f.close()
 
     def execute(self):
-        tmp = 'planAhead -mode tcl -source {0}'
-        cmd = tmp.format(self.tclname)
-        p = subprocess.Popen(cmd, shell=True, stderr=subprocess.PIPE)
-        ## But do not wait till planahead finish, start displaying output immediately ##
-        while True:
-            out = p.stderr.read(1)
-            if out == '' and p.poll() != None:
-                break
-            if out != '':
-                sys.stdout.write(out)
-                sys.stdout.flush()
+        session = tcl_session.get_session('planAhead -mode tcl')
+        result = session.source(self.tclname, log_path=self.logname, timeout=self.timeout)
         os.remove(self.tclname)
+        return result
 
 
     def add_files(self, fileset):
         for f in fileset:
             self.files.append(f)
 
+    def update_files(self):
+        """Keep in the files only those missing from the existing project,
+        and list the files of the project to remove. Return False when
+        the project is up to date."""
+        from srcfile import TCLFile
+        current = project_files.read_xpr_files(self.filename + '.ppr')
+        scripts = [f for f in self.files if isinstance(f, TCLFile)]
+        sources = [f for f in self.files if self._is_project_file(f)]
+        added, self.removed = project_files.get_changes(current, sources, PLANAHEAD_PROJECT_EXTENSIONS)
+        project_files.log_changes("PlanAhead", added, self.removed)
+        # the scripts are sourced at every update
+        self.files = added + scripts
+        return bool(self.files or self.removed)
+
     def add_property(self, new_property):
         self.properties.append(new_property)
 
@@ -228,16 +247,19 @@ mrproper:
 
     def __emit_files(self):
         tmp = "add_files -norecurse {0}"
-        ret = []
-        from srcfile import VHDLFile, VerilogFile, SVFile, UCFFile, NGCFile, XMPFile, XCOFile
+        ret = ["remove_files {%s}" % path for path in self.removed]
         for f in self.files:
-            if isinstance(f, VHDLFile) or isinstance(f, VerilogFile) or isinstance(f, SVFile) or isinstance(f, UCFFile) or isinstance(f, NGCFile) or isinstance(f, XMPFile) or isinstance(f, XCOFile):
+            if self._is_project_file(f):
                 line = tmp.format(f.rel_path())
             else:
                 continue
             ret.append(line)
         return ('\n'.join(ret))+'\n'
 
+    def _is_project_file(self, f):
+        from srcfile import VHDLFile, VerilogFile, SVFile, UCFFile, NGCFile, XMPFile, XCOFile
+        return isinstance(f, VHDLFile) or isinstance(f, VerilogFile) or isinstance(f, SVFile) or isinstance(f, UCFFile) or isinstance(f, NGCFile) or isinstance(f, XMPFile) or isinstance(f, XCOFile)
+
 
 
 class _PlanAheadProjectProperty:
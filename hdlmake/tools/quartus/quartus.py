@@ -22,15 +22,22 @@
 #
 
 import os
+import re
 import sys
+import logging
+from collections import OrderedDict
 
 import string
 from string import Template
 import fetch
 
-from makefile_writer import MakefileWriter
+from makefile_writer import MakefileWriter, write_file
+from tools.common import project_files
 
 
+# extensions of the files hdlmake writes in a project
+QUARTUS_PROJECT_EXTENSIONS = ['vhd', 'vhdl', 'vho', 'v', 'vh', 'vo', 'vm', 'sv', 'svh', 'stp', 'sdc', 'qip', 'dpf']
+
 QUARTUS_STANDARD_LIBS = ['altera', 'altera_mf', 'lpm', 'ieee', 'std']
 
 
@@ -141,7 +148,7 @@ mrproper:
 
 
     def generate_synthesis_project(self, update=False, tool_version='', top_mod=None, fileset=None):
-        self.properties = []
+        self.properties = OrderedDict()
         self.files = []
         self.filename = top_mod.syn_project
         self.preflow = top_mod.quartus_preflow
@@ -156,19 +163,23 @@ mrproper:
                                        top_mod.syn_package,
                                        top_mod.syn_top)
         self.add_files(fileset)
+        if update is True:
+            added, removed = project_files.get_changes(self.current_files,
+                                                       [f for f in self.files if self._get_assignment(f)],
+                                                       QUARTUS_PROJECT_EXTENSIONS)
+            project_files.log_changes("Quartus", added, removed)
         self.emit()
 
 
     def emit(self):
-        f = open(self.filename+'.qsf', "w")
-        for p in self.properties:
-            f.write(p.emit()+'\n')
-        f.write(self.__emit_files())
-        f.write(self.__emit_scripts())
-        f.close()
-        f = open(self.filename+'.qpf', "w")
-        f.write("PROJECT_REVISION = \"" + self.filename + "\"\n")
-        f.close()
+        # the files are only written when they change, so Quartus doesn't
+        # see a modified project
+        content = ''.join(p.emit()+'\n' for p in self.properties.itervalues())
+        content += self.__emit_files()
+        content += self.__emit_scripts()
+        if not write_file(self.filename+'.qsf', content):
+            logging.info("The .qsf project file is up to date")
+        write_file(self.filename+'.qpf', "PROJECT_REVISION = \"" + self.filename + "\"\n")
 
     def __emit_scripts(self):
         tmp = 'set_global_assignment -name {0} "quartus_sh:{1}"'
@@ -182,96 +193,101 @@ mrproper:
         return pre+'\n'+mod+'\n'+post+'\n'
 
     def __emit_files(self):
-        from srcfile import VHDLFile, VerilogFile, SignalTapFile, SDCFile, QIPFile, DPFFile
         tmp = "set_global_assignment -name {0} {1}"
         ret = []
         for f in self.files:
-            if isinstance(f, VHDLFile):
-                line = tmp.format("VHDL_FILE", f.rel_path())
-            elif isinstance(f, VerilogFile):
-                line = tmp.format("VERILOG_FILE", f.rel_path())
-            elif isinstance(f, SignalTapFile):
-                line = tmp.format("SIGNALTAP_FILE", f.rel_path())
-            elif isinstance(f, SDCFile):
-                line = tmp.format("SDC_FILE", f.rel_path())
-            elif isinstance(f, QIPFile):
-                line = tmp.format("QIP_FILE", f.rel_path())
-            elif isinstance(f, DPFFile):
-                line = tmp.format("MISC_FILE", f.rel_path())
+            assignment = self._get_assignment(f)
+            if assignment:
+                line = tmp.format(assignment, f.rel_path())
             else:
                 continue
             ret.append(line)
         return ('\n'.join(ret))+'\n'
 
+    def _get_assignment(self, f):
+        from srcfile import VHDLFile, VerilogFile, SignalTapFile, SDCFile, QIPFile, DPFFile
+        if isinstance(f, VHDLFile):
+            return "VHDL_FILE"
+        elif isinstance(f, VerilogFile):
+            return "VERILOG_FILE"
+        elif isinstance(f, SignalTapFile):
+            return "SIGNALTAP_FILE"
+        elif isinstance(f, SDCFile):
+            return "SDC_FILE"
+        elif isinstance(f, QIPFile):
+            return "QIP_FILE"
+        elif isinstance(f, DPFFile):
+            return "MISC_FILE"
+        return None
+
     def add_property(self, val):
+        """Add a property, or replace the property with the same key at its
+        place in the project"""
         #don't save files (they are unneeded)
         if val.name_type is not None and "_FILE" in val.name_type:
             return
-        self.properties.append(val)
+        key = val.key()
+        if key is None:
+            key = ("property", len(self.properties))
+        self.properties[key] = val
 
     def add_files(self, fileset):
         for f in fileset:
             self.files.append(f)
 
     def read(self):
-        def __gather_string(words, first_index):
-            i = first_index
-            ret = []
-            if words[i][0] != '"':
-                return (words[i], 1)
-            else:
-                while True:
-                    ret.append(words[i])
-                    if words[i][len(words[i])-1] == '"':
-                        return (' '.join(ret), len(ret))
-                    i = i + 1
-
+        self.current_files = []
         f = open(self.filename+'.qsf', "r")
-        lines = [l.strip() for l in f.readlines()]
-        lines = [l for l in lines if l != "" and l[0] != '#']
+        text = f.read()
+        f.close()
         QPP = _QuartusProjectProperty
-        for line in lines:
-            words = line.split()
+        for words in _split_commands(text):
+            if words[0] not in QPP.t:
+                # kept as they are, e.g. set_parameter
+                self.properties[("raw", len(self.properties))] = _QuartusRawCommand(words)
+                continue
             command = QPP.t[words[0]]
             what = name = name_type = from_ = to = section_id = None
+            extra = []
             i = 1
-            while True:
-                if i >= len(words):
-                    break
-
-                if words[i] == "-name":
+            while i < len(words):
+                word = words[i]
+                if word == "-name" and i+2 < len(words):
                     name_type = words[i+1]
-                    name, add = __gather_string(words, i+2)
-                    i = i+2+add
-                    continue
-                elif words[i] == "-section_id":
-                    section_id, add = __gather_string(words, i+1)
-                    i = i+1+add
-                    continue
-                elif words[i] == "-to":
-                    to, add = __gather_string(words, i+1)
-                    i = i+1+add
-                    continue
-                elif words[i] == "-from":
-                    from_, add = __gather_string(words, i+1)
+                    name = words[i+2]
+                    i = i+3
+                elif word in QPP.options and i+1 < len(words):
+                    value = words[i+1]
+                    if word == "-section_id":
+                        section_id = value
+                    elif word == "-to":
+                        to = value
+                    else:
+                        from_ = value
+                    i = i+2
+                elif what is None and not word.startswith("-"):
+                    what = word
+                    i = i+1
+                elif word.startswith("-") and i+1 < len(words) and not words[i+1].startswith("-"):
+                    # options hdlmake doesn't know, e.g. -entity or -tag
+                    extra.extend(words[i:i+2])
                     i = i+2
-                    continue
                 else:
-                    what = words[i]
+                    extra.append(word)
                     i = i+1
-                    continue
             prop = QPP(command=command,
                        what=what, name=name,
                        name_type=name_type,
                        from_=from_,
                        to=to,
-                       section_id=section_id)
+                       section_id=section_id,
+                       extra=extra)
 
+            if name_type is not None and name_type.endswith("_FILE") and name is not None:
+                self.current_files.append(os.path.normpath(_unquote(name)))
             self.add_property(prop)
-        f.close()
 
     def add_initial_properties(self, syn_device, syn_grade, syn_package, syn_top):
-        import re
         family_names = {
             "^EP2AGX.*$": "Arria II GX",
             "^EP3C.*$": "Cyclone III"
@@ -290,14 +306,98 @@ mrproper:
 
 
 
+# global assignments set by hdlmake: a project holds each one once
+QUARTUS_HDLMAKE_ASSIGNMENTS = ['FAMILY', 'DEVICE', 'TOP_LEVEL_ENTITY']
+
+# a word of a Tcl command, after the spaces and escaped newlines before it
+_TOKEN = re.compile(r'(?:[ \t\r\f\v]|\\\n)*(?:'
+                    r'([\n;])|'  # end of the command
+                    r'("(?:[^"\\]|\\.)*"|(?:[^\s;\\{]|\\.)(?:[^\s;\\]|\\.)*)|'
+                    r'(\{)|'
+                    r'(\\)?$)', re.DOTALL)
+_SPECIAL = re.compile(r'[{;\\]')
+_SIMPLE_WORD = re.compile(r'"[^"]*"|\S+')
+
+
+def _split_commands(text):
+    """Split the text of a .qsf file into commands, yielding the list of
+    words of each command. The words are kept as written, with their quotes
+    or braces, so that they are written back the same; comments are left
+    out. Like Tcl, a command ends at a newline or a semicolon outside of
+    quotes and braces, and a backslash continues it on the next line."""
+    lines = text.splitlines()
+    if not _SPECIAL.search(text) and not any(line.count('"') % 2 for line in lines):
+        # the usual files written by Quartus, one command per line
+        for line in lines:
+            words = _SIMPLE_WORD.findall(line)
+            if words and words[0][0] != "#":
+                yield words
+        return
+    words = []
+    i = 0
+    length = len(text)
+    while i < length:
+        match = _TOKEN.match(text, i)
+        end, word, brace = match.group(1, 2, 3)
+        i = match.end()
+        if end:
+            if words:
+                yield words
+                words = []
+        elif word:
+            if word[0] == "#" and not words:
+                newline = text.find("\n", match.start(2))
+                i = length if newline < 0 else newline
+            else:
+                # an unterminated quote is taken as a bare word
+                words.append(word)
+        elif brace:
+            start = i - 1
+            depth = 1
+            while i < length and depth:
+                char = text[i]
+                if char == "\\":
+                    i += 1
+                elif char == "{":
+                    depth += 1
+                elif char == "}":
+                    depth -= 1
+                i += 1
+            words.append(text[start:i])
+        else:
+            break  # the end of the text
+    if words:
+        yield words
+
+
+def _unquote(word):
+    if len(word) > 1 and (word[0], word[-1]) in [('"', '"'), ('{', '}')]:
+        return word[1:-1]
+    return word
+
+
+class _QuartusRawCommand:
+    """A command of the .qsf file hdlmake doesn't manage"""
+
+    name_type = None
+
+    def __init__(self, words):
+        self.words = words
+
+    def emit(self):
+        return ' '.join(self.words)
+
+
 class _QuartusProjectProperty:
     SET_GLOBAL_INSTANCE, SET_INSTANCE_ASSIGNMENT, SET_LOCATION_ASSIGNMENT, SET_GLOBAL_ASSIGNMENT = range(4)
     t = {"set_global_instance": SET_GLOBAL_INSTANCE,
          "set_instance_assignment": SET_INSTANCE_ASSIGNMENT,
          "set_location_assignment": SET_LOCATION_ASSIGNMENT,
          "set_global_assignment": SET_GLOBAL_ASSIGNMENT}
+    names = dict([(b, a) for a, b in t.items()])
+    options = ["-section_id", "-to", "-from"]
 
-    def __init__(self, command, what=None, name=None, name_type=None, from_=None, to=None, section_id=None):
+    def __init__(self, command, what=None, name=None, name_type=None, from_=None, to=None, section_id=None, extra=None):
         self.command = command
         self.what = what
         self.name = name
@@ -305,10 +405,20 @@ class _QuartusProjectProperty:
         self.from_ = from_
         self.to = to
         self.section_id = section_id
+        self.extra = extra or []
+
+    def key(self):
+        """The assignment set by hdlmake this property sets: a property with
+        the same key replaces it. None for the other properties, which are
+        all kept."""
+        if (self.command == self.SET_GLOBAL_ASSIGNMENT and self.name_type in QUARTUS_HDLMAKE_ASSIGNMENTS and
+                self.to is None and self.from_ is None and self.section_id is None and not self.extra):
+            return (self.command, self.name_type)
+        return None
 
     def emit(self):
         words = []
-        words.append(dict([(b, a) for a, b in self.t.items()])[self.command])
+        words.append(self.names[self.command])
 
         if self.what is not None:
             words.append(self.what)
@@ -325,7 +435,5 @@ class _QuartusProjectProperty:
         if self.section_id is not None:
             words.append("-section_id")
             words.append(self.section_id)
+        words.extend(self.extra)
         return ' '.join(words)
-
-
-
@@ -31,13 +31,20 @@ import fetch
 import logging
 
 from makefile_writer import MakefileWriter
+from util import tcl_session
+from tools.common import project_files
 
 
+# extensions of the files added by hdlmake, which it may remove from a project
+VIVADO_PROJECT_EXTENSIONS = ['vhd', 'vhdl', 'vho', 'v', 'vh', 'vo', 'vm', 'sv', 'svh', 'ucf', 'ngc', 'xmp', 'xco', 'bd']
+
 VIVADO_STANDARD_LIBS = ['ieee', 'std']
 
 
 class ToolControls(MakefileWriter):
 
+    timeout = None
+
     
     def detect_version(self, path):
         return 'unknown'
@@ -142,9 +149,15 @@ mrproper:
         self.filename = top_mod.syn_project
         self.header = None
         self.tclname = 'temporal.tcl'
+        self.logname = 'hdlmake_vivado.log'
+        self.removed = []
+        self.add_files(fileset)
         if update is True:
             logging.info("Existing project detected: updating...")
             self.update_project()
+            if not self.update_files():
+                logging.info("Vivado project is up to date.")
+                return None
         else:
             logging.info("No previous project: creating a new one...")
             self.create_project()
@@ -152,11 +165,11 @@ mrproper:
                                    top_mod.syn_grade,
                                    top_mod.syn_package,
                                    top_mod.syn_top)
-        self.add_files(fileset)
         self.emit()
-        self.execute()
-
-        logging.info("Vivado project file generated.")
+        result = self.execute()
+        if result.ok:
+            logging.info("Vivado project file generated.")
+        return result
 
 
     def emit(self):
@@ -167,28 +180,34 @@ mrproper:
         f.write(self.__emit_files())
         f.write('update_compile_order -fileset sources_1\n')
         f.write('update_compile_order -fileset sim_1\n')
-        f.write('exit\n')
+        f.write('close_project\n')
         f.close()
 
     def execute(self):
-        tmp = 'vivado -mode tcl -source {0}'
-        cmd = tmp.format(self.tclname)
-        p = subprocess.Popen(cmd, shell=True, stderr=subprocess.PIPE)
-        ## But do not wait till Vivado finish, start displaying output immediately ##
-        while True:
-            out = p.stderr.read(1)
-            if out == '' and p.poll() != None:
-                break
-            if out != '':
-                sys.stdout.write(out)
-                sys.stdout.flush()
+        session = tcl_session.get_session('vivado -mode tcl')
+        result = session.source(self.tclname, log_path=self.logname, timeout=self.timeout)
         os.remove(self.tclname)
+        return result
 
 
     def add_files(self, fileset):
         for f in fileset:
             self.files.append(f)
 
+    def update_files(self):
+        """Keep in the files only those missing from the existing project,
+        and list the files of the project to remove. Return False when
+        the project is up to date."""
+        from srcfile import TCLFile
+        current = project_files.read_xpr_files(self.filename + '.xpr')
+        scripts = [f for f in self.files if isinstance(f, TCLFile)]
+        sources = [f for f in self.files if self._is_project_file(f)]
+        added, self.removed = project_files.get_changes(current, sources, VIVADO_PROJECT_EXTENSIONS)
+        project_files.log_changes("Vivado", added, self.removed)
+        # the scripts are sourced at every update
+        self.files = added + scripts
+        return bool(self.files or self.removed)
+
     def add_property(self, new_property):
         self.properties.append(new_property)
 
@@ -229,10 +248,10 @@ mrproper:
     def __emit_files(self):
         tmp = "add_files -norecurse {0}"
         tcl = "source {0}"
-        ret = []
-        from srcfile import VHDLFile, VerilogFile, SVFile, UCFFile, NGCFile, XMPFile, XCOFile, BDFile, TCLFile
+        ret = ["remove_files {%s}" % path for path in self.removed]
+        from srcfile import TCLFile
         for f in self.files:
-            if isinstance(f, VHDLFile) or isinstance(f, VerilogFile) or isinstance(f, SVFile) or isinstance(f, UCFFile) or isinstance(f, NGCFile) or isinstance(f, XMPFile) or isinstance(f, XCOFile) or isinstance(f, BDFile):
+            if self._is_project_file(f):
                 line = tmp.format(f.rel_path())
             elif isinstance(f, TCLFile):
                 line = tcl.format(f.rel_path())
@@ -241,6 +260,10 @@ mrproper:
             ret.append(line)
         return ('\n'.join(ret))+'\n'
 
+    def _is_project_file(self, f):
+        from srcfile import VHDLFile, VerilogFile, SVFile, UCFFile, NGCFile, XMPFile, XCOFile, BDFile
+        return isinstance(f, VHDLFile) or isinstance(f, VerilogFile) or isinstance(f, SVFile) or isinstance(f, UCFFile) or isinstance(f, NGCFile) or isinstance(f, XMPFile) or isinstance(f, XCOFile) or isinstance(f, BDFile)
+
 
 
 class _VivadoProjectProperty:
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Watch a set of files and directories for changes.
+
+A file has changed when its modification time, size or inode changed (this
+catches editors that save through a rename). A directory has changed when
+the list of its entries changed. On Linux the kernel inotify interface is
+used to learn which paths have to be checked and to sleep until something
+happens; everywhere else all the paths are polled.
+"""
+
+import os
+import time
+import select
+import struct
+import logging
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+def _dir_state(path):
+    try:
+        return tuple(sorted(os.listdir(path)))
+    except OSError:
+        return None
+
+
+class PollingWatcher(object):
+    """Find changes by checking every watched path"""
+
+    def __init__(self, files, dirs=(), interval=1.0):
+        self.files = set(files)
+        self.dirs = set(dirs)
+        self.interval = interval
+        self._state = {}
+        self._scan(self.files, self.dirs)
+
+    def _scan(self, files, dirs):
+        changed = set()
+        for path, state in ([(f, _file_state(f)) for f in files] +
+                            [(d, _dir_state(d)) for d in dirs]):
+            if self._state.get(path) != state:
+                changed.add(path)
+            self._state[path] = state
+        return changed
+
+    def update(self, files, dirs=()):
+        """Replace the watched paths, keeping what is known of the old ones"""
+        files = set(files)
+        dirs = set(dirs)
+        new_files = files - self.files
+        new_dirs = dirs - self.dirs
+        self.files = files
+        self.dirs = dirs
+        self._scan(new_files, new_dirs)
+
+    def fileno(self):
+        """Descriptor that becomes readable when something changed, if any"""
+        return None
+
+    def changes(self):
+        """Return the watched paths that changed since the last call"""
+        return self._scan(self.files, self.dirs)
+
+    def wait(self, timeout=None):
+        """Block until some watched path changes or the timeout expires"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            changed = self.changes()
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return set()
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(PollingWatcher):
+    """Find changes with Linux inotify, checking only the reported paths"""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    _EVENT = struct.Struct("iIII")
+
+    # editors write a file through several system calls: wait a little, so
+    # that a save is seen as a single change
+    SETTLE_TIME = 0.05
+
+    def __init__(self, files, dirs=()):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        self._unwatched = set()
+        self._touched = set()
+        self._watch_directories(set(os.path.dirname(f) for f in files) | set(dirs))
+        PollingWatcher.__init__(self, files, dirs)
+
+    def _watch_directories(self, directories):
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM |
+                self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+        watched = set(self._watches.values())
+        for directory in directories:
+            if directory in watched or directory in self._unwatched:
+                continue
+            wd = self._add_watch(self._fd, directory.encode("utf-8"), mask)
+            if wd < 0:
+                logging.debug("Can't watch %s, it will be polled" % directory)
+                self._unwatched.add(directory)
+                continue
+            self._watches[wd] = directory
+
+    def update(self, files, dirs=()):
+        files = set(files)
+        dirs = set(dirs)
+        self._watch_directories(set(os.path.dirname(f) for f in files) | dirs)
+        PollingWatcher.update(self, files, dirs)
+
+    def fileno(self):
+        return self._fd
+
+    def _read_events(self):
+        try:
+            buf = os.read(self._fd, 65536)
+        except OSError:
+            return False
+        pos = 0
+        while pos < len(buf):
+            wd, mask, cookie, length = self._EVENT.unpack_from(buf, pos)
+            pos += self._EVENT.size
+            name = buf[pos:pos + length].rstrip(b"\0").decode("utf-8")
+            pos += length
+            if mask & self.IN_Q_OVERFLOW:
+                self._touched.update(self.files | self.dirs)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            self._touched.add(directory)
+            if name:
+                self._touched.add(os.path.join(directory, name))
+        return True
+
+    def changes(self):
+        while self._read_events():
+            pass
+        touched, self._touched = self._touched, set()
+        files = self.files & touched
+        dirs = self.dirs & touched
+        for directory in self._unwatched:
+            files.update(f for f in self.files if os.path.dirname(f) == directory)
+            if directory in self.dirs:
+                dirs.add(directory)
+        return self._scan(files, dirs)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if self._unwatched:
+                # some directories can only be polled
+                remaining = self.interval if remaining is None else min(remaining, self.interval)
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if readable:
+                time.sleep(self.SETTLE_TIME)
+            changed = self.changes()
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return set()
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def new_watcher(files, dirs=()):
+    """Return an inotify based watcher if the platform supports it,
+    a polling one otherwise"""
+    try:
+        return InotifyWatcher(files, dirs)
+    except (OSError, AttributeError, TypeError) as e:
+        logging.debug("inotify is not available (%s), polling the files instead" % e)
+        return PollingWatcher(files, dirs)
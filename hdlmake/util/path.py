@@ -149,6 +149,14 @@ def rel2abs(path, base=None):
     return os.path.abspath(retval)
 
 
+def cache_path(name):
+    """Return the path of the file name in the hdlmake cache directory,
+    ~/.cache/hdlmake unless XDG_CACHE_HOME is set"""
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "hdlmake", name)
+
+
 def search_for_manifest(search_path):
     """
     Look for manifest in the given folder
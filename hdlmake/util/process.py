@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run a tool, showing its output as it comes.
+
+Both pipes of the process are read line by line, each one by its own thread,
+so that a tool filling one of them never blocks and no time is spent polling
+it. The lines are copied to the terminal and to a log file. A process still
+running after its timeout is killed, together with the processes it started.
+"""
+
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import subprocess
+from Queue import Queue, Empty
+
+
+class ProcessResult(object):
+    """Exit status of a command run by run()"""
+
+    def __init__(self, command, returncode, timed_out, duration, log_path):
+        self.command = command
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.duration = duration
+        self.log_path = log_path
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+    def __str__(self):
+        if self.timed_out:
+            status = "timed out after %.1f s" % self.duration
+        elif self.returncode == 0:
+            status = "succeeded in %.1f s" % self.duration
+        else:
+            status = "failed with exit status %d after %.1f s" % (self.returncode, self.duration)
+        if self.log_path:
+            status += " (log: %s)" % self.log_path
+        return "%s %s" % (self.command, status)
+
+
+def _read_lines(pipe, name, queue):
+    for line in iter(pipe.readline, ''):
+        queue.put((name, line))
+    pipe.close()
+    queue.put((name, None))
+
+
+def _kill(process):
+    """Kill the process and the processes it started: the command is run by
+    a shell, which doesn't forward the signal to the tool"""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+    except OSError:
+        return  # already gone
+    for _ in range(50):
+        if process.poll() is not None:
+            return
+        time.sleep(0.1)
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        pass
+
+
+def run(command, log_path=None, timeout=None, echo=None):
+    """Run the command with a shell and return a ProcessResult.
+
+    The lines written by the command are copied to echo (sys.stdout by
+    default, False to keep quiet) and to the file log_path when given. The
+    command is killed when it runs for more than timeout seconds.
+    """
+    if echo is None:
+        echo = sys.stdout
+    log_file = open(log_path, "w") if log_path else None
+    start = time.time()
+    process = subprocess.Popen(command, shell=True,
+                               stdin=open(os.devnull),
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               preexec_fn=getattr(os, "setsid", None),
+                               close_fds=(os.name == "posix"),
+                               bufsize=1)
+    queue = Queue()
+    readers = [threading.Thread(target=_read_lines, args=(pipe, name, queue))
+               for name, pipe in [("stdout", process.stdout), ("stderr", process.stderr)]]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    timed_out = False
+    open_pipes = len(readers)
+    try:
+        while open_pipes:
+            if timeout is None:
+                name, line = queue.get()
+            else:
+                remaining = start + timeout - time.time()
+                try:
+                    if remaining <= 0:
+                        raise Empty
+                    name, line = queue.get(timeout=remaining)
+                except Empty:
+                    logging.error("%s: no exit after %s s, killing it" % (command, timeout))
+                    timed_out = True
+                    _kill(process)
+                    break
+            if line is None:
+                open_pipes -= 1
+                continue
+            if echo:
+                echo.write(line)
+                echo.flush()
+            if log_file:
+                log_file.write(line)
+        process.wait()
+    except KeyboardInterrupt:
+        _kill(process)
+        raise
+    finally:
+        for reader in readers:
+            reader.join(1.0)
+        if log_file:
+            log_file.close()
+    return ProcessResult(command, process.returncode, timed_out, time.time() - start, log_path)
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keep the TCL shell of a tool running and send it scripts to source.
+
+Starting a tool like Vivado takes tens of seconds, so a shell is started
+once per command and directory and kept until hdlmake exits: the scripts of
+a run, and those of all the runs of ``hdlmake serve`` or ``hdlmake watch``,
+share it. The scripts are written to the standard input of the shell, each
+one followed by lines printing a marker to both pipes, with the status of
+the script on the standard output, so the output of a script ends where both
+markers are read.
+"""
+
+import os
+import re
+import sys
+import time
+import atexit
+import logging
+import threading
+import subprocess
+from Queue import Queue, Empty
+
+from util.process import ProcessResult, _read_lines, _kill
+
+_sessions = {}
+
+
+class TclSession(object):
+    """A TCL shell run by command, e.g. ``vivado -mode tcl``"""
+
+    def __init__(self, command):
+        self.command = command
+        self.cwd = os.getcwd()
+        self._count = 0
+        self._queue = Queue()
+        self._process = subprocess.Popen(command, shell=True,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE,
+                                         preexec_fn=getattr(os, "setsid", None),
+                                         close_fds=(os.name == "posix"),
+                                         bufsize=1)
+        self._open_pipes = 2
+        for name, pipe in [("stdout", self._process.stdout), ("stderr", self._process.stderr)]:
+            reader = threading.Thread(target=_read_lines, args=(pipe, name, self._queue))
+            reader.daemon = True
+            reader.start()
+
+    def is_alive(self):
+        return self._process.poll() is None and self._open_pipes == 2
+
+    def source(self, script, log_path=None, timeout=None, echo=None):
+        """Source the script in the shell and return a ProcessResult: the
+        return code is 0 when the script ran without error. The output of
+        the script is copied to echo (sys.stdout by default) and log_path.
+        The shell is killed when the script runs for more than timeout
+        seconds."""
+        if echo is None:
+            echo = sys.stdout
+        self._count += 1
+        marker = "HDLMAKE_DONE_%d_%d" % (os.getpid(), self._count)
+        done = re.compile(r"%s(?: (\d+) ?(.*))?$" % marker)
+        description = "%s: source %s" % (self.command, script)
+        # a marker may follow the prompt of the shell on its line
+        self._write('set hdlmake_status [catch {source {%s}} hdlmake_error]\n'
+                    'puts stderr "%s"\n'
+                    'flush stderr\n'
+                    'puts "%s $hdlmake_status [string map {\\n { }} $hdlmake_error]"\n'
+                    'flush stdout\n' % (os.path.abspath(script), marker, marker))
+
+        log_file = open(log_path, "w") if log_path else None
+        start = time.time()
+        returncode = None
+        waited = set(["stdout", "stderr"])
+        timed_out = False
+        try:
+            while waited:
+                try:
+                    if timeout is None:
+                        name, line = self._queue.get()
+                    else:
+                        remaining = start + timeout - time.time()
+                        if remaining <= 0:
+                            raise Empty
+                        name, line = self._queue.get(timeout=remaining)
+                except Empty:
+                    logging.error("%s: no answer after %s s, killing it" % (description, timeout))
+                    timed_out = True
+                    returncode = 1
+                    self.kill()
+                    break
+                if line is None:
+                    self._open_pipes -= 1
+                    if self._open_pipes == 0:
+                        # the shell exited before the end of the script
+                        returncode = self._process.wait() or 1
+                        break
+                    continue
+                match = done.search(line)
+                if match and name in waited and (name == "stdout") == (match.group(1) is not None):
+                    waited.discard(name)
+                    if name == "stderr":
+                        continue
+                    returncode = int(match.group(1))
+                    if returncode and match.group(2):
+                        line = "ERROR: %s\n" % match.group(2)
+                    else:
+                        continue
+                if echo:
+                    echo.write(line)
+                    echo.flush()
+                if log_file:
+                    log_file.write(line)
+        except KeyboardInterrupt:
+            self.kill()
+            raise
+        finally:
+            if log_file:
+                log_file.close()
+        if returncode and not timed_out:
+            # a failed script may leave a project open: start over next time
+            self.close()
+        return ProcessResult(description, returncode, timed_out, time.time() - start, log_path)
+
+    def _write(self, text):
+        try:
+            self._process.stdin.write(text)
+            self._process.stdin.flush()
+        except IOError:
+            pass  # the shell exited, which source() finds out from its output
+
+    def close(self, timeout=10):
+        """Ask the shell to exit, kill it if it doesn't"""
+        if self._process.poll() is None:
+            self._write("exit\n")
+            try:
+                self._process.stdin.close()
+            except IOError:
+                pass
+            deadline = time.time() + timeout
+            while self._process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if self._process.poll() is None:
+                self.kill()
+
+    def kill(self):
+        _kill(self._process)
+        self._process.wait()
+
+
+def get_session(command):
+    """Return the running shell for the command in the current directory,
+    starting it if needed"""
+    key = (command, os.getcwd())
+    session = _sessions.get(key)
+    if session is None or not session.is_alive():
+        if not _sessions:
+            atexit.register(close_sessions)
+        logging.debug("Starting the TCL shell: %s" % command)
+        session = TclSession(command)
+        _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    """Close all the shells started by get_session()"""
+    while _sessions:
+        _, session = _sessions.popitem()
+        session.close()
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time the compilations of the simulation makefiles and report on them.
+
+The makefiles generated with --profile run every compile command through
+this file, used as a script:
+
+    python timing.py LOG TARGET PREREQUISITES -- COMMAND [ARGUMENTS...]
+
+It runs the command and appends a line of JSON to LOG, with the target, its
+prerequisites, the start and end times and the exit status. The script only
+depends on the standard library, so that it runs with any python.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import subprocess
+
+TIMING_LOG = "hdlmake_timing.jsonl"
+
+
+def run_timed(argv):
+    """Run the command given in argv and log its timing. Return the exit
+    status of the command."""
+    if len(argv) < 6 or argv[4] != "--":
+        sys.stderr.write("usage: %s LOG TARGET PREREQUISITES -- COMMAND [ARGUMENTS...]\n" % argv[0])
+        return 2
+    log, target, prerequisites = argv[1:4]
+    command = argv[5:]
+    start = time.time()
+    try:
+        status = subprocess.call(command)
+    except OSError as e:
+        sys.stderr.write("%s: %s\n" % (command[0], e))
+        status = 127
+    record = {"target": target,
+              "deps": prerequisites.split(),
+              "start": start,
+              "end": time.time(),
+              "status": status}
+    # a single write on a file opened for appending: the lines written by
+    # parallel jobs don't mix
+    fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record, sort_keys=True) + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+    return status
+
+
+def get_shim_command():
+    """Return the command prefix running a compile command through this file,
+    the default of the HDLMAKE_TIMING variable of the makefiles"""
+    return "python %s" % os.path.abspath(__file__).replace(".pyc", ".py")
+
+
+def read_log(path):
+    """Return the last record of every target found in the log"""
+    records = {}
+    with open(path) as log:
+        for line in log:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut by an interrupted build
+            records[record["target"]] = record
+    return records
+
+
+def _library(target):
+    return target.split("/", 1)[0] if "/" in target else ""
+
+
+def get_critical_path(records):
+    """Return the longest chain of targets, weighted by their durations, as a
+    list of targets starting with the first one built"""
+    deps = dict((t, [d for d in r["deps"] if d in records and d != t]) for t, r in records.items())
+    longest = {}
+    previous = {}
+
+    def visit(target, visiting):
+        if target in longest:
+            return longest[target]
+        visiting.add(target)
+        best, best_dep = 0.0, None
+        for dep in deps[target]:
+            if dep in visiting:
+                continue  # circular prerequisites
+            length = visit(dep, visiting)
+            if length > best:
+                best, best_dep = length, dep
+        visiting.discard(target)
+        longest[target] = best + records[target]["end"] - records[target]["start"]
+        previous[target] = best_dep
+        return longest[target]
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 2 * len(records) + 100))
+    for target in sorted(records):
+        visit(target, set())
+    if not longest:
+        return []
+    target = max(sorted(longest), key=lambda t: longest[t])
+    path = []
+    while target is not None:
+        path.append(target)
+        target = previous[target]
+    return list(reversed(path))
+
+
+def print_report(path, top=20):
+    """Print the time spent per file and per library, the critical path and
+    the parallelism achieved by the build logged in path"""
+    if not os.path.isfile(path):
+        print("No timing log found at %s: generate the makefile with --profile and run make" % path,
+              file=sys.stderr)
+        sys.exit(1)
+    records = read_log(path)
+    if not records:
+        print("The timing log %s is empty" % path, file=sys.stderr)
+        sys.exit(1)
+    durations = dict((t, r["end"] - r["start"]) for t, r in records.items())
+    total = sum(durations.values())
+    wall = max(r["end"] for r in records.values()) - min(r["start"] for r in records.values())
+
+    print("Slowest targets:")
+    for target in sorted(durations, key=lambda t: (-durations[t], t))[:top]:
+        status = "" if records[target]["status"] == 0 else "  (failed: %d)" % records[target]["status"]
+        print("  %10.2f s  %s%s" % (durations[target], target, status))
+    print()
+
+    libraries = {}
+    for target, duration in durations.items():
+        count, time_sum = libraries.get(_library(target), (0, 0.0))
+        libraries[_library(target)] = (count + 1, time_sum + duration)
+    print("Libraries:")
+    for library in sorted(libraries, key=lambda l: (-libraries[l][1], l)):
+        count, time_sum = libraries[library]
+        print("  %10.2f s  %-24s %d targets" % (time_sum, library or ".", count))
+    print()
+
+    critical_path = get_critical_path(records)
+    critical_time = sum(durations[t] for t in critical_path)
+    print("Critical path (%.2f s):" % critical_time)
+    for target in critical_path:
+        print("  %10.2f s  %s" % (durations[target], target))
+    print()
+
+    print("Compile time:  %10.2f s in %d targets" % (total, len(records)))
+    print("Wall time:     %10.2f s" % wall)
+    if wall > 0 and critical_time > 0:
+        print("Parallelism:   %10.2f achieved, %.2f at most" % (total / wall, total / critical_time))
+
+
+if __name__ == "__main__":
+    sys.exit(run_timed(sys.argv))
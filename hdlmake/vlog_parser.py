@@ -62,7 +62,7 @@ class VerilogPreprocessor(object):
         def flip(self):
             self.push(not self.pop())
 
-    def __init__(self):
+    def __init__(self, include_cache=None):
         self.vpp_stack = self.VL_Stack()
         self.vlog_file = None
         # List of `include search paths
@@ -71,6 +71,9 @@ class VerilogPreprocessor(object):
         self.vpp_macros = []
         # Dictionary of files sub-included by each file parsed
         self.vpp_filedeps = {}
+        # Content of the included files by path, can be shared by several
+        # preprocessors so that a header is only read once
+        self.include_cache = include_cache if include_cache is not None else {}
 
 
     def _find_macro(self, name):
@@ -188,7 +191,7 @@ class VerilogPreprocessor(object):
                 if matches["include"]:
                     included_file_path = self._search_include(last.group(1), os.path.dirname(file_name))
                     logging.debug("File being parsed %s (library %s) includes %s" % (file_name, library, included_file_path))
-                    line = self._preprocess_file(file_content=open(included_file_path, "r").read(),
+                    line = self._preprocess_file(file_content=self._read_include(included_file_path),
                                                  file_name=included_file_path, library=library)
                     self.vpp_filedeps[file_name + library].append(included_file_path)
                     # add the whole include chain to the dependencies of the currently parsed file
@@ -221,6 +224,12 @@ class VerilogPreprocessor(object):
             if n_expansions == 0:
                 return new_buf
 
+    def _read_include(self, path):
+        if path not in self.include_cache:
+            with open(path, "r") as include_file:
+                self.include_cache[path] = include_file.read()
+        return self.include_cache[path]
+
     def _define(self, name, expansion):
         mdef = self.VL_Define(name, [], expansion)
         self.vpp_macros.append(mdef)
@@ -546,7 +555,8 @@ class VerilogParser(DepParser):
         try:
             includes = self.preprocessor.vpp_filedeps[dep_file.path + dep_file.library]
             for f in includes:
-                dep_file.depends_on.add(SourceFileFactory().new(path=f, module=dep_file.module))
+                dep_file.included_files.add(SourceFileFactory().new(path=f, module=dep_file.module))
+            dep_file.depends_on.update(dep_file.included_files)
             logging.debug( "%s has %d includes." % (str(dep_file), len(includes)))
         except KeyError:
             logging.debug(str(dep_file) + " has no includes.")
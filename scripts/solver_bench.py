@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the dependency solver on a generated design.
+
+Writes a VHDL design of the given number of files in a temporary directory:
+every file uses a few packages and instantiates a few entities of the other
+files. The files are parsed once, then the dependencies are solved several
+times and the median time of the solver alone is reported.
+
+    python scripts/solver_bench.py --files 2000 --runs 5
+"""
+
+from __future__ import print_function
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "hdlmake"))
+
+import fetch
+from module import Module
+from srcfile import SourceFileFactory, SourceFileSet
+import new_dep_solver as dep_solver
+
+PACKAGES = 20
+
+VHDL_ENTITY = """library ieee;
+use ieee.std_logic_1164.all;
+%(uses)s
+
+entity ent_%(index)d is
+  port (clk : in std_logic);
+end ent_%(index)d;
+
+architecture rtl of ent_%(index)d is
+begin
+%(instances)s
+end rtl;
+"""
+
+VHDL_PACKAGE = """library ieee;
+use ieee.std_logic_1164.all;
+
+package pkg_%(index)d is
+end pkg_%(index)d;
+"""
+
+
+def write_design(directory, files, instances):
+    """Write the design and return the paths of its files"""
+    rand = random.Random(files)
+    paths = []
+    for index in range(PACKAGES):
+        paths.append(os.path.join(directory, "pkg_%d.vhd" % index))
+        with open(paths[-1], "w") as vhdl:
+            vhdl.write(VHDL_PACKAGE % {"index": index})
+    for index in range(files - PACKAGES):
+        uses = '\n'.join("use work.pkg_%d.all;" % p for p in rand.sample(range(PACKAGES), 3))
+        children = [rand.randrange(files - PACKAGES) for _ in range(instances)]
+        paths.append(os.path.join(directory, "ent_%d.vhd" % index))
+        with open(paths[-1], "w") as vhdl:
+            vhdl.write(VHDL_ENTITY % {
+                "index": index,
+                "uses": uses,
+                "instances": '\n'.join("  u%d: entity work.ent_%d port map (clk => clk);" % (n, child)
+                                       for n, child in enumerate(children))})
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hdlmake dependency solver benchmark")
+    parser.add_argument("--files", type=int, default=1000,
+                        help="number of files of the design")
+    parser.add_argument("--instances", type=int, default=4,
+                        help="number of instances in every file")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="number of runs of the solver")
+    options = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    directory = tempfile.mkdtemp(prefix="hdlmake-bench-")
+    try:
+        paths = write_design(directory, options.files, options.instances)
+        module = Module(parent=None, url=directory, source=fetch.LOCAL, fetchto=directory, pool=None)
+        module.include_dirs = []
+        sff = SourceFileFactory()
+        fileset = SourceFileSet()
+        for path in paths:
+            fileset.add(sff.new(path=path, module=module))
+
+        start = time.time()
+        for source_file in fileset:
+            source_file.rels
+        parse_time = (time.time() - start) * 1000.0
+
+        samples = []
+        for _ in range(options.runs):
+            for source_file in fileset:
+                source_file.depends_on = set()
+            start = time.time()
+            dep_solver.solve(fileset, tool_objects=[])
+            samples.append((time.time() - start) * 1000.0)
+        samples.sort()
+        print("files %d, relations %d" % (len(fileset), sum(len(f.rels) for f in fileset)))
+        print("%-8s %10.1f ms" % ("parse", parse_time))
+        print("%-8s %10.1f ms" % ("solve", samples[len(samples) // 2]))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the start-up time of hdlmake.
+
+Runs a few cheap commands several times in the current directory and
+reports the median wall-clock time of each one. The script exits with a
+non-zero status when ``manifest-help`` is slower than the given target,
+so it can be used to catch start-up regressions.
+
+    cd tests/counter/sim/modelsim/vhdl
+    python ../../../../../scripts/startup_bench.py --runs 20
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HDLMAKE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "..", "hdlmake")
+
+
+def _time_command(args, runs):
+    samples = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.call([sys.executable, HDLMAKE] + args,
+                            stdout=devnull, stderr=devnull)
+            samples.append((time.time() - start) * 1000.0)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hdlmake start-up benchmark")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="number of runs for each command")
+    parser.add_argument("--target", type=float, default=100.0,
+                        help="maximum median time for manifest-help, in ms")
+    parser.add_argument("commands", nargs="*",
+                        default=["manifest-help", "list-mods", "list-files"],
+                        help="hdlmake commands to be measured")
+    options = parser.parse_args()
+
+    failed = False
+    for command in options.commands:
+        median = _time_command(command.split(), options.runs)
+        status = ""
+        if command == "manifest-help" and median > options.target:
+            status = "  (above target of %.0f ms)" % options.target
+            failed = True
+        print("%-16s %8.1f ms%s" % (command, median, status))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()